@@ -0,0 +1,274 @@
+"""
+Admission control for incoming requests.
+
+Every request is put in a lane by method and path:
+
+- "system": /health, /ready, /metrics and CORS preflights; always admitted
+- "crew":   crew runs and batches, the expensive lane
+- "trace":  frontend trace events
+- "default": everything else (job status, event streams, images, stats)
+
+Each lane has its own token bucket per client and its own pool of in-flight
+slots with a short FIFO wait queue, so a burst of crew runs can't take the
+slots cheap requests need. The crew
+lane is also shed while the job queue is deep or the machine is low on
+memory. Rejections are 429s with Retry-After. Limits are per worker process.
+
+Clients are identified by something they can't rotate at will: an API key
+listed in ADMISSION_API_KEYS, else the address Fly's edge puts in
+Fly-Client-IP (only trusted when running on Fly), else the peer address.
+Unknown keys and X-Forwarded-For are ignored.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from metrics import ADMISSION_REQUESTS
+
+ADMISSION = os.getenv("ADMISSION", "1") == "1"
+# Requests per second and burst size per client, per lane
+ADMISSION_CREW_RATE = float(os.getenv("ADMISSION_CREW_RATE", str(10 / 60)))
+ADMISSION_CREW_BURST = float(os.getenv("ADMISSION_CREW_BURST", "5"))
+ADMISSION_TRACE_RATE = float(os.getenv("ADMISSION_TRACE_RATE", "20"))
+ADMISSION_TRACE_BURST = float(os.getenv("ADMISSION_TRACE_BURST", "50"))
+ADMISSION_DEFAULT_RATE = float(os.getenv("ADMISSION_DEFAULT_RATE", "20"))
+ADMISSION_DEFAULT_BURST = float(os.getenv("ADMISSION_DEFAULT_BURST", "40"))
+# In-flight requests per lane, and how many more may wait (up to ADMISSION_QUEUE_TIMEOUT) for a slot
+ADMISSION_CREW_CONCURRENCY = int(os.getenv("ADMISSION_CREW_CONCURRENCY", "8"))
+ADMISSION_CREW_QUEUE = int(os.getenv("ADMISSION_CREW_QUEUE", "8"))
+ADMISSION_TRACE_CONCURRENCY = int(os.getenv("ADMISSION_TRACE_CONCURRENCY", "32"))
+ADMISSION_TRACE_QUEUE = int(os.getenv("ADMISSION_TRACE_QUEUE", "64"))
+ADMISSION_DEFAULT_CONCURRENCY = int(os.getenv("ADMISSION_DEFAULT_CONCURRENCY", "64"))
+ADMISSION_DEFAULT_QUEUE = int(os.getenv("ADMISSION_DEFAULT_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# Shed crew runs once this many jobs are waiting or available memory drops below this
+ADMISSION_MAX_JOB_QUEUE = int(os.getenv("ADMISSION_MAX_JOB_QUEUE", "12"))
+ADMISSION_MIN_FREE_MB = int(os.getenv("ADMISSION_MIN_FREE_MB", "150"))
+ADMISSION_SHED_RETRY_AFTER = int(os.getenv("ADMISSION_SHED_RETRY_AFTER", "10"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+# Comma-separated API keys that get their own buckets (sent as X-API-Key or "Authorization: Bearer <key>")
+ADMISSION_API_KEYS = {key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()}
+# Fly's proxy sets Fly-Client-IP itself; anywhere else the header comes straight from the client
+BEHIND_FLY_PROXY = bool(os.getenv("FLY_APP_NAME"))
+
+CREW_PATHS = {("POST", "/run-crew"), ("POST", "/run-crew/stream"), ("POST", "/jobs"), ("POST", "/batch")}
+SYSTEM_PATHS = {"/health", "/ready", "/metrics"}
+
+
+class Rejected(Exception):
+    """Request refused by admission control"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Lane:
+    def __init__(self, name, rate, burst, concurrency, queue_size):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.buckets = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self.active = 0
+        self.waiters = deque()
+
+    def check_rate(self, client):
+        bucket = self.buckets.pop(client, None) or TokenBucket(self.rate, self.burst)
+        self.buckets[client] = bucket
+        while len(self.buckets) > ADMISSION_MAX_CLIENTS:
+            self.buckets.popitem(last=False)
+        wait = bucket.take()
+        if wait:
+            raise Rejected("rate_limited", wait)
+
+    async def acquire(self):
+        """Take an in-flight slot, waiting in FIFO order for up to ADMISSION_QUEUE_TIMEOUT"""
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            raise Rejected("queue_full", 1)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # The slot was handed over just as the wait timed out
+                return
+            self.waiters.remove(waiter)
+            waiter.cancel()
+            raise Rejected("queue_timeout", ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            # Client disconnected or server shutting down while queued: don't strand the slot
+            if waiter.done():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+                waiter.cancel()
+            raise
+
+    def release(self):
+        """Hand the slot to the next waiter, or free it"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo (shared by all workers on the machine), or None"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class AdmissionController:
+    def __init__(self, queue_depth=lambda: 0):
+        self.queue_depth = queue_depth
+        self.lanes = {
+            "crew": Lane("crew", ADMISSION_CREW_RATE, ADMISSION_CREW_BURST, ADMISSION_CREW_CONCURRENCY, ADMISSION_CREW_QUEUE),
+            "trace": Lane("trace", ADMISSION_TRACE_RATE, ADMISSION_TRACE_BURST, ADMISSION_TRACE_CONCURRENCY, ADMISSION_TRACE_QUEUE),
+            "default": Lane(
+                "default", ADMISSION_DEFAULT_RATE, ADMISSION_DEFAULT_BURST, ADMISSION_DEFAULT_CONCURRENCY, ADMISSION_DEFAULT_QUEUE
+            ),
+        }
+        self.memory_checked_at = 0.0
+        self.memory_mb = None
+
+    @staticmethod
+    def lane_for(method, path):
+        if method == "OPTIONS" or path in SYSTEM_PATHS:
+            return "system"
+        if (method, path) in CREW_PATHS:
+            return "crew"
+        if method == "POST" and path == "/trace":
+            return "trace"
+        return "default"
+
+    @staticmethod
+    def client_for(scope):
+        headers = dict(scope.get("headers") or [])
+        api_key = headers.get(b"x-api-key", b"").decode("latin-1").strip()
+        if not api_key:
+            scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+            api_key = token.strip() if scheme.lower() == "bearer" else ""
+        if api_key in ADMISSION_API_KEYS:
+            # Hashed so stats and memory never hold the key itself
+            return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        # Behind Fly's proxy the peer is the proxy; the edge passes the real address along
+        if BEHIND_FLY_PROXY and headers.get(b"fly-client-ip"):
+            return "ip:" + headers[b"fly-client-ip"].decode("latin-1").strip()
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    def check_load(self):
+        """Shed expensive work while the job queue is deep or memory is short"""
+        depth = self.queue_depth()
+        if depth >= ADMISSION_MAX_JOB_QUEUE:
+            raise Rejected("shed_queue_depth", ADMISSION_SHED_RETRY_AFTER)
+        now = time.monotonic()
+        if now - self.memory_checked_at >= 1:
+            self.memory_checked_at = now
+            self.memory_mb = available_memory_mb()
+        if self.memory_mb is not None and self.memory_mb < ADMISSION_MIN_FREE_MB:
+            raise Rejected("shed_memory", ADMISSION_SHED_RETRY_AFTER)
+
+    async def admit(self, lane_name, client):
+        """Return the lane holding a slot for this request; raises Rejected"""
+        lane = self.lanes[lane_name]
+        lane.check_rate(client)
+        if lane_name == "crew":
+            self.check_load()
+        await lane.acquire()
+        return lane
+
+    def stats(self):
+        return {
+            "enabled": ADMISSION,
+            "available_memory_mb": self.memory_mb,
+            "lanes": {
+                name: {
+                    "active": lane.active,
+                    "waiting": len(lane.waiters),
+                    "concurrency": lane.concurrency,
+                    "rate_per_s": round(lane.rate, 4),
+                    "burst": lane.burst,
+                    "clients": len(lane.buckets),
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to every HTTP request"""
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION:
+            await self.app(scope, receive, send)
+            return
+        lane_name = self.controller.lane_for(scope["method"], scope["path"])
+        if lane_name == "system":
+            await self.app(scope, receive, send)
+            return
+        try:
+            lane = await self.controller.admit(lane_name, self.controller.client_for(scope))
+        except Rejected as e:
+            ADMISSION_REQUESTS.inc(lane=lane_name, outcome=e.reason)
+            await self.reject(send, e)
+            return
+        ADMISSION_REQUESTS.inc(lane=lane_name, outcome="admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+
+    @staticmethod
+    async def reject(send, error):
+        body = json.dumps({"detail": "Too many requests", "reason": error.reason}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(error.retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
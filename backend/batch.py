@@ -0,0 +1,110 @@
+"""
+Batch QR art generation.
+
+Variants of the same (prompt, payload) are packed into multi-output
+predictions, and independent predictions run concurrently through the
+prediction manager. The concurrency cap and the minimum spacing between
+creations are shared by every /batch request in the process, so concurrent
+batches queue for the same slots instead of each adding their own.
+Predictions are retried under replicate_policy and their images go through
+the image store and scan verification, like a crew run's. Results are
+yielded as each prediction completes.
+"""
+import asyncio
+import os
+import time
+from predictions import prediction_manager
+from qr_gen_replicate import (
+    build_prediction_input, cached_images, image_cache_key, replicate_policy, store_outputs, verify_output,
+    QR_DETERMINISTIC, QR_SEED, UNVERIFIED,
+)
+from qr_verify import verification_enabled
+
+BATCH_MAX_OUTPUTS = int(os.getenv("BATCH_MAX_OUTPUTS", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_CREATE_INTERVAL = float(os.getenv("BATCH_CREATE_INTERVAL", "0.25"))
+
+# Shared by all batches in this worker process
+batch_slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+pacing_lock = asyncio.Lock()
+last_create = [0.0]
+
+
+def plan_predictions(items):
+    """Split each item's variants into predictions of at most BATCH_MAX_OUTPUTS outputs"""
+    plan = []
+    for item_index, item in enumerate(items):
+        remaining = item["variants"]
+        chunk_index = 0
+        while remaining > 0:
+            num_outputs = min(remaining, BATCH_MAX_OUTPUTS)
+            # Each chunk needs its own seed, otherwise pinned seeds repeat the same images
+            seed = QR_SEED + chunk_index * BATCH_MAX_OUTPUTS if QR_DETERMINISTIC else -1
+            plan.append({
+                "item_index": item_index,
+                "chunk_index": chunk_index,
+                "input": build_prediction_input(
+                    item["prompt"], item["qr_code_content"], seed=seed, num_outputs=num_outputs
+                ),
+            })
+            remaining -= num_outputs
+            chunk_index += 1
+    return plan
+
+
+async def generate_images(prediction_input):
+    """Stored images for one planned prediction: from the image store, or a new prediction"""
+    cache_key = image_cache_key(prediction_input)
+    images = await asyncio.to_thread(cached_images, cache_key)
+    if images:
+        return images
+    # Cancelling this coroutine cancels the prediction on Replicate
+    output = await prediction_manager.generate(prediction_input, policy=replicate_policy)
+    return await asyncio.to_thread(store_outputs, output, cache_key)
+
+
+async def verify_images(images, qr_code_content):
+    """Scan report per image; decoding is CPU-bound, so it runs off the event loop"""
+    if not verification_enabled():
+        return [UNVERIFIED for _ in images]
+    return await asyncio.to_thread(lambda: [verify_output(image, qr_code_content) for image in images])
+
+
+async def run_batch(items):
+    """Async generator of per-prediction results, in completion order"""
+    plan = plan_predictions(items)
+
+    async def run_one(entry):
+        async with batch_slots:
+            async with pacing_lock:
+                wait = last_create[0] + BATCH_CREATE_INTERVAL - time.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                last_create[0] = time.time()
+            start_time = time.time()
+            result = {
+                "item_index": entry["item_index"],
+                "chunk_index": entry["chunk_index"],
+                "prompt": entry["input"]["prompt"],
+                "qr_code_content": entry["input"]["qr_code_content"],
+                "outputs": [],
+                "verification": [],
+                "error": None,
+            }
+            try:
+                images = await generate_images(entry["input"])
+                result["outputs"] = [image["url"] for image in images]
+                result["verification"] = await verify_images(images, entry["input"]["qr_code_content"])
+            except Exception as e:
+                result["error"] = str(e)
+            result["elapsed_ms"] = round((time.time() - start_time) * 1000)
+            return result
+
+    tasks = [asyncio.create_task(run_one(entry)) for entry in plan]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client disconnected or batch aborted: cancel whatever is still queued or running
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for Exa, Browserbase, W&B inference and Replicate.
+
+Each service has configurable latency, jitter and failure rate so the real
+backend can be benchmarked without API credits:
+
+    uvicorn bench.fake_services:app --port 9100
+
+Point the backend at it with EXA_BASE_URL=http://127.0.0.1:9100/exa,
+BROWSERBASE_BASE_URL=.../browserbase, WANDB_INFERENCE_BASE_URL=.../inference/v1
+and REPLICATE_BASE_URL=.../replicate (run_bench.py does this for you).
+Profiles are read from FAKE_<SERVICE>_LATENCY / _JITTER / _FAILURE_RATE
+(seconds, seconds, 0-1) and FAKE_SEED.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import time
+import uuid
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+SERVICES = ("exa", "browserbase", "inference", "replicate")
+DEFAULT_LATENCY = {"exa": 0.4, "browserbase": 0.8, "inference": 0.6, "replicate": 3.0}
+
+rng = random.Random(int(os.getenv("FAKE_SEED", "42")))
+
+profiles = {
+    name: {
+        "latency": float(os.getenv(f"FAKE_{name.upper()}_LATENCY", DEFAULT_LATENCY[name])),
+        "jitter": float(os.getenv(f"FAKE_{name.upper()}_JITTER", "0.1")),
+        "failure_rate": float(os.getenv(f"FAKE_{name.upper()}_FAILURE_RATE", "0")),
+    }
+    for name in SERVICES
+}
+
+# 1x1 transparent PNG, served when zxing-cpp is not installed to render a real code
+PNG_BYTES = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+PAGE_TEXT = (
+    "Our brand is modern, bold and innovative with a clean, minimal layout. "
+    "The palette mixes #1a73e8, #ff6b6b and #4ecdc4 with subtle gradient depth. "
+) * 20
+
+app = FastAPI()
+predictions = {}
+
+
+def sample_latency(service):
+    profile = profiles[service]
+    return max(0.0, rng.gauss(profile["latency"], profile["jitter"]))
+
+
+async def simulate(service, fraction=1.0):
+    """Sleep for fraction of the service's latency, then maybe fail; returns the full sampled latency"""
+    latency = sample_latency(service)
+    await asyncio.sleep(latency * fraction)
+    if rng.random() < profiles[service]["failure_rate"]:
+        raise HTTPException(status_code=503, detail=f"fake {service} failure")
+    return latency
+
+
+@app.get("/profiles")
+def get_profiles():
+    return profiles
+
+
+@app.post("/exa/search")
+async def exa_search(request: Request):
+    body = await request.json()
+    await simulate("exa")
+    base = str(request.base_url).rstrip("/")
+    slug = "-".join(body.get("query", "brand").lower().split())
+    return {"results": [{"url": f"{base}/sites/{slug}/{i}"} for i in range(body.get("numResults", 3))]}
+
+
+@app.post("/browserbase/scrape")
+async def browserbase_scrape(request: Request):
+    body = await request.json()
+    await simulate("browserbase")
+    return {"text": f"{body.get('url')}\n{PAGE_TEXT}"}
+
+
+@app.post("/inference/v1/completions")
+async def completions(request: Request):
+    body = await request.json()
+    text = "minimal, bold, gradient, logo, 64k\nA modern brand with a bold, innovative identity."
+    prompt_tokens = len(str(body.get("prompt", "")).split())
+    if body.get("stream"):
+        # A quarter of the latency goes to the first token (prefill), the rest is spread over the others
+        latency = await simulate("inference", fraction=0.25)
+        return StreamingResponse(stream_completion(body, text, prompt_tokens, latency * 0.75), media_type="text/event-stream")
+    await simulate("inference")
+    return {
+        "id": f"cmpl-{uuid.uuid4().hex[:12]}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "text": text, "finish_reason": "stop", "logprobs": None}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+    }
+
+
+async def stream_completion(body, text, prompt_tokens, decode_seconds):
+    """OpenAI-style SSE completion, one word per chunk"""
+    tokens = re.findall(r"[^ \n]+ ?|\n", text)
+    base = {"id": f"cmpl-{uuid.uuid4().hex[:12]}", "object": "text_completion", "created": int(time.time()), "model": body.get("model", "fake")}
+    for index, token in enumerate(tokens):
+        if index:
+            await asyncio.sleep(decode_seconds / (len(tokens) - 1))
+        chunk = {**base, "choices": [{"index": 0, "text": token, "finish_reason": None, "logprobs": None}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    if (body.get("stream_options") or {}).get("include_usage"):
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        yield f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def prediction_json(request, prediction):
+    elapsed = time.time() - prediction["created"]
+    status = prediction["status"]
+    if status not in ("canceled", "failed"):
+        if elapsed >= prediction["duration"]:
+            status = "failed" if prediction["fails"] else "succeeded"
+        elif elapsed >= min(0.5, prediction["duration"] / 4):
+            status = "processing"
+        else:
+            status = "starting"
+        prediction["status"] = status
+    base = str(request.base_url).rstrip("/")
+    output = None
+    if status == "succeeded":
+        output = [f"{base}/replicate/files/{prediction['id']}-{i}.png" for i in range(prediction["num_outputs"])]
+    return {
+        "id": prediction["id"],
+        "model": "fake/qr-code",
+        "version": "fake",
+        "status": status,
+        "input": prediction["input"],
+        "output": output,
+        "logs": "",
+        "error": "fake replicate failure" if status == "failed" else None,
+        "metrics": {},
+        "created_at": None,
+        "started_at": None,
+        "completed_at": None,
+        "urls": {},
+    }
+
+
+@app.get("/replicate/v1/deployments/{owner}/{name}")
+async def get_deployment(owner: str, name: str):
+    return {"owner": owner, "name": name, "current_release": None}
+
+
+@app.post("/replicate/v1/deployments/{owner}/{name}/predictions", status_code=201)
+async def create_prediction(owner: str, name: str, request: Request):
+    body = await request.json()
+    prediction_input = body.get("input", {})
+    prediction = {
+        "id": uuid.uuid4().hex[:20],
+        "created": time.time(),
+        "duration": sample_latency("replicate"),
+        "fails": rng.random() < profiles["replicate"]["failure_rate"],
+        "status": "starting",
+        "input": prediction_input,
+        "num_outputs": int(prediction_input.get("num_outputs", 1)),
+    }
+    predictions[prediction["id"]] = prediction
+    return prediction_json(request, prediction)
+
+
+@app.get("/replicate/v1/predictions/{prediction_id}")
+async def get_prediction(prediction_id: str, request: Request):
+    if prediction_id not in predictions:
+        raise HTTPException(status_code=404, detail="not found")
+    return prediction_json(request, predictions[prediction_id])
+
+
+@app.post("/replicate/v1/predictions/{prediction_id}/cancel")
+async def cancel_prediction(prediction_id: str, request: Request):
+    if prediction_id not in predictions:
+        raise HTTPException(status_code=404, detail="not found")
+    predictions[prediction_id]["status"] = "canceled"
+    return prediction_json(request, predictions[prediction_id])
+
+
+def render_qr(content):
+    """A plain, scannable QR for the payload when zxing-cpp is installed (exercises qr_verify)"""
+    try:
+        import io
+        import numpy
+        import zxingcpp
+        from PIL import Image
+
+        barcode = zxingcpp.create_barcode(content, zxingcpp.BarcodeFormat.QRCode)
+        image = Image.fromarray(numpy.array(zxingcpp.write_barcode_to_image(barcode, scale=16)))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    except Exception:
+        return PNG_BYTES
+
+
+@app.get("/replicate/files/{name}")
+async def get_file(name: str):
+    prediction = predictions.get(name.split("-")[0])
+    if prediction is None or not prediction["input"].get("qr_code_content"):
+        return Response(content=PNG_BYTES, media_type="image/png")
+    return Response(content=render_qr(prediction["input"]["qr_code_content"]), media_type="image/png")
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the backend.
+
+Starts bench/fake_services.py and the real FastAPI app (uvicorn main:app)
+pointed at it, drives concurrent load at /run-crew/stream and /trace, and
+reports per-stage and end-to-end p50/p95/p99, throughput and app memory.
+
+    cd backend
+    python -m bench.run_bench --requests 20 --concurrency 4
+    python -m bench.run_bench --save-baseline bench/baseline.json
+    python -m bench.run_bench --baseline bench/baseline.json   # exits 1 on regression
+
+Fake service latency is configured with FAKE_<SERVICE>_LATENCY/_JITTER/
+_FAILURE_RATE env vars (see fake_services.py); FAKE_SEED keeps runs repeatable.
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def wait_for(url, timeout=60):
+    """Poll url until it returns 200; returns seconds waited"""
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.time() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def start_process(module_app, port, env, workers=1):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module_app, "--port", str(port), "--log-level", "warning",
+         "--workers", str(workers)],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if not os.getenv("BENCH_VERBOSE") else None,
+        stderr=subprocess.DEVNULL if not os.getenv("BENCH_VERBOSE") else None,
+    )
+
+
+def process_tree(pid):
+    """pid and all of its descendants, from /proc/<pid>/task/*/children (Linux only)"""
+    pids = [pid]
+    for child_list in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(child_list) as f:
+                children = [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+        for child in children:
+            pids.extend(process_tree(child))
+    return pids
+
+
+def memory_kb(pid):
+    """
+    Current and peak RSS of a process and its children from /proc (Linux only).
+    With --app-workers > 1 the spawned pid is uvicorn's supervisor, so the
+    workers are summed in and also listed one by one.
+    """
+    processes = []
+    for process in process_tree(pid):
+        try:
+            with open(f"/proc/{process}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+            processes.append({
+                "pid": process,
+                "rss_kb": int(fields["VmRSS"].split()[0]),
+                "peak_rss_kb": int(fields["VmHWM"].split()[0]),
+            })
+        except (OSError, KeyError):
+            continue
+    if not processes:
+        return {"rss_kb": None, "peak_rss_kb": None}
+    memory = {
+        "rss_kb": sum(process["rss_kb"] for process in processes),
+        # Sum of each process's own peak; they need not have peaked at the same time
+        "peak_rss_kb": sum(process["peak_rss_kb"] for process in processes),
+    }
+    if len(processes) > 1:
+        memory["processes"] = processes
+    return memory
+
+
+def run_crew_once(app_url, topic, mode):
+    """One streamed crew run; returns (e2e seconds, {stage: ms}, error)"""
+    stages = {}
+    start = time.time()
+    try:
+        with requests.post(
+            f"{app_url}/run-crew/stream",
+            json={"topic": topic, "mode": mode},
+            stream=True,
+            timeout=(5, 300),
+        ) as resp:
+            resp.raise_for_status()
+            event_type = None
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event_type = line[7:]
+                elif line.startswith("data: "):
+                    data = json.loads(line[6:])
+                    if event_type == "stage" and data.get("status") == "completed" and "elapsed_ms" in data:
+                        stages[data["stage"]] = data["elapsed_ms"]
+                    elif event_type == "done":
+                        error = data.get("error") if data.get("status") != "completed" else None
+                        return time.time() - start, stages, error
+    except requests.RequestException as e:
+        return time.time() - start, stages, str(e)
+    return time.time() - start, stages, "stream ended without done event"
+
+
+def run_trace_once(app_url, batch_size):
+    events = [{"agent": "bench", "message": f"event {i}", "type": "info"} for i in range(batch_size)]
+    start = time.time()
+    try:
+        resp = requests.post(f"{app_url}/trace", json=events, timeout=10)
+        error = None if resp.status_code < 400 else f"HTTP {resp.status_code}"
+    except requests.RequestException as e:
+        error = str(e)
+    return time.time() - start, error
+
+
+def run_load(fn, jobs, concurrency):
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda args: fn(*args), jobs))
+    return results, time.time() - start
+
+
+def run_benchmark(args):
+    cache_dir = tempfile.mkdtemp(prefix="bench-cache-")
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    env = dict(os.environ)
+    fake = start_process("bench.fake_services:app", args.fake_port, env)
+    app = None
+    try:
+        wait_for(f"{fake_url}/profiles")
+        env.update({
+            "EXA_BASE_URL": f"{fake_url}/exa",
+            "BROWSERBASE_BASE_URL": f"{fake_url}/browserbase",
+            "WANDB_INFERENCE_BASE_URL": f"{fake_url}/inference/v1",
+            "REPLICATE_BASE_URL": f"{fake_url}/replicate",
+            "WANDB_API_KEY": env.get("BENCH_WANDB_API_KEY", "bench-fake-key"),
+            "REPLICATE_API_TOKEN": "bench-fake-token",
+            "WANDB_MODE": "disabled",
+            "WEAVE_DISABLED": "true",
+            "CACHE_DIR": cache_dir,
+            "PIPELINE_MODE": args.mode,
+            "WEB_CONCURRENCY": str(args.app_workers),
+            "REPLICATE_POLL_MIN": "0.1",
+            "REPLICATE_POLL_MAX": "0.5",
+            # All load comes from one client; measure the pipeline, not the per-client rate limit
+            "ADMISSION_CREW_RATE": env.get("ADMISSION_CREW_RATE", "1000"),
+            "ADMISSION_CREW_BURST": env.get("ADMISSION_CREW_BURST", "1000"),
+        })
+        app_start = time.time()
+        app = start_process("main:app", args.app_port, env, workers=args.app_workers)
+        time_to_first_200 = wait_for(f"{app_url}/health")
+        startup = {"time_to_first_200_s": round(time.time() - app_start, 3), "health_wait_s": round(time_to_first_200, 3)}
+        # Drive load only once W&B and the crew runtime are up, so warm-up isn't counted as latency
+        wait_for(f"{app_url}/ready", timeout=120)
+        startup["time_to_ready_s"] = round(time.time() - app_start, 3)
+
+        topics = [f"Bench Brand {i % args.topics}" for i in range(args.requests)]
+        crew_results, crew_elapsed = run_load(
+            run_crew_once, [(app_url, topic, args.mode) for topic in topics], args.concurrency
+        )
+        trace_results, trace_elapsed = run_load(
+            run_trace_once, [(app_url, args.trace_batch)] * args.trace_requests, args.trace_concurrency
+        )
+        memory = memory_kb(app.pid)
+    finally:
+        for proc in (app, fake):
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    stage_values = {}
+    for _, stages, error in crew_results:
+        if error is None:
+            for name, ms in stages.items():
+                stage_values.setdefault(name, []).append(ms)
+    crew_ok = [e2e * 1000 for e2e, _, error in crew_results if error is None]
+    trace_ok = [latency * 1000 for latency, error in trace_results if error is None]
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "topics": args.topics,
+            "mode": args.mode,
+            "app_workers": args.app_workers,
+            "trace_requests": args.trace_requests,
+            "trace_batch": args.trace_batch,
+            "trace_concurrency": args.trace_concurrency,
+        },
+        "startup": startup,
+        "run_crew": {
+            "e2e_ms": summarize(crew_ok),
+            "errors": len(crew_results) - len(crew_ok),
+            "throughput_rps": round(len(crew_ok) / crew_elapsed, 3) if crew_elapsed else None,
+            "stages_ms": {name: summarize(values) for name, values in sorted(stage_values.items())},
+        },
+        "trace": {
+            "latency_ms": summarize(trace_ok),
+            "errors": len(trace_results) - len(trace_ok),
+            "throughput_events_per_s": round(len(trace_ok) * args.trace_batch / trace_elapsed, 1) if trace_elapsed else None,
+        },
+        "memory": memory,
+    }
+
+
+def print_report(report):
+    def row(name, stats):
+        cells = [f"{stats[k]:.0f}" if stats[k] is not None else "-" for k in ("p50", "p95", "p99")]
+        print(f"  {name:<24} n={stats['count']:<5} p50={cells[0]:>7}  p95={cells[1]:>7}  p99={cells[2]:>7} ms")
+
+    print("📊 Benchmark report")
+    print(f"  startup: {report['startup']}")
+    crew = report["run_crew"]
+    print(f"  run-crew: {crew['throughput_rps']} runs/s, {crew['errors']} errors")
+    row("end-to-end", crew["e2e_ms"])
+    for name, stats in crew["stages_ms"].items():
+        row(name, stats)
+    trace = report["trace"]
+    print(f"  trace: {trace['throughput_events_per_s']} events/s, {trace['errors']} errors")
+    row("trace request", trace["latency_ms"])
+    print(f"  memory: {report['memory']}")
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Return a list of p95 regressions beyond tolerance"""
+    regressions = []
+    checks = [("run_crew e2e", report["run_crew"]["e2e_ms"], baseline["run_crew"]["e2e_ms"]),
+              ("trace", report["trace"]["latency_ms"], baseline["trace"]["latency_ms"])]
+    for name, stats in report["run_crew"]["stages_ms"].items():
+        if name in baseline["run_crew"]["stages_ms"]:
+            checks.append((f"stage {name}", stats, baseline["run_crew"]["stages_ms"][name]))
+    for name, current, base in checks:
+        if current["p95"] is None or not base.get("p95"):
+            continue
+        if current["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95']:.0f}ms vs baseline {base['p95']:.0f}ms")
+    if report["run_crew"]["errors"] > baseline["run_crew"]["errors"]:
+        regressions.append(f"run_crew errors: {report['run_crew']['errors']} vs baseline {baseline['run_crew']['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20, help="crew runs to issue")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent crew runs")
+    parser.add_argument("--topics", type=int, default=5, help="distinct brand names (repeats exercise caches)")
+    parser.add_argument("--mode", default="direct", choices=["crew", "direct", "hybrid"])
+    parser.add_argument("--trace-requests", type=int, default=200)
+    parser.add_argument("--trace-batch", type=int, default=10, help="events per /trace request")
+    parser.add_argument("--trace-concurrency", type=int, default=16)
+    parser.add_argument("--app-workers", type=int, default=1, help="uvicorn worker processes (shared SQLite job state when > 1)")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--app-port", type=int, default=9200)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="fail if p95 regresses against this report")
+    parser.add_argument("--save-baseline", help="write the report as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Report written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
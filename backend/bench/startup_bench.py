@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the backend.
+
+For each run it measures, in fresh processes:
+
+- import time of main (python -X importtime), plus the slowest modules main imports
+- time from launching uvicorn to the first 200 from /health (liveness)
+- time from launching uvicorn to the first 200 from /ready (W&B and crew runtime initialized)
+
+and fails if the median time to first 200 exceeds --max-first-200.
+
+    cd backend
+    python -m bench.startup_bench
+    python -m bench.startup_bench --runs 5 --fast-start 0   # initialize before serving, for comparison
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from bench.run_bench import BACKEND_DIR, start_process, wait_for
+
+
+def bench_env(fast_start):
+    env = dict(os.environ)
+    env.update({
+        "WANDB_API_KEY": env.get("BENCH_WANDB_API_KEY", "bench-fake-key"),
+        "WANDB_MODE": "disabled",
+        "WEAVE_DISABLED": "true",
+        "CACHE_DIR": tempfile.mkdtemp(prefix="bench-startup-"),
+        "FAST_START": fast_start,
+    })
+    return env
+
+
+def import_times(env, top):
+    """Import time of main and of its slowest direct imports (cumulative), from -X importtime"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0
+    direct = children = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Names are indented two spaces per nesting level, and a module is listed after its imports
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == "main":
+                total, direct = int(cumulative), children
+            children = {}
+    slowest = sorted(direct.items(), key=lambda item: -item[1])[:top]
+    return total / 1e6, {name: round(us / 1e6, 3) for name, us in slowest}
+
+
+def time_to_ready(env, port, timeout):
+    """Seconds from launching uvicorn to the first 200 from /health and from /ready"""
+    app_url = f"http://127.0.0.1:{port}"
+    start = time.time()
+    app = start_process("main:app", port, env)
+    try:
+        wait_for(f"{app_url}/health", timeout)
+        first_200 = time.time() - start
+        wait_for(f"{app_url}/ready", timeout)
+        ready = time.time() - start
+    finally:
+        app.terminate()
+        try:
+            app.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app.kill()
+    return first_200, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--fast-start", default="1", choices=["0", "1"], help="FAST_START for the app")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports of main to report")
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--max-first-200", type=float, default=5.0, help="fail above this median (seconds)")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    env = bench_env(args.fast_start)
+    imports, first_200s, readies = [], [], []
+    slowest = {}
+    for run in range(args.runs):
+        import_s, slowest = import_times(env, args.top)
+        first_200, ready = time_to_ready(env, args.port, args.timeout)
+        imports.append(import_s)
+        first_200s.append(first_200)
+        readies.append(ready)
+        print(f"  run {run + 1}: import main {import_s:.2f}s, first 200 {first_200:.2f}s, ready {ready:.2f}s")
+
+    report = {
+        "config": {"runs": args.runs, "fast_start": args.fast_start},
+        "import_main_s": round(statistics.median(imports), 3),
+        "time_to_first_200_s": round(statistics.median(first_200s), 3),
+        "time_to_ready_s": round(statistics.median(readies), 3),
+        "slowest_imports_s": slowest,
+    }
+    print("📊 Startup report (medians)")
+    print(f"  import main        {report['import_main_s']:.2f}s")
+    print(f"  time to first 200  {report['time_to_first_200_s']:.2f}s")
+    print(f"  time to ready      {report['time_to_ready_s']:.2f}s")
+    print("  slowest imports of main:")
+    for name, seconds in slowest.items():
+        print(f"    {name:<28} {seconds:.3f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {args.json}")
+    if report["time_to_first_200_s"] > args.max_first_200:
+        print(f"❌ Time to first 200 {report['time_to_first_200_s']:.2f}s exceeds {args.max_first_200}s")
+        sys.exit(1)
+    print(f"✅ First 200 under {args.max_first_200}s")
+
+
+if __name__ == "__main__":
+    main()
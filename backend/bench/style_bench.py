@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for style_engine.analyze_pages.
+
+Builds synthetic brand pages (filler prose with descriptor keywords and hex
+colors sprinkled in), times the single-pass engine against the previous
+per-category substring scan, and fails if the engine is slower than
+--max-ms-per-kb.
+
+    cd backend
+    python -m bench.style_bench
+    python -m bench.style_bench --pages 10 --page-kb 500
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from style_engine import DESCRIPTOR_KEYWORDS, analyze_pages
+
+FILLER = (
+    "our team builds products for customers around the world with care and attention to detail "
+    "learn more about pricing plans support documentation careers press and contact information "
+).split()
+
+
+def make_page(size_kb, rng):
+    keywords = [k for keys in DESCRIPTOR_KEYWORDS.values() for k in keys]
+    words = []
+    size = 0
+    while size < size_kb * 1024:
+        roll = rng.random()
+        if roll < 0.02:
+            word = rng.choice(keywords)
+        elif roll < 0.025:
+            word = "#" + "".join(rng.choice("0123456789abcdef") for _ in range(rng.choice((3, 6))))
+        else:
+            word = rng.choice(FILLER)
+        words.append(word)
+        size += len(word) + 1
+    return {"url": "https://example.com", "text": " ".join(words)}
+
+
+def legacy_analyze(pages):
+    """The substring scan style_engine replaced, kept here as the comparison point"""
+    content = " ".join(p["text"] for p in pages).lower()
+    descriptors = [cat for cat, keys in DESCRIPTOR_KEYWORDS.items() if any(k in content for k in keys)]
+    colors = []
+    for p in pages:
+        colors += re.findall(r'#(?:[0-9a-fA-F]{3}){1,2}', p.get("text", "") + " " + p.get("summary", ""))
+    return descriptors[:6], list(dict.fromkeys(c.lower() for c in colors))[:8]
+
+
+def best_of(fn, pages, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(pages)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=5, help="pages per brand")
+    parser.add_argument("--page-kb", type=int, default=200, help="size of each page in KB")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-ms-per-kb", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pages = [make_page(args.page_kb, rng) for _ in range(args.pages)]
+    total_kb = sum(len(p["text"]) for p in pages) / 1024
+
+    engine = best_of(analyze_pages, pages, args.repeats)
+    legacy = best_of(legacy_analyze, pages, args.repeats)
+    engine_ms_per_kb = engine * 1000 / total_kb
+    result = analyze_pages(pages)
+
+    print(f"📊 Style engine on {args.pages} pages, {total_kb:.0f} KB")
+    print(f"  style_engine   {engine * 1000:8.2f} ms  {engine_ms_per_kb:.4f} ms/KB")
+    print(f"  legacy scan    {legacy * 1000:8.2f} ms  {legacy * 1000 / total_kb:.4f} ms/KB (presence only, no scores)")
+    print(f"  keywords: {result['style_keywords']}")
+    print(f"  colors:   {result['color_palette']}")
+    if engine_ms_per_kb > args.max_ms_per_kb:
+        print(f"❌ {engine_ms_per_kb:.4f} ms/KB exceeds {args.max_ms_per_kb} ms/KB")
+        sys.exit(1)
+    print(f"✅ Under {args.max_ms_per_kb} ms/KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Two-level TTL cache: an in-memory LRU in front of a SQLite store (or, with
+CACHE_BACKEND=redis, a Redis-compatible server shared by several machines).
+
+Values must be JSON-serializable. Every cache registers itself in `caches`
+so its hit/miss counters can be reported by /cache/stats. A cache created
+with stale_seconds keeps expired entries that much longer, for get_stale() to
+serve while the service behind it is down (see resilience.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from state_backend import STATE_BACKEND, get_redis, REDIS_PREFIX
+
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(CACHE_DIR, "cache.db"))
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "256"))
+CACHE_DISK_ITEMS = int(os.getenv("CACHE_DISK_ITEMS", "5000"))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis" if STATE_BACKEND == "redis" else "sqlite")
+# How long expired research / completion entries stay available as a fallback
+CACHE_STALE_SECONDS = int(os.getenv("CACHE_STALE_SECONDS", str(7 * 24 * 3600)))
+
+caches = {}
+
+_db_lock = threading.Lock()
+_db = None
+
+
+def get_db():
+    """Open (once) the SQLite database shared by all caches"""
+    global _db
+    with _db_lock:
+        if _db is None:
+            os.makedirs(os.path.dirname(CACHE_DB_PATH) or ".", exist_ok=True)
+            _db = sqlite3.connect(CACHE_DB_PATH, check_same_thread=False, isolation_level=None, timeout=30)
+            _db.execute("PRAGMA journal_mode=WAL")
+            _db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            _db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache_entries (namespace, accessed_at)"
+            )
+        return _db
+
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive cache key for free text such as brand names"""
+    return " ".join(text.lower().split())
+
+
+class TTLCache:
+    def __init__(self, name, ttl_seconds, memory_items=CACHE_MEMORY_ITEMS, disk_items=CACHE_DISK_ITEMS, stale_seconds=0):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0, "stale_hits": 0}
+        caches[name] = self
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                if expires_at + self.stale_seconds <= now:
+                    del self.memory[key]
+
+        try:
+            row = self._redis_get(key) if CACHE_BACKEND == "redis" else self._sqlite_get(key, now)
+        except Exception as e:
+            print(f"⚠️ Cache {self.name} read failed: {e}")
+            row = None
+
+        if row is None or row[1] <= now:
+            with self.lock:
+                self.counters["misses"] += 1
+            return default
+        value = json.loads(row[0])
+        with self.lock:
+            self.counters["disk_hits"] += 1
+            self._remember(key, row[1], value)
+        return value
+
+    def get_stale(self, key, default=None):
+        """Like get, but also returns entries up to stale_seconds past their expiry"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] + self.stale_seconds > now:
+                self.counters["stale_hits"] += 1
+                return entry[1]
+        try:
+            row = self._redis_get(key) if CACHE_BACKEND == "redis" else self._sqlite_get(key, now)
+        except Exception as e:
+            print(f"⚠️ Cache {self.name} read failed: {e}")
+            row = None
+        if row is None or row[1] + self.stale_seconds <= now:
+            return default
+        with self.lock:
+            self.counters["stale_hits"] += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl_seconds=None):
+        now = time.time()
+        expires_at = now + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self.lock:
+            self.counters["sets"] += 1
+            self._remember(key, expires_at, value)
+        try:
+            if CACHE_BACKEND == "redis":
+                self._redis_set(key, json.dumps(value), expires_at, now)
+            else:
+                self._sqlite_set(key, json.dumps(value), expires_at, now)
+        except Exception as e:
+            print(f"⚠️ Cache {self.name} write failed: {e}")
+
+    def _sqlite_get(self, key, now):
+        db = get_db()
+        with _db_lock:
+            row = db.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.name, key),
+            ).fetchone()
+            if row is not None and row[1] > now:
+                db.execute(
+                    "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, self.name, key),
+                )
+        return row
+
+    def _sqlite_set(self, key, value_json, expires_at, now):
+        db = get_db()
+        with _db_lock:
+            db.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, value_json, expires_at, now),
+            )
+            self._evict_disk(db, now)
+
+    def _redis_key(self, key):
+        return f"{REDIS_PREFIX}cache:{self.name}:{key}"
+
+    def _redis_get(self, key):
+        # Redis expires entries itself; size is bounded by the server's maxmemory policy
+        raw = get_redis().get(self._redis_key(key))
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry["value"], entry["expires_at"]
+
+    def _redis_set(self, key, value_json, expires_at, now):
+        entry = json.dumps({"value": value_json, "expires_at": expires_at})
+        get_redis().set(self._redis_key(key), entry, ex=max(1, int(expires_at - now + self.stale_seconds)))
+
+    def _remember(self, key, expires_at, value):
+        """Insert into the memory LRU; caller holds self.lock"""
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self, db, now):
+        """Drop rows past their stale window, then the least recently used ones past disk_items; caller holds _db_lock"""
+        expired = db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.name, now - self.stale_seconds)
+        ).rowcount
+        overflow = db.execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.name,)
+        ).fetchone()[0] - self.disk_items
+        if overflow > 0:
+            db.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                " SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?)",
+                (self.name, self.name, overflow),
+            )
+        evicted = expired + max(overflow, 0)
+        if evicted:
+            with self.lock:
+                self.counters["evictions"] += evicted
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "memory_size": len(self.memory),
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                **self.counters,
+            }
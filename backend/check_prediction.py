@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 """
-Check the status of a Replicate prediction
+Check the status of a Replicate prediction.
+
+For predictions created by a running backend, prefer GET /predictions/{id},
+which also shows polling and deadline state.
 """
 import os
+import sys
 from dotenv import load_dotenv
 import replicate
 
@@ -15,8 +19,7 @@ def check_prediction(prediction_id):
     
     try:
         client = replicate.Client(api_token=os.getenv("REPLICATE_API_TOKEN"))
-        deployment = client.deployments.get("behnam354/qr-code-hackathon")
-        prediction = deployment.predictions.get(prediction_id)
+        prediction = client.predictions.get(prediction_id)
         
         print(f"✅ Prediction status: {prediction.status}")
         print(f"✅ Prediction output: {prediction.output}")
@@ -29,6 +32,7 @@ def check_prediction(prediction_id):
         return None
 
 if __name__ == "__main__":
-    # Use the prediction ID from your test
-    prediction_id = "skj548d6jhrme0cr0b7b5nt6jm"
-    check_prediction(prediction_id) 
\ No newline at end of file
+    if len(sys.argv) != 2:
+        print("Usage: python check_prediction.py <prediction_id>")
+        sys.exit(1)
+    check_prediction(sys.argv[1])
@@ -1,304 +1,430 @@
-from crewai import Agent, Task, Crew, LLM, Process
-from crewai import BaseLLM
-from openai import OpenAI
 import os
-import weave
-from qr_gen_replicate import generate_qr_art
+from qr_gen_replicate import qr_art_tool, generate_qr_variants
+from research import search_with_exa, scrape_with_browserbase
+from style_engine import analyze_pages
+from metrics import STAGE_SECONDS
+from tracing import traced
+from state_backend import process_lock
+from history import history, HISTORY, HISTORY_REUSE_SECONDS
+from image_cache import image_cache
 import re
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Which path run_crew takes: "crew" (CrewAI agents only), "direct" (hand-written
+# pipeline) or "hybrid" (direct research and image, report by the crew's writer agent)
+PIPELINE_MODES = ("crew", "direct", "hybrid")
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "direct")
+# Write the report while the image is being generated instead of after it
+PIPELINE_OVERLAP = os.getenv("PIPELINE_OVERLAP", "1") == "1"
+# Streamed summary/report text is sent as "token" events at most this often (seconds)
+TOKEN_EVENT_INTERVAL = float(os.getenv("TOKEN_EVENT_INTERVAL", "0.1"))
+
+WANDB_INFERENCE_BASE_URL = os.getenv("WANDB_INFERENCE_BASE_URL", "https://api.inference.wandb.ai/v1")
+
+overlap_pool = ThreadPoolExecutor(max_workers=int(os.getenv("JOB_WORKERS", "2")), thread_name_prefix="report")
 
 class DummyLLM:
     def call(self, prompt: str, **kwargs):
         # Return a constant string or simulate tool call
         return "CALL_TOOL_QRCodeArtGenerator('dummy prompt')"
 
-def extract_color_palette(results):
-    all_colors = []
-    for r in results:
-        text = (r.get("text","") + " " + r.get("summary","") )
-        all_colors += re.findall(r'#(?:[0-9a-fA-F]{3}){1,2}', text)
-    seen, palette = set(), []
-    for c in all_colors:
-        cl = c.lower()
-        if cl not in seen:
-            seen.add(cl)
-            palette.append(cl)
-    return palette[:8]
-
-def extract_visual_descriptors(content):
-    descriptor_keywords = {
-        "minimalist":   ["minimal", "clean", "simple", "uncluttered"],
-        "modern":       ["modern", "contemporary", "sleek", "cutting-edge"],
-        "elegant":      ["elegant", "refined", "sophisticated", "polished"],
-        "bold":         ["bold", "strong", "impactful", "striking"],
-        "friendly":     ["friendly", "warm", "inviting", "approachable"],
-        "professional": ["professional", "business", "corporate", "formal"],
-        "innovative":   ["innovative", "creative", "forward-thinking", "fresh"],
-        "dynamic":      ["dynamic", "energetic", "vibrant", "lively"],
-        "premium":      ["premium", "luxury", "high-end", "exclusive"],
-        "playful":      ["playful", "fun", "casual", "relaxed"]
+class CrewRuntime:
+    """
+    Long-lived objects shared by all crew runs: Weave tracing, the pooled LLM
+    client, the agents and a template crew. Built once, in the background after
+    startup, since crewai, openai and weave take seconds to import.
+    """
+    def __init__(self, wandb_api_key):
+        import weave
+        from crewai import Agent, Task, Crew, Process
+        from wandb_llm import WandbOpenAILLM
+
+        try:
+            with process_lock("weave-init"):
+                weave.init(project_name="weavehacks")
+            print("✅ Weave initialized successfully")
+        except Exception as e:
+            print(f"⚠️ Weave initialization failed: {e}")
+            print("⚠️ Crew AI will continue without Weave tracing")
+
+        self.llm = WandbOpenAILLM(
+            model="microsoft/Phi-4-mini-instruct",
+            api_key=wandb_api_key,
+            base_url=WANDB_INFERENCE_BASE_URL,
+            project="behnam-shahbazi40-dropbox/weavehacks"
+        )
+        llm = self.llm
+
+        self.researcher = Agent(
+            role='Research Analyst',
+            goal='Find and analyze the best investment opportunities',
+            backstory='Expert in financial analysis and market research',
+            llm=llm,
+            verbose=True,
+            allow_delegation=False,
+        )
+
+        self.qr_generator = Agent(
+            role='QR Art Generator',
+            goal='Generate artistic QR code images based on research topic',
+            backstory='Expert in generative AI art and QR code design',
+            tools=[qr_art_tool()],
+            verbose=True,
+            allow_delegation=False,
+            llm=llm,
+        )
+
+        self.writer = Agent(
+            role='Report Writer',
+            goal='Write clear and concise investment reports',
+            backstory='Experienced in creating detailed financial reports',
+            llm=llm,
+            verbose=True,
+            allow_delegation=False,
+        )
+
+        research_task = Task(
+            description='Deep research on the {topic}',
+            expected_output='Comprehensive market data including key players, market size, and growth trends.',
+            agent=self.researcher
+        )
+
+        qr_task = Task(
+            description='Use the QR code art generation tool to generate an artistic QR code for the research topic. Do not answer in text; only use the tool.',
+            expected_output='A PNG image file of the artistic QR code saved to disk or a URL to the generated image.',
+            agent=self.qr_generator
+        )
+
+        writing_task = Task(
+            description='Write a detailed report based on the research and include the QR code art',
+            expected_output='The report should be easy to read and understand. Use bullet points where applicable. Reference the generated QR code art.',
+            agent=self.writer
+        )
+
+        self.crew = Crew(
+            agents=[self.researcher, self.qr_generator, self.writer],
+            tasks=[research_task, qr_task, writing_task],
+            verbose=True,
+            process=Process.sequential,
+        )
+
+        self.exa_agent = Agent(
+            role      = "EXA Search Agent",
+            goal      = "Retrieve brand identity URLs via EXA AI",
+            backstory = "Specialist in semantic web search with EXA",
+            llm       = llm,
+            verbose   = True
+        )
+        self.scraper_agent = Agent(
+            role      = "Browserbase Scraper",
+            goal      = "Fetch page text from URLs via Browserbase",
+            backstory = "Expert web scraper using Browserbase",
+            llm       = llm,
+            verbose   = True
+        )
+        self.style_agent = Agent(
+            role      = "Style Extractor",
+            goal      = "Find visual descriptors & colors in text",
+            backstory = "Knows design language by heart",
+            llm       = llm,
+            verbose   = True
+        )
+        self.research_agent = Agent(
+            role      = "Brand Analyst",
+            goal      = "Summarize brand identity narrative",
+            backstory = "Discerns brand personality and audience",
+            llm       = llm,
+            verbose   = True
+        )
+        self.prompt_agent = Agent(
+            role      = "Prompt Engineer",
+            goal      = "Produce a rich QR-code prompt",
+            backstory = "Crafts image prompts for DALL·E/Stable Diffusion",
+            llm       = llm,
+            verbose   = True
+        )
+
+    def kickoff(self, inputs):
+        # Tasks hold per-run output, so each run kicks off a fresh copy of the template crew
+        return self.crew.copy().kickoff(inputs)
+
+    def write_report_with_crew(self, report_prompt):
+        """Run only the writer agent, as a one-task crew"""
+        from crewai import Task, Crew, Process
+
+        task = Task(
+            description=report_prompt,
+            expected_output='The report should be easy to read and understand. Use bullet points where applicable. Reference the generated QR code art.',
+            agent=self.writer
+        )
+        crew = Crew(agents=[self.writer], tasks=[task], verbose=True, process=Process.sequential)
+        return crew.kickoff().raw
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime():
+    """Return the shared CrewRuntime, building it on first use (None without WANDB_API_KEY)"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            wandb_api_key = os.getenv("WANDB_API_KEY")
+            if not wandb_api_key:
+                print("⚠️ WANDB_API_KEY not found - Crew AI will use fallback LLM")
+                return None
+            _runtime = CrewRuntime(wandb_api_key)
+            print("✅ Crew runtime initialized")
+        return _runtime
+
+def crew_output_to_result(crew_output):
+    """Map the sequential crew's task outputs onto the run_crew response shape"""
+    task_outputs = [t.raw for t in (crew_output.tasks_output or [])]
+    research = task_outputs[0] if len(task_outputs) > 0 else ""
+    qr_output = task_outputs[1] if len(task_outputs) > 1 else ""
+    match = re.search(r"(https?://\S+|/images/[0-9a-f]{64})", qr_output)
+    return {
+        "urls": [],
+        "scraped": [],
+        "style": {},
+        "summary": research,
+        "concise_prompt": None,
+        "qr_code_url": match.group(1).rstrip(").,'\"") if match else None,
+        "report": crew_output.raw,
     }
-    content = content.lower()
-    descriptors = []
-    for cat, keys in descriptor_keywords.items():
-        if any(k in content for k in keys):
-            descriptors.append(cat)
-    if any(k in content for k in ["geometric", "angular", "sharp"]):
-        descriptors.append("geometric")
-    if any(k in content for k in ["organic", "flowing", "curved"]):
-        descriptors.append("organic")
-    if any(k in content for k in ["gradient", "shadow", "depth"]):
-        descriptors.append("dimensional")
-    return descriptors[:6]
-
-def run_crew(topic: str, qr_data: str = 'behnamshahbazi.com/qrwe'):
-    try:
-        weave.init(project_name="weavehacks")
-        print("✅ Weave initialized successfully")
-    except Exception as e:
-        print(f"⚠️ Weave initialization failed: {e}")
-        print("⚠️ Crew AI will continue without Weave tracing")
-    
-    wandb_api_key = os.getenv("WANDB_API_KEY")
-    if not wandb_api_key:
-        print("⚠️ WANDB_API_KEY not found - Crew AI will use fallback LLM")
-        # You could add a fallback LLM here if needed
-        return "Crew AI workflow completed (W&B not configured)"
 
-    class WandbOpenAILLM(BaseLLM):
-        def __init__(self, model, api_key, base_url, project):
-            self.client = OpenAI(
-                base_url=base_url,
-                api_key=api_key,
-                project=project
-            )
-            self.model = model
+def produced_image(result):
+    """True when a run ended with an image URL; failed generations carry an error message instead"""
+    return (result.get("qr_code_url") or "").startswith(("http://", "https://", "/images/"))
 
-        def call(self, prompt: str, **kwargs) -> str:
-            try:
-                if isinstance(prompt, list):
-                    prompt_str = ""
-                    for msg in prompt:
-                        role = msg.get("role", "user").capitalize()
-                        content = msg.get("content", "")
-                        prompt_str += f"{role}: {content}\n"
-                else:
-                    prompt_str = prompt
-
-                formatted_prompt = f"### Instruction:\n{prompt_str.strip()}\n\n### Response:\n"
-
-                response = self.client.completions.create(
-                    model=self.model,
-                    prompt=formatted_prompt,
-                    max_tokens=512,
-                    temperature=0.7
-                )
-
-                return response.choices[0].text.strip()
-            except Exception as e:
-                print("❌ [ERROR] Wandb LLM call failed:", e)
-                raise
-
-    llm = WandbOpenAILLM(
-        model="microsoft/Phi-4-mini-instruct",
-        api_key=wandb_api_key,
-        base_url="https://api.inference.wandb.ai/v1",
-        project="behnam-shahbazi40-dropbox/weavehacks"
-    )
+def history_image_available(generation):
+    """Only reuse generations whose image is still in the local store; Replicate's own URLs expire"""
+    match = re.search(r"/images/([0-9a-f]{64})$", generation["qr_code_url"] or "")
+    return match is not None and image_cache.get(match.group(1)) is not None
 
-    researcher = Agent(
-        role='Research Analyst',
-        goal='Find and analyze the best investment opportunities',
-        backstory='Expert in financial analysis and market research',
-        llm=llm,
-        verbose=True,
-        allow_delegation=False,
-    )
+@traced
+def extract_style(inputs):
+    style = analyze_pages(inputs)
+    print({"style_keywords": style["style_keywords"], "color_palette": style["color_palette"]})
+    return style
 
-    qr_generator = Agent(
-        role='QR Art Generator',
-        goal='Generate artistic QR code images based on research topic',
-        backstory='Expert in generative AI art and QR code design',
-        tools=[generate_qr_art],
-        verbose=True,
-        allow_delegation=False,
-        llm=llm,
+@traced
+def summarize_brand(runtime, inputs, on_token=None):
+    prompt = (
+        f"Given these style keywords {inputs['style_keywords']} and colors {inputs['color_palette']}, "
+        "write a concise narrative summary of the brand’s visual identity."
     )
+    return runtime.research_agent.llm.call(prompt, temperature=0.3, on_token=on_token)
 
-    writer = Agent(
-        role='Report Writer',
-        goal='Write clear and concise investment reports',
-        backstory='Experienced in creating detailed financial reports',
-        llm=llm,
-        verbose=True,
-        allow_delegation=False,
+@traced
+def make_qr_prompt(runtime, inputs, art_style=None, company_name=None):
+    if art_style and art_style.lower() == 'abstract' and company_name:
+        # Try to extract a mission keyword from the summary, fallback to 'innovation'
+        summary = inputs.get('summary', '')
+        match = re.search(r"mission.*?([a-zA-Z]+)", summary)
+        if match:
+            mission_keyword = match.group(1)
+        else:
+            words = [w for w in summary.split() if len(w) > 4]
+            mission_keyword = words[0] if words else 'innovation'
+        return f"{company_name}, {mission_keyword}"
+    if art_style and art_style.lower() == 'nature' and company_name:
+        return f"{company_name}, logo, AI, technology, nature"
+    # Default: original prompt engineering
+    prompt = (
+        f"Create an image-generation prompt for an artistic QR code.\n"
+        f"Brand summary: {inputs['summary']}\n"
+        f"Include design style, color palette, mood, composition details.\n"
+        f"The prompt should be a comma-separated list of up to 5 unique keywords and phrases (no duplicates), no more than 120 characters in total, in the style of AI art prompts.\n"
+        f"The prompt MUST be tailored to generate a CUTE, VERY ARTISTIC, and HIGH-QUALITY logo.\n"
+        f"The prompt MUST include the brand name: {company_name}.\n"
+        f"Follow this example for style: 'cute, high quality, artistic, logo, dreamy, soft colors, adorable, intricate, digital painting, 64k'.\n"
+        f"Tailor the keywords to the company or brand name, its logo, and its color palette. Respond ONLY with the short prompt for the QR code generator, nothing else."
     )
+    # Only the first line is used, so stop generating there; 120 characters fit well within 96 tokens
+    return runtime.prompt_agent.llm.call(prompt, temperature=0.7, max_tokens=96, first_line=True)
 
-    research_task = Task(
-        description='Deep research on the {topic}',
-        expected_output='Comprehensive market data including key players, market size, and growth trends.',
-        agent=researcher
-    )
+def run_crew(topic: str, qr_data: str = 'behnamshahbazi.com/qrwe', on_event=None, mode: str = None):
+    mode = mode or PIPELINE_MODE
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode: {mode}")
+    started = time.time()
+    timings = {}
 
-    qr_task = Task(
-        description='Use the QR code art generation tool to generate an artistic QR code for the research topic. Do not answer in text; only use the tool.',
-        expected_output='A PNG image file of the artistic QR code saved to disk or a URL to the generated image.',
-        agent=qr_generator
-    )
+    def emit(stage_name, status, **data):
+        # Report pipeline progress to the caller (job queue, SSE stream)
+        if on_event:
+            on_event({"stage": stage_name, "status": status, "time": time.time(), **data})
 
-    writing_task = Task(
-        description='Write a detailed report based on the research and include the QR code art',
-        expected_output='The report should be easy to read and understand. Use bullet points where applicable. Reference the generated QR code art.',
-        agent=writer
-    )
+    @contextmanager
+    def stage(name):
+        """Time a pipeline stage; anything put in the yielded dict is sent as partial results"""
+        emit(name, "started")
+        start_time = time.time()
+        partial = {}
+        try:
+            yield partial
+        except Exception as e:
+            STAGE_SECONDS.observe(time.time() - start_time, stage=name, status="error")
+            emit(name, "failed", elapsed_ms=round((time.time() - start_time) * 1000), error=str(e))
+            raise
+        STAGE_SECONDS.observe(time.time() - start_time, stage=name, status="ok")
+        timings[name] = round((time.time() - start_time) * 1000)
+        emit(name, "completed", elapsed_ms=timings[name], data=partial)
 
-    crew = Crew(
-        agents=[researcher, qr_generator, writer],
-        tasks=[research_task, qr_task, writing_task],
-        verbose=True,
-        process=Process.sequential,
-    )
+    def token_events(stage_name):
+        """on_token callback that batches streamed text into "token" events; returns (callback, flush)"""
+        pending = {"offset": 0, "text": "", "sent_at": time.monotonic()}
 
-    # Explicitly run the Crew to orchestrate all agents and tasks using kickoff, passing topic as input
-    crew_output = crew.kickoff({'topic': topic})
-    print(f"[DEBUG] Crew kickoff output: {crew_output}")
+        def flush():
+            if pending["text"]:
+                emit(stage_name, "token", offset=pending["offset"], text=pending["text"])
+            pending.update(offset=pending["offset"] + len(pending["text"]), text="", sent_at=time.monotonic())
 
-    EXA_API_KEY = os.getenv("EXA_API_KEY", "your_exa_api_key")
-    BROWSERBASE_API_KEY = os.getenv("BROWSERBASE_API_KEY", "your_browserbase_api_key")
+        def on_token(delta, offset):
+            if offset != pending["offset"] + len(pending["text"]):
+                # A retried attempt starts over; the client truncates to offset
+                flush()
+                pending["offset"] = offset
+            pending["text"] += delta
+            if time.monotonic() - pending["sent_at"] >= TOKEN_EVENT_INTERVAL:
+                flush()
 
-    exa_agent = Agent(
-        role      = "EXA Search Agent",
-        goal      = "Retrieve brand identity URLs via EXA AI",
-        backstory = "Specialist in semantic web search with EXA",
-        llm       = llm,
-        verbose   = True
-    )
-    scraper_agent = Agent(
-        role      = "Browserbase Scraper",
-        goal      = "Fetch page text from URLs via Browserbase",
-        backstory = "Expert web scraper using Browserbase",
-        llm       = llm,
-        verbose   = True
-    )
-    style_agent = Agent(
-        role      = "Style Extractor",
-        goal      = "Find visual descriptors & colors in text",
-        backstory = "Knows design language by heart",
-        llm       = llm,
-        verbose   = True
-    )
-    research_agent = Agent(
-        role      = "Brand Analyst",
-        goal      = "Summarize brand identity narrative",
-        backstory = "Discerns brand personality and audience",
-        llm       = llm,
-        verbose   = True
-    )
-    prompt_agent = Agent(
-        role      = "Prompt Engineer",
-        goal      = "Produce a rich QR-code prompt",
-        backstory = "Crafts image prompts for DALL·E/Stable Diffusion",
-        llm       = llm,
-        verbose   = True
-    )
+        return on_token, flush
 
-    def search_with_exa(inputs):
-        print({"exa_query": inputs["brand_name"]})
-        resp = requests.post(
-            "https://api.exa.ai/search",
-            headers={"Authorization": f"Bearer {EXA_API_KEY}"},
-            json={"query": f"{inputs['brand_name']} visual identity", "numResults": 3}
-        ).json()
-        urls = [r["url"] for r in resp.get("results",[])]
-        print({"exa_results": urls})
-        return urls
-
-    def scrape_with_browserbase(inputs):
-        out = []
-        for url in inputs:
-            print({"scrape_url": url})
-            text = requests.post(
-                "https://api.browserbase.com/scrape",
-                headers={"Authorization": f"Bearer {BROWSERBASE_API_KEY}"},
-                json={"url": url}
-            ).json().get("text","")[:3000]
-            out.append({"url": url, "text": text})
-        print({"scraped": out})
-        return out
-
-    def extract_style(inputs):
-        all_text = " ".join(r["text"] for r in inputs)
-        keywords = extract_visual_descriptors(all_text)
-        colors   = extract_color_palette(inputs)
-        print({"style_keywords": keywords, "color_palette": colors})
-        return {"style_keywords": keywords, "color_palette": colors}
-
-    def summarize_brand(inputs):
-        prompt = (
-            f"Given these style keywords {inputs['style_keywords']} and colors {inputs['color_palette']}, "
-            "write a concise narrative summary of the brand’s visual identity."
-        )
-        return research_agent.llm.call(prompt, temperature=0.3)
-
-    def make_qr_prompt(inputs, art_style=None, company_name=None):
-        if art_style and art_style.lower() == 'abstract' and company_name:
-            # Try to extract a mission keyword from the summary, fallback to 'innovation'
-            import re
-            summary = inputs.get('summary', '')
-            match = re.search(r"mission.*?([a-zA-Z]+)", summary)
-            if match:
-                mission_keyword = match.group(1)
-            else:
-                words = [w for w in summary.split() if len(w) > 4]
-                mission_keyword = words[0] if words else 'innovation'
-            return f"{company_name}, {mission_keyword}"
-        if art_style and art_style.lower() == 'nature' and company_name:
-            return f"{company_name}, logo, AI, technology, nature"
-        # Default: original prompt engineering
-        prompt = (
-            f"Create an image-generation prompt for an artistic QR code.\n"
-            f"Brand summary: {inputs['summary']}\n"
-            f"Include design style, color palette, mood, composition details.\n"
-            f"The prompt should be a comma-separated list of up to 5 unique keywords and phrases (no duplicates), no more than 120 characters in total, in the style of AI art prompts.\n"
-            f"The prompt MUST be tailored to generate a CUTE, VERY ARTISTIC, and HIGH-QUALITY logo.\n"
-            f"The prompt MUST include the brand name: {company_name}.\n"
-            f"Follow this example for style: 'cute, high quality, artistic, logo, dreamy, soft colors, adorable, intricate, digital painting, 64k'.\n"
-            f"Tailor the keywords to the company or brand name, its logo, and its color palette. Respond ONLY with the short prompt for the QR code generator, nothing else."
-        )
-        return prompt_agent.llm.call(prompt, temperature=0.7)
+    def finish(result):
+        """Record the run in the generation history and return result with its generation_id"""
+        # A failed generation is not a result anyone should browse or be served again
+        if HISTORY and produced_image(result):
+            try:
+                elapsed_ms = round((time.time() - started) * 1000)
+                result["generation_id"] = history.record(topic, qr_data, mode, result, timings, elapsed_ms)
+            except Exception as e:
+                print(f"⚠️ Could not record generation in history: {e}")
+        return result
+
+    if HISTORY and HISTORY_REUSE_SECONDS > 0:
+        with stage("history_lookup") as partial:
+            generation = history.find_reusable(topic, qr_data, mode, usable=history_image_available)
+            partial["generation_id"] = generation["id"] if generation else None
+        if generation is not None:
+            print(f"♻️ Answering {topic!r} from generation {generation['id']}")
+            return history.as_result(generation)
+
+    runtime = get_runtime()
+    if runtime is None:
+        # You could add a fallback LLM here if needed
+        return "Crew AI workflow completed (W&B not configured)"
+
+    if mode == "crew":
+        # Explicitly run the Crew to orchestrate all agents and tasks using kickoff, passing topic as input
+        with stage("crew_kickoff") as partial:
+            crew_output = runtime.kickoff({'topic': topic})
+            result = crew_output_to_result(crew_output)
+            partial["qr_code_url"] = result["qr_code_url"]
+        print(f"[DEBUG] Crew kickoff output: {crew_output}")
+        return finish(result)
 
     # Run the research pipeline
-    urls = search_with_exa({"brand_name": topic})
-    scraped = scrape_with_browserbase(urls)
-    style = extract_style(scraped)
-    summary = summarize_brand(style)
+    with stage("exa_search") as partial:
+        try:
+            urls = search_with_exa(topic)
+        except Exception as e:
+            # Research is best effort, like individual scrapes: carry on without sources
+            print(f"⚠️ Exa search failed: {e}")
+            urls = []
+            partial["error"] = str(e)
+        partial["urls"] = urls
+    with stage("scrape") as partial:
+        scraped = scrape_with_browserbase(
+            urls,
+            on_page=lambda url, chars, elapsed_ms, error: emit(
+                "scrape_url", "failed" if error else "completed",
+                url=url, chars=chars, elapsed_ms=elapsed_ms, error=error,
+            ),
+        )
+        partial["pages"] = len(scraped)
+    with stage("extract_style") as partial:
+        style = extract_style(scraped)
+        partial.update(style)
+    with stage("summarize_brand") as partial:
+        on_token, flush_tokens = token_events("summarize_brand")
+        summary = summarize_brand(runtime, style, on_token=on_token)
+        flush_tokens()
+        partial["summary"] = summary
     # Determine art style and company name
     art_style = None
     if 'style_keywords' in style and style['style_keywords']:
         art_style = style['style_keywords'][0]
     company_name = topic
-    qr_prompt = make_qr_prompt({"summary": summary}, art_style=art_style, company_name=company_name)
-    concise_prompt = qr_prompt.strip().split('\n')[0]
+    with stage("make_qr_prompt") as partial:
+        qr_prompt = make_qr_prompt(runtime, {"summary": summary}, art_style=art_style, company_name=company_name)
+        concise_prompt = qr_prompt.strip().split('\n')[0]
+        partial["concise_prompt"] = concise_prompt
     print(f"[DEBUG] Researched prompt for QR code generator: {concise_prompt}")
 
+    def write_report(report_prompt):
+        with stage("write_report") as partial:
+            if mode == "hybrid":
+                report = runtime.write_report_with_crew(report_prompt)
+            else:
+                on_token, flush_tokens = token_events("write_report")
+                report = runtime.writer.llm.call(report_prompt, on_token=on_token)
+                flush_tokens()
+            partial["report"] = report
+        return report
+
+    report_future = None
+    if PIPELINE_OVERLAP:
+        # The report only needs the prompt, so write it while the GPU works and link the image afterwards
+        report_future = overlap_pool.submit(write_report, (
+            f"Write a detailed report based on the following research topic: {topic}.\n\n"
+            f"Reference the QR code art, which is linked at the end of the report.\n\n"
+            f"The QR code was generated using this prompt: '{concise_prompt}'"
+        ))
+
     # 2. QR Code Generation (manual tool call)
-    qr_image_url = generate_qr_art.func(concise_prompt, qr_code_content=qr_data)
+    with stage("generate_qr_art") as partial:
+        try:
+            generation = generate_qr_variants(
+                concise_prompt,
+                qr_data,
+                on_status=lambda status: emit("replicate_prediction", status),
+                on_variant=lambda variant: emit(
+                    "qr_verify", "passed" if variant["passed"] else "failed" if variant["passed"] is False else "skipped",
+                    url=variant["url"], score=variant["score"], attempt=variant["attempt"],
+                    conditioning_scale=variant["conditioning_scale"],
+                ),
+            )
+            qr_image_url = generation["qr_code_url"]
+            qr_verification = generation["verification"]
+        except Exception as e:
+            print(f"❌ [ERROR] QR art generation failed: {e}")
+            qr_image_url = f"Error generating QR code art: {str(e)}"
+            qr_verification = None
+        partial["qr_code_url"] = qr_image_url
+        partial["qr_verification"] = qr_verification
     print(f"[DEBUG] QR code generated at: {qr_image_url}")
 
     # 3. Report Writing
-    report_prompt = (
-        f"Write a detailed report based on the following research topic: {topic}.\n\n"
-        f"Include this QR code art: {qr_image_url}\n\n"
-        f"The QR code was generated using this prompt: '{concise_prompt}'"
-    )
-    report_result = writer.llm.call(report_prompt)
+    if report_future is not None:
+        report_result = f"{report_future.result()}\n\nQR code art: {qr_image_url}"
+    else:
+        report_result = write_report((
+            f"Write a detailed report based on the following research topic: {topic}.\n\n"
+            f"Include this QR code art: {qr_image_url}\n\n"
+            f"The QR code was generated using this prompt: '{concise_prompt}'"
+        ))
 
-    return {
+    return finish({
         "urls": urls,
         "scraped": scraped,
         "style": style,
         "summary": summary,
         "concise_prompt": concise_prompt,
         "qr_code_url": qr_image_url,
+        "qr_verification": qr_verification,
         "report": report_result
-    }
+    })
@@ -0,0 +1,303 @@
+"""
+Generation history: every run_crew result, kept in SQLite under CACHE_DIR.
+
+Each generation is stored with its brand, QR payload, mode, style keywords,
+color palette, summary, prompt, report, per-stage timings and image reference.
+Keywords and colors also go into small index tables keyed by
+(value, created_at), so gallery queries by brand, keyword, color and date range
+are index scans. Pages use a keyset cursor instead of OFFSET.
+
+With HISTORY_REUSE_SECONDS set, run_crew answers a repeat of a recent request
+(same brand, payload and mode, image still in the local store) from history
+without any research, LLM or Replicate calls. similar() ranks earlier
+generations by brand, payload, keyword and color overlap.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from cache import normalize_text
+
+HISTORY = os.getenv("HISTORY", "1") == "1"
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(os.getenv("CACHE_DIR", ".cache"), "history.db"))
+HISTORY_MAX_ITEMS = int(os.getenv("HISTORY_MAX_ITEMS", "10000"))
+# Answer repeat requests from generations at most this old (0 = always generate)
+HISTORY_REUSE_SECONDS = int(os.getenv("HISTORY_REUSE_SECONDS", "0"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+
+# Columns of a generation; everything else (urls, style, summary, report, qr_verification, timings) is data
+COLUMNS = ("id", "created_at", "brand", "brand_key", "qr_data", "mode", "concise_prompt", "qr_code_url", "elapsed_ms")
+# Candidates scored per similar() lookup
+SIMILAR_CANDIDATES = 200
+
+
+def normalize_color(color):
+    """'#AABBCC', 'aabbcc' and '#abc' all become '#aabbcc' (the style engine's form)"""
+    digits = color.strip().lower().lstrip("#")
+    if len(digits) == 3:
+        digits = "".join(c * 2 for c in digits)
+    return f"#{digits}"
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def encode_cursor(created_at, generation_id):
+    return f"{created_at!r}:{generation_id}"
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError if it is malformed"""
+    created_at, _, generation_id = cursor.partition(":")
+    if not generation_id:
+        raise ValueError(f"Malformed cursor {cursor!r}")
+    return float(created_at), generation_id
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB_PATH, max_items=HISTORY_MAX_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.db = None
+        self.inserts = 0
+        self.counters = {"recorded": 0, "reused": 0, "queries": 0, "similar_lookups": 0}
+
+    def _connect(self):
+        """Open (once) the history database; called with self.lock held"""
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " id TEXT PRIMARY KEY, created_at REAL NOT NULL, brand TEXT NOT NULL, brand_key TEXT NOT NULL,"
+                " qr_data TEXT, mode TEXT, concise_prompt TEXT, qr_code_url TEXT, elapsed_ms INTEGER, data TEXT NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_generations_created ON generations (created_at, id)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_generations_brand ON generations (brand_key, created_at, id)")
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_generations_reuse ON generations (brand_key, qr_data, mode, created_at)"
+            )
+            for table, column in (("generation_keywords", "keyword"), ("generation_colors", "color")):
+                # created_at is copied in so a tag query walks the index already in page order
+                self.db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    f" {column} TEXT NOT NULL, created_at REAL NOT NULL, generation_id TEXT NOT NULL,"
+                    f" PRIMARY KEY ({column}, created_at, generation_id)) WITHOUT ROWID"
+                )
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_generation ON {table} (generation_id)")
+        return self.db
+
+    @staticmethod
+    def _row_to_generation(row):
+        generation = json.loads(row[len(COLUMNS)])
+        generation.update(zip(COLUMNS, row[:len(COLUMNS)]))
+        return generation
+
+    @staticmethod
+    def _summary(generation):
+        """The fields a gallery listing needs"""
+        style = generation.get("style") or {}
+        return {
+            "id": generation["id"],
+            "created_at": generation["created_at"],
+            "brand": generation["brand"],
+            "mode": generation["mode"],
+            "style_keywords": style.get("style_keywords", []),
+            "color_palette": style.get("color_palette", []),
+            "concise_prompt": generation["concise_prompt"],
+            "qr_code_url": generation["qr_code_url"],
+            "elapsed_ms": generation["elapsed_ms"],
+        }
+
+    def record(self, topic, qr_data, mode, result, timings, elapsed_ms):
+        """Store a run_crew result with its stage timings (ms) and total run time; returns the new generation id"""
+        generation_id = uuid.uuid4().hex
+        now = time.time()
+        style = result.get("style") or {}
+        keywords = list(dict.fromkeys(style.get("style_keywords") or []))
+        colors = list(dict.fromkeys(normalize_color(c) for c in style.get("color_palette") or []))
+        data = {
+            "urls": result.get("urls") or [],
+            "style": {key: style[key] for key in ("style_keywords", "color_palette") if key in style},
+            "summary": result.get("summary"),
+            "report": result.get("report"),
+            "qr_verification": result.get("qr_verification"),
+            "timings": timings,
+        }
+        values = (
+            generation_id, now, topic, normalize_text(topic), qr_data, mode,
+            result.get("concise_prompt"), result.get("qr_code_url"), elapsed_ms,
+        )
+        with self.lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    f"INSERT INTO generations ({', '.join(COLUMNS)}, data) VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                    (*values, json.dumps(data, default=str)),
+                )
+                db.executemany(
+                    "INSERT INTO generation_keywords (keyword, created_at, generation_id) VALUES (?, ?, ?)",
+                    [(keyword, now, generation_id) for keyword in keywords],
+                )
+                db.executemany(
+                    "INSERT INTO generation_colors (color, created_at, generation_id) VALUES (?, ?, ?)",
+                    [(color, now, generation_id) for color in colors],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self.counters["recorded"] += 1
+            self.inserts += 1
+            if self.inserts % 100 == 0:
+                self._prune(db)
+        return generation_id
+
+    def _prune(self, db):
+        """Drop the oldest generations beyond max_items; called with self.lock held"""
+        row = db.execute(
+            "SELECT created_at FROM generations ORDER BY created_at DESC LIMIT 1 OFFSET ?", (self.max_items,)
+        ).fetchone()
+        if row is None:
+            return
+        for table in ("generation_keywords", "generation_colors"):
+            db.execute(f"DELETE FROM {table} WHERE created_at <= ?", (row[0],))
+        db.execute("DELETE FROM generations WHERE created_at <= ?", (row[0],))
+
+    def get(self, generation_id):
+        with self.lock:
+            row = self._connect().execute(
+                f"SELECT {', '.join(COLUMNS)}, data FROM generations WHERE id = ?", (generation_id,)
+            ).fetchone()
+        return self._row_to_generation(row) if row is not None else None
+
+    def query(self, brand=None, keyword=None, color=None, since=None, until=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+        """
+        One page of generations, newest first, matching every given filter.
+        Returns {"items", "next_cursor"}; pass next_cursor back for the next page.
+        """
+        joins, where, params = [], [], []
+        # Order by the table that is filtered on, so SQLite reads its index in page order
+        order = ("g.created_at", "g.id")
+        if keyword:
+            joins.append("JOIN generation_keywords k ON k.generation_id = g.id AND k.keyword = ?")
+            params.append(keyword.strip().lower())
+            order = ("k.created_at", "k.generation_id")
+        if color:
+            joins.append("JOIN generation_colors c ON c.generation_id = g.id AND c.color = ?")
+            params.append(normalize_color(color))
+            order = order if keyword else ("c.created_at", "c.generation_id")
+        if brand:
+            where.append("g.brand_key = ?")
+            params.append(normalize_text(brand))
+        if since is not None:
+            where.append("g.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("g.created_at < ?")
+            params.append(until)
+        if cursor:
+            where.append(f"({order[0]}, {order[1]}) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        sql = (
+            f"SELECT {', '.join('g.' + column for column in COLUMNS)}, g.data FROM generations g {' '.join(joins)}"
+            f"{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY {order[0]} DESC, {order[1]} DESC LIMIT ?"
+        )
+        with self.lock:
+            self.counters["queries"] += 1
+            # One extra row tells whether there is a next page
+            rows = self._connect().execute(sql, (*params, limit + 1)).fetchall()
+        items = [self._summary(self._row_to_generation(row)) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"]) if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def as_result(generation):
+        """A stored generation in run_crew's result shape (scraped pages are not kept)"""
+        return {
+            "urls": generation.get("urls") or [],
+            "scraped": [],
+            "style": generation.get("style") or {},
+            "summary": generation.get("summary"),
+            "concise_prompt": generation["concise_prompt"],
+            "qr_code_url": generation["qr_code_url"],
+            "qr_verification": generation.get("qr_verification"),
+            "report": generation.get("report"),
+            "generation_id": generation["id"],
+        }
+
+    def find_reusable(self, topic, qr_data, mode, max_age=HISTORY_REUSE_SECONDS, usable=lambda generation: True):
+        """Newest generation for the same brand, payload and mode within max_age that usable() accepts"""
+        if max_age <= 0:
+            return None
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT {', '.join(COLUMNS)}, data FROM generations"
+                " WHERE brand_key = ? AND qr_data = ? AND mode = ? AND created_at >= ?"
+                " ORDER BY created_at DESC LIMIT 5",
+                (normalize_text(topic), qr_data, mode, time.time() - max_age),
+            ).fetchall()
+        for row in rows:
+            generation = self._row_to_generation(row)
+            if usable(generation):
+                with self.lock:
+                    self.counters["reused"] += 1
+                return generation
+        return None
+
+    def similar(self, topic=None, qr_data=None, keywords=(), colors=(), limit=5):
+        """
+        Earlier generations ranked by similarity: same brand counts most, then
+        the same payload, then keyword and color overlap (Jaccard).
+        """
+        brand_key = normalize_text(topic) if topic else None
+        keywords = [keyword.strip().lower() for keyword in keywords if keyword.strip()]
+        colors = [normalize_color(color) for color in colors if color.strip()]
+        candidate_sql, params = [], []
+        if brand_key:
+            candidate_sql.append("SELECT id FROM (SELECT id FROM generations WHERE brand_key = ? ORDER BY created_at DESC LIMIT ?)")
+            params += [brand_key, SIMILAR_CANDIDATES]
+        for table, column, values in (("generation_keywords", "keyword", keywords), ("generation_colors", "color", colors)):
+            if values:
+                candidate_sql.append(
+                    f"SELECT generation_id FROM (SELECT generation_id FROM {table}"
+                    f" WHERE {column} IN ({', '.join('?' * len(values))}) ORDER BY created_at DESC LIMIT ?)"
+                )
+                params += [*values, SIMILAR_CANDIDATES]
+        if not candidate_sql:
+            return []
+        with self.lock:
+            self.counters["similar_lookups"] += 1
+            rows = self._connect().execute(
+                f"SELECT {', '.join(COLUMNS)}, data FROM generations WHERE id IN ({' UNION '.join(candidate_sql)})",
+                params,
+            ).fetchall()
+        scored = []
+        for row in rows:
+            generation = self._row_to_generation(row)
+            style = generation.get("style") or {}
+            score = (
+                0.5 * (generation["brand_key"] == brand_key)
+                + 0.2 * (qr_data is not None and generation["qr_data"] == qr_data)
+                + 0.2 * jaccard(keywords, style.get("style_keywords") or [])
+                + 0.1 * jaccard(colors, [normalize_color(color) for color in style.get("color_palette") or []])
+            )
+            if score > 0:
+                scored.append((score, generation))
+        scored.sort(key=lambda item: (item[0], item[1]["created_at"]), reverse=True)
+        return [{"score": round(score, 3), **self._summary(generation)} for score, generation in scored[:limit]]
+
+    def stats(self):
+        with self.lock:
+            count = self._connect().execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+            return {"enabled": HISTORY, "generations": count, "reuse_seconds": HISTORY_REUSE_SECONDS, **self.counters}
+
+
+history = HistoryStore()
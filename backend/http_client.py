@@ -0,0 +1,39 @@
+"""
+Shared HTTP session for outbound API calls.
+
+One keep-alive connection pool is reused by every request instead of opening a
+new TCP/TLS connection per call.
+"""
+import os
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import HTTP_SECONDS
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def build_session(pool_size=HTTP_POOL_SIZE):
+    """Create a requests session whose pool can hold pool_size connections per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def record_response(response, *args, **kwargs):
+    """Response hook: time to response headers per host, for /metrics"""
+    HTTP_SECONDS.observe(
+        response.elapsed.total_seconds(),
+        host=urlsplit(response.url).netloc,
+        status=str(response.status_code),
+    )
+
+
+session = build_session()
@@ -0,0 +1,176 @@
+"""
+Content-addressed store for generated QR art.
+
+Images are streamed from Replicate in chunks straight to a temp file, hashed
+on the way, and renamed to `<sha256 of the bytes>.png`, so concurrent
+generations never share a path and memory per download stays flat. A second
+index maps the SHA-256 of the full Replicate input dict to that digest, so a
+repeat (prompt, payload, parameters, seed) is served from disk instead of
+spending another GPU run. Retention is bounded by total size (LRU) and age.
+
+Several worker processes can share the directory. A file's mtime is its last
+access time (bumped on every hit), an index miss falls back to the disk, and
+each store rescans the directory before evicting, so every worker sees and
+bounds the images written by the others.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from cache import TTLCache
+from http_client import session, HTTP_CONNECT_TIMEOUT
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(os.getenv("CACHE_DIR", ".cache"), "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_RETENTION_SECONDS = int(os.getenv("IMAGE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(64 * 1024)))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "30"))
+
+# Replicate input hash -> content digests of its outputs
+image_refs = TTLCache("image_refs", ttl_seconds=IMAGE_RETENTION_SECONDS)
+
+
+def input_key(prediction_input):
+    """Stable hash of a Replicate input dict"""
+    payload = json.dumps(prediction_input, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES, retention_seconds=IMAGE_RETENTION_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.retention_seconds = retention_seconds
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # digest -> (size in bytes, last access), least recently used first
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self.listeners = []  # called with each newly stored digest
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files on disk and their modification times; caller holds self.lock"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith(".tmp") and stat.st_mtime < now - 2 * IMAGE_DOWNLOAD_TIMEOUT:
+                    # Left behind by a download interrupted by a restart; newer ones may be another worker's
+                    os.remove(path)
+                    continue
+            except OSError:
+                # Removed by another worker meanwhile
+                continue
+            if name.endswith(".png"):
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        self.index = OrderedDict((digest, (size, mtime)) for mtime, digest, size in sorted(entries))
+        self.total_bytes = sum(size for size, _ in self.index.values())
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, f"{digest}.png")
+
+    def get(self, digest):
+        """Return the file path for a content digest, or None"""
+        path = self.path_for(digest)
+        with self.lock:
+            try:
+                # The index only knows this worker's files; another worker may have stored or evicted it
+                size = os.stat(path).st_size
+                os.utime(path)
+            except OSError:
+                previous = self.index.pop(digest, None)
+                if previous:
+                    self.total_bytes -= previous[0]
+                self.counters["misses"] += 1
+                return None
+            previous = self.index.pop(digest, None)
+            self.total_bytes += size - (previous[0] if previous else 0)
+            self.index[digest] = (size, time.time())
+            self.counters["hits"] += 1
+        return path
+
+    def lookup(self, key):
+        """Digests of the images previously generated for a Replicate input key, or None"""
+        digests = image_refs.get(key)
+        if not digests or any(self.get(digest) is None for digest in digests):
+            return None
+        return digests
+
+    def remember(self, key, digests):
+        """Record the outputs generated for a Replicate input key"""
+        image_refs.set(key, list(digests))
+
+    def put_stream(self, chunks):
+        """Write an iterable of byte chunks to the store; returns the content digest"""
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.directory, f"{threading.get_ident()}-{time.time_ns()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    if chunk:
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            digest = hasher.hexdigest()
+            os.replace(tmp_path, self.path_for(digest))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            # Pick up what other workers stored or evicted, so the size cap covers the whole directory
+            self._load_index()
+            self.counters["stores"] += 1
+            self._evict()
+        for listener in self.listeners:
+            listener(digest)
+        return digest
+
+    def download(self, url):
+        """Stream an image URL into the store in IMAGE_CHUNK_SIZE chunks; returns the digest"""
+        with session.get(url, stream=True, timeout=(HTTP_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_TIMEOUT)) as response:
+            response.raise_for_status()
+            return self.put_stream(response.iter_content(chunk_size=IMAGE_CHUNK_SIZE))
+
+    def _evict(self):
+        """Drop expired files, then least recently used ones past the size cap; caller holds self.lock"""
+        cutoff = time.time() - self.retention_seconds
+        doomed = {digest for digest, (_, accessed_at) in self.index.items() if accessed_at < cutoff}
+        self.counters["expired"] += len(doomed)
+        remaining = self.total_bytes - sum(self.index[digest][0] for digest in doomed)
+        for digest, (size, _) in self.index.items():
+            if remaining <= self.max_bytes or len(self.index) - len(doomed) <= 1:
+                break
+            if digest not in doomed:
+                doomed.add(digest)
+                remaining -= size
+                self.counters["evictions"] += 1
+        for digest in doomed:
+            size, _ = self.index.pop(digest)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path_for(digest))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.index),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "retention_seconds": self.retention_seconds,
+                **self.counters,
+            }
+
+
+image_cache = ImageCache()
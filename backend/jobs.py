@@ -0,0 +1,243 @@
+"""
+Background job queue for crew runs.
+
+Crew runs are fully blocking (LLM calls, Exa, Browserbase, Replicate), so they
+are executed on a bounded set of worker threads instead of the uvicorn event
+loop. Job records, events and the queue itself live in the state backend
+(see state_backend.py), so with a shared backend any uvicorn worker or
+machine can pick up a job queued by another. A running job is leased to its
+worker process, which renews the lease every JOB_LEASE_SECONDS / 3; if the
+process dies, any worker's heartbeat requeues the job once the lease runs out
+(up to JOB_MAX_ATTEMPTS runs in total) and fails it after that.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+from singleflight import SINGLEFLIGHT
+from state_backend import STATE_BACKEND, create_backend
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "16"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+# How often idle workers check a shared backend for jobs queued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+# How long /run-crew waits for its job before answering 504 (the job keeps running)
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "600"))
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class JobTimeoutError(Exception):
+    """Raised when waiting for a job takes longer than the timeout"""
+
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_MAX_QUEUE, ttl_seconds=JOB_TTL_SECONDS, backend=STATE_BACKEND):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.store = create_backend(backend, ttl_seconds)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.handlers = {}
+        self.threads = []
+        self.running = set()  # ids of the jobs this process is running
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.counters = {
+            "submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0, "failed": 0, "requeued": 0, "lost": 0,
+        }
+
+    def register(self, fn):
+        """Make fn runnable as a job; every worker process must register the same functions"""
+        self.handlers[fn.__name__] = fn
+        return fn
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self.lock:
+            if self.threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"crew-job-{index}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name="crew-job-heartbeat", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def queue_depth(self):
+        return self.store.counts()["queued"]
+
+    def submit(self, fn, dedupe_key=None, **kwargs):
+        """
+        Queue fn(**kwargs, on_event=...) and return the job record; fn must be
+        registered. If a queued or running job was submitted with the same
+        dedupe_key, that job is returned instead and both callers share it.
+        """
+        if self.handlers.get(fn.__name__) is not fn:
+            raise ValueError(f"{fn.__name__} is not registered with the job manager")
+        self.start()
+        self._prune()
+        dedupe_key = dedupe_key if SINGLEFLIGHT else None
+        # Attaching to a job already in flight costs nothing, so it is allowed even with a full queue
+        active_id = self.store.find_active(dedupe_key) if dedupe_key else None
+        if active_id is None:
+            depth = self.queue_depth()
+            if depth >= self.max_queue:
+                with self.lock:
+                    self.counters["rejected"] += 1
+                raise QueueFullError(f"Job queue is full ({depth}/{self.max_queue})")
+            job = self._new_job(fn, dedupe_key, kwargs)
+            # The store creates the job unless an identical one got there first, on this worker or another
+            active_id = self.store.create(job)
+            if active_id is None:
+                with self.lock:
+                    self.counters["submitted"] += 1
+                self.wakeup.set()
+                print(f"📥 Job {job['id']} queued (depth: {depth + 1})")
+                return job
+        active = self.store.get(active_id)
+        if active is None:
+            # Finished and pruned in the meantime
+            return self.submit(fn, dedupe_key, **kwargs)
+        with self.lock:
+            self.counters["coalesced"] += 1
+        print(f"🔗 Attached to in-flight job {active_id}")
+        return active
+
+    @staticmethod
+    def _new_job(fn, dedupe_key, kwargs):
+        return {
+            "id": uuid.uuid4().hex,
+            "task": fn.__name__,
+            "kwargs": kwargs,
+            "dedupe_key": dedupe_key,
+            "status": "queued",
+            "stage": None,
+            "stages": [],
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "worker": None,
+            "error": None,
+            "result": None,
+        }
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    async def wait(self, job_id, interval=0.25, timeout=JOB_WAIT_TIMEOUT):
+        """
+        Wait (without blocking the event loop) until a job finishes; returns the
+        final record, or raises JobTimeoutError after timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in ("completed", "failed"):
+                return job
+            if time.monotonic() >= deadline:
+                raise JobTimeoutError(f"Job {job_id} is still {job['status']} after {timeout:g}s")
+            await asyncio.sleep(interval)
+
+    def record_event(self, job_id, event):
+        """Append a pipeline event and keep the stage summary in sync"""
+        self.store.append_event(job_id, event)
+        # Stages can overlap on different threads, so the store updates the summary atomically
+        if event["status"] == "started":
+            self.store.start_stage(job_id, event["stage"], event["time"])
+        elif "elapsed_ms" in event:
+            self.store.finish_stage(job_id, event["stage"], event["elapsed_ms"])
+
+    def events_since(self, job_id, index):
+        job = self.store.get(job_id)
+        if job is None:
+            return [], None
+        return self.store.events_since(job_id, index), job["status"]
+
+    def _work(self):
+        while True:
+            try:
+                job = self.store.claim(self.worker_id, JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Could not claim a job: {e}")
+                job = None
+            if job is None:
+                # Woken immediately by local submits; polls for jobs queued by other workers
+                self.wakeup.wait(JOB_POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        """Renew the leases of this process's jobs, and requeue or fail jobs whose worker died"""
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                with self.lock:
+                    running = list(self.running)
+                if running:
+                    self.store.renew(running, self.worker_id, JOB_LEASE_SECONDS)
+                for job_id, status in self.store.reap(JOB_MAX_ATTEMPTS):
+                    print(f"💀 Job {job_id} lost its worker, {'requeued' if status == 'queued' else 'failed'}")
+                    self.store.append_event(job_id, {"stage": "job", "status": status, "time": time.time()})
+                    with self.lock:
+                        self.counters["requeued" if status == "queued" else "lost"] += 1
+                    if status == "queued":
+                        self.wakeup.set()
+            except Exception as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    def _run(self, job):
+        job_id = job["id"]
+        fn = self.handlers.get(job["task"])
+        with self.lock:
+            self.running.add(job_id)
+        try:
+            if fn is None:
+                raise RuntimeError(f"No handler registered for {job['task']}")
+            result = fn(**job["kwargs"], on_event=lambda event: self.record_event(job_id, event))
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            self._finish(job_id, "failed", error=str(e))
+            return
+        finally:
+            with self.lock:
+                self.running.discard(job_id)
+        self._finish(job_id, "completed", result=result)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        if not self.store.finish(job_id, self.worker_id, status=status, finished_at=time.time(), result=result, error=error):
+            # The lease ran out (e.g. a long stall) and the job was requeued or failed elsewhere
+            print(f"⚠️ Job {job_id} is no longer leased to this worker, dropping its {status} result")
+            return
+        with self.lock:
+            self.counters[status] += 1
+
+    def _prune(self):
+        """Drop finished jobs older than the TTL so the store stays bounded"""
+        self.store.prune(time.time() - self.ttl_seconds)
+
+    def stats(self):
+        counts = self.store.counts()
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "worker_id": self.worker_id,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": counts["queued"],
+                "running": counts["running"],
+                **self.counters,
+            }
+
+
+job_manager = JobManager()
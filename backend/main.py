@@ -1,15 +1,36 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-import wandb
-import weave
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, JSONResponse
+import asyncio
+import json
 import os
+import time
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from crew_runner import run_crew
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+# Load .env before importing modules that read configuration at import time
 load_dotenv()
+from crew_runner import run_crew, get_runtime, PIPELINE_MODE
+from jobs import job_manager, QueueFullError, JobTimeoutError
+from state_backend import process_lock
+from cache import caches, normalize_text
+from singleflight import groups as singleflight_groups
+from resilience import policies
+from image_cache import image_cache, IMAGE_RETENTION_SECONDS
+from predictions import prediction_manager
+from batch import run_batch
+from trace_queue import TraceQueue
+from history import history, HISTORY_PAGE_SIZE
+from admission import AdmissionController, AdmissionMiddleware
+from shaping import add_compression, parse_fields, shape_result, page_artifacts, ARTIFACT_PAGE_SIZE, ARTIFACT_MAX_PAGE_SIZE
+import metrics
 
 app = FastAPI()
 
+# Per-client rate limits and priority lanes; added first so CORS wraps it and 429s carry CORS headers
+admission = AdmissionController(queue_depth=job_manager.queue_depth)
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # Enable CORS for all origins (for development)
 app.add_middleware(
     CORSMiddleware,
@@ -19,50 +40,143 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps the other middleware and sees every response body
+add_compression(app)
+
 # Global variable to store W&B status
 wandb_initialized = False
 WANDB_PROJECT = os.environ.get("WANDB_PROJECT", "weavehacks")
+# Runs from every worker process / machine are grouped under one name in W&B
+WANDB_RUN_GROUP = os.environ.get("WANDB_RUN_GROUP", "api")
+# Set by Fly; lets any machine route /images requests to the one holding the file
+FLY_MACHINE_ID = os.environ.get("FLY_MACHINE_ID", "")
+# Serve /health right away and initialize W&B and the crew runtime in the background;
+# "0" does both before the server accepts requests
+FAST_START = os.environ.get("FAST_START", "1") == "1"
+
+# Background initialization progress, reported by /ready
+readiness = {"wandb": "pending", "runtime": "pending", "started_at": time.time(), "ready_at": None}
+
+job_manager.register(run_crew)
+if FLY_MACHINE_ID:
+    image_cache.listeners.append(
+        lambda digest: job_manager.store.set_value(f"image:{digest}", FLY_MACHINE_ID, IMAGE_RETENTION_SECONDS)
+    )
 
 def initialize_wandb():
     """Initialize W&B with error handling"""
     global wandb_initialized
     try:
-        wandb.init(project=WANDB_PROJECT)
+        import wandb
+
+        # Workers start together; concurrent wandb.init calls on one machine trip over each other
+        with process_lock("wandb-init"):
+            wandb.init(
+                project=WANDB_PROJECT,
+                group=WANDB_RUN_GROUP,
+                job_type="api-worker",
+                name=job_manager.worker_id,
+            )
         print(f"✅ W&B initialized successfully with project: {WANDB_PROJECT}")
         wandb_initialized = True
+        readiness["wandb"] = "ok"
     except Exception as e:
         print(f"⚠️ W&B initialization failed: {e}")
         print("⚠️ App will continue without W&B logging")
         wandb_initialized = False
+        readiness["wandb"] = "failed"
+
+def initialize_runtime():
+    """Build the shared crew runtime (LLM client, agents, Weave)"""
+    try:
+        readiness["runtime"] = "ok" if get_runtime() is not None else "disabled"
+    except Exception as e:
+        print(f"⚠️ Crew runtime initialization failed: {e}")
+        print("⚠️ It will be retried on the first crew run")
+        readiness["runtime"] = "failed"
+
+async def warm_up():
+    """Initialize W&B and the crew runtime side by side, off the event loop"""
+    await asyncio.gather(asyncio.to_thread(initialize_wandb), asyncio.to_thread(initialize_runtime))
+    readiness["ready_at"] = time.time()
+    print(f"✅ Ready after {readiness['ready_at'] - readiness['started_at']:.1f}s")
+
+def flush_trace_events(batch):
+    """Trace queue sink: one W&B log call per batch of frontend events"""
+    if wandb_initialized:
+        import wandb
+
+        wandb.log({"trace_events": batch, "trace_batch_size": len(batch)})
+    else:
+        print(f"📝 {len(batch)} trace events (W&B not available)")
+
+trace_queue = TraceQueue(flush_trace_events)
+
+metrics.gauge("job_queue_depth", "Crew jobs waiting for a worker", job_manager.queue_depth)
+metrics.gauge("trace_queue_depth", "Trace events waiting to be flushed", lambda: trace_queue.stats()["queue_depth"])
+metrics.gauge("replicate_predictions_in_flight", "Predictions not yet finished", lambda: prediction_manager.stats()["in_flight"])
+metrics.gauge(
+    "cache_hits", "Cache hits (memory + disk) per cache",
+    lambda: {name: c.counters["memory_hits"] + c.counters["disk_hits"] for name, c in caches.items()},
+    label="cache",
+)
+metrics.gauge("cache_misses", "Cache misses per cache", lambda: {name: c.counters["misses"] for name, c in caches.items()}, label="cache")
+metrics.gauge(
+    "circuit_open", "1 while a dependency's circuit breaker is open",
+    lambda: {name: int(p.state == "open") for name, p in policies.items()},
+    label="dependency",
+)
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize W&B when the app starts"""
-    initialize_wandb()
+    """Start the workers, then initialize W&B and the shared crew runtime (in the background with FAST_START)"""
+    trace_queue.start()
+    job_manager.start()
+    if FAST_START:
+        app.state.warm_up = asyncio.create_task(warm_up())
+    else:
+        await warm_up()
 
 @app.get("/health")
 def health():
+    """Liveness: the process is up and serving requests"""
     return {"status": "ok"}
 
-@app.post("/trace")
+@app.get("/ready")
+def ready():
+    """Readiness: background initialization has finished (W&B or the runtime may still have failed)"""
+    if readiness["ready_at"] is None:
+        return JSONResponse(status_code=503, content={"status": "starting", **readiness})
+    return {"status": "ready", **readiness}
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await trace_queue.stop()
+
+@app.post("/trace", status_code=202)
 async def trace_event(request: Request):
-    event = await request.json()
-    # Log the event to W&B as a custom trace (if available)
-    if wandb_initialized:
-        try:
-            wandb.log({"trace_event": event})
-        except Exception as e:
-            print(f"⚠️ Failed to log to W&B: {e}")
-    else:
-        print(f"📝 Trace event (W&B not available): {event}")
-    # Optionally, log to Weave (if using advanced tracing)
-    # weave.log(event)
-    return {"status": "logged", "event": event}
+    # Accepts a single event or an array; events are flushed to W&B in the background
+    payload = await request.json()
+    events = payload if isinstance(payload, list) else [payload]
+    accepted, dropped = trace_queue.put_many(events)
+    if dropped and not accepted:
+        raise HTTPException(status_code=429, detail="Trace queue is full", headers={"Retry-After": "5"})
+    return {"status": "queued", "accepted": accepted, "dropped": dropped}
+
+@app.get("/trace/stats")
+def trace_stats():
+    return trace_queue.stats()
 
 @app.post("/debug-wandb")
 async def debug_wandb():
     if wandb_initialized:
         try:
+            import wandb
+
             # Log a test event to W&B
             wandb.log({"debug": "Frontend-Backend-W&B connection confirmed"})
             return {"status": "ok", "message": f"Connected to W&B project: {WANDB_PROJECT}"}
@@ -73,8 +187,246 @@ async def debug_wandb():
 
 class CrewRequest(BaseModel):
     topic: str
+    qr_data: str = 'behnamshahbazi.com/qrwe'
+    # Pipeline path; defaults to PIPELINE_MODE
+    mode: Optional[Literal["crew", "direct", "hybrid"]] = None
+
+def submit_crew_job(req: CrewRequest):
+    """Queue a crew run on the worker pool, or 503 when the queue is full"""
+    try:
+        # Identical concurrent requests attach to the same job and share its result
+        dedupe_key = f"{normalize_text(req.topic)}|{req.qr_data.strip()}|{req.mode or PIPELINE_MODE}"
+        return job_manager.submit(run_crew, dedupe_key=dedupe_key, topic=req.topic, qr_data=req.qr_data, mode=req.mode)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+def result_fields(fields: Optional[str]):
+    """Parsed `fields` query parameter, or 400"""
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/run-crew")
-async def run_crew_endpoint(req: CrewRequest):
-    result = run_crew(req.topic)
-    return {"result": result}
+async def run_crew_endpoint(req: CrewRequest, fields: Optional[str] = None):
+    paths = result_fields(fields)
+    # Run on the job pool so the event loop (and /health) stays responsive
+    job = submit_crew_job(req)
+    # The job may run on another worker, so wait on the shared record rather than a local future
+    try:
+        job = await job_manager.wait(job["id"])
+    except JobTimeoutError as e:
+        # The job keeps running; its result stays available from /jobs/{job_id}/result
+        raise HTTPException(status_code=504, detail=str(e), headers={"X-Job-Id": job["id"]})
+    if job is None or job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"] if job else "Job expired")
+    # job_id lets the caller page through the research artifacts left out of the result
+    return {"job_id": job["id"], "result": shape_result(job["result"], paths)}
+
+@app.post("/jobs", status_code=202)
+async def create_job(req: CrewRequest):
+    job = submit_crew_job(req)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    stats["images"] = image_cache.stats()
+    stats["singleflight"] = {name: group.stats() for name, group in singleflight_groups.items()}
+    return stats
+
+@app.get("/resilience/status")
+def resilience_status():
+    """Breaker state, retry/hedge counters and latency per outbound dependency"""
+    return {name: policy.stats() for name, policy in policies.items()}
+
+@app.get("/admission/stats")
+def admission_stats():
+    """In-flight and waiting requests per admission lane (this worker only)"""
+    return admission.stats()
+
+@app.get("/history")
+def list_history(
+    brand: Optional[str] = None,
+    keyword: Optional[str] = None,
+    color: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """Past generations, newest first; since/until are Unix timestamps, cursor comes from next_cursor"""
+    try:
+        return history.query(brand=brand, keyword=keyword, color=color, since=since, until=until, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/history/stats")
+def history_stats():
+    return history.stats()
+
+@app.get("/history/similar")
+def similar_history(
+    topic: Optional[str] = None,
+    qr_data: Optional[str] = None,
+    keywords: str = "",
+    colors: str = "",
+    limit: int = Query(5, ge=1, le=50),
+):
+    """Earlier generations most like the given brand, payload, style keywords and colors (comma-separated)"""
+    return {"items": history.similar(topic, qr_data, keywords.split(","), colors.split(","), limit)}
+
+@app.get("/history/{generation_id}")
+def get_history(generation_id: str):
+    generation = history.get(generation_id)
+    if generation is None:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return generation
+
+@app.get("/images/{digest}")
+def get_image(digest: str, request: Request):
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = image_cache.get(digest)
+    if path is None:
+        owner = job_manager.store.get_value(f"image:{digest}") if FLY_MACHINE_ID else None
+        if owner and owner != FLY_MACHINE_ID:
+            # Generated on another machine: ask Fly's proxy to replay the request there
+            return Response(status_code=307, headers={"fly-replay": f"instance={owner}"})
+        raise HTTPException(status_code=404, detail="Image not found")
+    # The name is the content hash, so it doubles as a strong ETag
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") in (headers["ETag"], f"W/{headers['ETag']}", "*"):
+        return Response(status_code=304, headers=headers)
+    # FileResponse streams the file in chunks and answers Range / If-Range requests
+    return FileResponse(path, media_type="image/png", headers=headers)
+
+@app.get("/predictions")
+def list_predictions():
+    return {"stats": prediction_manager.stats(), "predictions": prediction_manager.list()}
+
+@app.post("/predictions/webhook")
+async def prediction_webhook(request: Request):
+    # Only used as a wake-up signal; the tracker re-reads the prediction from Replicate
+    payload = await request.json()
+    woken = prediction_manager.wake(payload.get("id", ""))
+    return {"status": "ok", "tracked": woken}
+
+@app.get("/predictions/{prediction_id}")
+def get_prediction(prediction_id: str):
+    record = prediction_manager.get(prediction_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    return record
+
+@app.delete("/predictions/{prediction_id}")
+def cancel_prediction(prediction_id: str):
+    try:
+        return prediction_manager.cancel(prediction_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not cancel prediction: {e}")
+
+@app.get("/jobs/stats")
+def job_stats():
+    return job_manager.stats()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {key: value for key, value in job.items() if key not in ("result", "events")}
+
+def completed_job(job_id: str):
+    """The finished job record, or 404/500/409"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, fields: Optional[str] = None):
+    paths = result_fields(fields)
+    return {"result": shape_result(completed_job(job_id)["result"], paths)}
+
+@app.get("/jobs/{job_id}/artifacts")
+def get_job_artifacts(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(ARTIFACT_PAGE_SIZE, ge=1, le=ARTIFACT_MAX_PAGE_SIZE),
+    max_chars: Optional[int] = Query(None, ge=0),
+):
+    """Scraped pages behind a job's result, a page at a time"""
+    return {"job_id": job_id, **page_artifacts(completed_job(job_id)["result"], offset, limit, max_chars)}
+
+
+async def job_event_stream(job_id: str, paths=None):
+    """Yield a job's pipeline events as server-sent events until it finishes"""
+    index = 0
+    while True:
+        events, status = job_manager.events_since(job_id, index)
+        for event in events:
+            kind = "token" if event["status"] == "token" else "stage"
+            yield f"event: {kind}\ndata: {json.dumps(event, default=str)}\n\n"
+        index += len(events)
+        if status in ("completed", "failed", None):
+            job = job_manager.get(job_id) or {}
+            done = {"status": status, "result": shape_result(job.get("result"), paths), "error": job.get("error")}
+            yield f"event: done\ndata: {json.dumps(done, default=str)}\n\n"
+            return
+        await asyncio.sleep(0.25)
+
+def sse_response(job_id: str, paths=None):
+    return StreamingResponse(
+        job_event_stream(job_id, paths),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, fields: Optional[str] = None):
+    paths = result_fields(fields)
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return sse_response(job_id, paths)
+
+@app.post("/run-crew/stream")
+async def run_crew_stream(req: CrewRequest, fields: Optional[str] = None):
+    paths = result_fields(fields)
+    job = submit_crew_job(req)
+    return sse_response(job["id"], paths)
+
+class BatchItem(BaseModel):
+    prompt: str
+    qr_code_content: str = 'behnamshahbazi.com/qrwe'
+    variants: int = Field(default=1, ge=1, le=16)
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=32)
+
+async def batch_event_stream(items):
+    start_time = asyncio.get_event_loop().time()
+    completed = failed = 0
+    async for result in run_batch(items):
+        if result["error"]:
+            failed += 1
+        else:
+            completed += 1
+        yield f"event: variant\ndata: {json.dumps(result)}\n\n"
+    elapsed_ms = round((asyncio.get_event_loop().time() - start_time) * 1000)
+    done = {"predictions": completed + failed, "failed": failed, "elapsed_ms": elapsed_ms}
+    yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+@app.post("/batch")
+async def batch_generate(req: BatchRequest):
+    """Generate QR art variants for many (prompt, payload) pairs, streamed as SSE"""
+    items = [item.model_dump() for item in req.items]
+    return StreamingResponse(
+        batch_event_stream(items),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,139 @@
+"""
+Minimal Prometheus-style metrics: counters and histograms rendered by /metrics.
+
+Kept dependency-free so it works on the 1-CPU Fly VM without a metrics client.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers fast cache hits up to slow diffusion runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.series.items()):
+            for i, bound in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {series[i]}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, help_text, buckets)
+        return _histograms[name]
+
+
+def counter(name, help_text):
+    with _lock:
+        if name not in _counters:
+            _counters[name] = Counter(name, help_text)
+        return _counters[name]
+
+
+def gauge(name, help_text, fn, label="key"):
+    """Register a callback whose value (number or {label value: number}) is read at scrape time"""
+    with _lock:
+        _gauges[name] = (help_text, fn, label)
+
+
+@contextmanager
+def timed(hist, **labels):
+    """Observe the duration of the block in hist; adds status="error" if it raises"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        hist.observe(time.perf_counter() - start_time, status="error", **labels)
+        raise
+    hist.observe(time.perf_counter() - start_time, status="ok", **labels)
+
+
+def render():
+    """Prometheus text exposition of every registered metric"""
+    lines = []
+    with _lock:
+        metrics = list(_histograms.values()) + list(_counters.values())
+        gauges = list(_gauges.items())
+    for metric in metrics:
+        with _lock:
+            lines.extend(metric.render())
+    for name, (help_text, fn, label_name) in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"⚠️ Gauge {name} failed: {e}")
+            continue
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                lines.append(f'{name}{{{label_name}="{label}"}} {v}')
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram("crew_stage_seconds", "Duration of run_crew pipeline stages")
+LLM_SECONDS = histogram("llm_call_seconds", "Duration of W&B inference completion calls")
+LLM_FIRST_TOKEN_SECONDS = histogram("llm_first_token_seconds", "Time to the first token of streamed W&B inference calls")
+LLM_TOKENS = counter("llm_tokens_total", "Tokens used by W&B inference completion calls")
+ADMISSION_REQUESTS = counter("admission_requests_total", "Requests admitted or rejected per admission lane and outcome")
+HTTP_SECONDS = histogram("http_client_seconds", "Duration of outbound HTTP calls")
+PREDICTION_SECONDS = histogram("replicate_prediction_seconds", "Time from prediction creation to a terminal status")
@@ -0,0 +1,304 @@
+"""
+In-process manager for Replicate predictions.
+
+Predictions are created and tracked on one background asyncio loop using the
+Replicate async client, so many generations can be in flight without holding a
+thread each. Polling backs off adaptively, a webhook can wake a tracker early,
+every prediction has a hard deadline, and abandoned predictions are canceled.
+"""
+import asyncio
+import os
+import threading
+import time
+from metrics import PREDICTION_SECONDS
+
+REPLICATE_DEPLOYMENT = os.getenv("REPLICATE_DEPLOYMENT", "behnam354/qr-code-hackathon")
+# Override to point at a local stand-in (see bench/fake_services.py)
+REPLICATE_BASE_URL = os.getenv("REPLICATE_BASE_URL") or None
+REPLICATE_DEADLINE = float(os.getenv("REPLICATE_DEADLINE", "120"))
+REPLICATE_POLL_MIN = float(os.getenv("REPLICATE_POLL_MIN", "0.5"))
+REPLICATE_POLL_MAX = float(os.getenv("REPLICATE_POLL_MAX", "5"))
+# Public base URL of this backend; when set Replicate calls /predictions/webhook on updates
+REPLICATE_WEBHOOK_URL = os.getenv("REPLICATE_WEBHOOK_URL", "")
+PREDICTION_HISTORY = int(os.getenv("PREDICTION_HISTORY", "200"))
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class PredictionError(Exception):
+    """Raised when a prediction fails, is canceled or misses its deadline"""
+
+
+class PredictionTimeout(PredictionError, TimeoutError):
+    """A prediction missed its deadline (and was canceled); unlike other failures, worth retrying"""
+
+
+class PendingPrediction:
+    """
+    A prediction submitted from outside the manager loop. result() blocks the
+    calling thread, wait() awaits from another loop; if either gives up (error,
+    timeout or cancellation) every prediction it created is canceled.
+    """
+
+    def __init__(self, manager, future):
+        self.manager = manager
+        self.future = future
+        self.prediction_ids = []
+
+    def result(self, timeout=None):
+        try:
+            return self.future.result(timeout=timeout)
+        except BaseException:
+            self.cancel()
+            raise
+
+    async def wait(self):
+        try:
+            return await asyncio.wrap_future(self.future)
+        except BaseException:
+            # Never block the caller's loop on the cancel round-trip
+            self.cancel(wait=False)
+            raise
+
+    def cancel(self, wait=True):
+        for prediction_id in list(self.prediction_ids):
+            try:
+                self.manager.cancel(prediction_id, wait=wait)
+            except Exception as e:
+                print(f"⚠️ Could not cancel prediction {prediction_id}: {e}")
+        # Also stops a retry that hasn't created its prediction yet
+        self.future.cancel()
+
+
+class PredictionManager:
+    def __init__(self, deployment_name=REPLICATE_DEPLOYMENT, deadline=REPLICATE_DEADLINE):
+        self.deployment_name = deployment_name
+        self.deadline = deadline
+        self.loop = None
+        self.thread = None
+        self.deployment = None
+        self.records = {}
+        self.wakeups = {}
+        self.active = {}  # prediction id -> Prediction being tracked on the loop
+        self.lock = threading.Lock()
+        self.counters = {"created": 0, "succeeded": 0, "failed": 0, "canceled": 0, "timed_out": 0}
+
+    def _ensure_loop(self):
+        """Start the background event loop on first use"""
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.loop.run_forever, name="replicate-predictions", daemon=True
+                )
+                self.thread.start()
+        return self.loop
+
+    async def _get_deployment(self):
+        if self.deployment is None:
+            import replicate
+
+            replicate_api_token = os.getenv("REPLICATE_API_TOKEN")
+            if not replicate_api_token:
+                raise ValueError("REPLICATE_API_TOKEN not set in environment")
+            client = replicate.Client(api_token=replicate_api_token, base_url=REPLICATE_BASE_URL)
+            self.deployment = await client.deployments.async_get(self.deployment_name)
+        return self.deployment
+
+    def submit(self, prediction_input, deadline=None, on_status=None, policy=None):
+        """
+        Create and track a prediction from any thread; returns a
+        PendingPrediction. With a policy (resilience.Policy) failed predictions
+        are retried under it, on the manager loop.
+        """
+        loop = self._ensure_loop()
+        pending = PendingPrediction(self, None)
+        kwargs = {"deadline": deadline, "on_status": on_status, "on_created": pending.prediction_ids.append}
+        if policy is not None:
+            coroutine = policy.acall(self.run, prediction_input, **kwargs)
+        else:
+            coroutine = self.run(prediction_input, **kwargs)
+        pending.future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        return pending
+
+    async def generate(self, prediction_input, deadline=None, on_status=None, policy=None):
+        """Await a prediction's output from any event loop without holding a thread"""
+        return await self.submit(prediction_input, deadline=deadline, on_status=on_status, policy=policy).wait()
+
+    async def run(self, prediction_input, deadline=None, on_status=None, on_created=None):
+        """Create a prediction and wait for its output (must run on the manager loop)"""
+        deployment = await self._get_deployment()
+        params = {}
+        if REPLICATE_WEBHOOK_URL:
+            params = {
+                "webhook": f"{REPLICATE_WEBHOOK_URL}/predictions/webhook",
+                "webhook_events_filter": ["start", "completed"],
+            }
+        prediction = await deployment.predictions.async_create(input=prediction_input, **params)
+        deadline_at = time.time() + (deadline or self.deadline)
+        record = {
+            "id": prediction.id,
+            "status": prediction.status,
+            "prompt": prediction_input.get("prompt"),
+            "num_outputs": prediction_input.get("num_outputs", 1),
+            "created_at": time.time(),
+            "deadline_at": deadline_at,
+            "finished_at": None,
+            "polls": 0,
+            "output": None,
+            "error": None,
+        }
+        with self.lock:
+            self.records[prediction.id] = record
+            self.counters["created"] += 1
+            self._prune()
+        wakeup = asyncio.Event()
+        self.wakeups[prediction.id] = wakeup
+        self.active[prediction.id] = prediction
+        if on_created:
+            on_created(prediction.id)
+        print(f"🎨 Prediction {prediction.id} created")
+
+        try:
+            return await self._track(prediction, record, wakeup, on_status)
+        except asyncio.CancelledError:
+            # The caller went away: don't keep paying for the GPU run
+            if record["finished_at"] is None:
+                await self._cancel_remote(prediction, record, "canceled")
+            raise
+        except Exception as e:
+            # Whatever broke the tracker, don't leave the GPU run going or the record in flight
+            if record["finished_at"] is None:
+                record["error"] = str(e)
+                await self._cancel_remote(prediction, record, "failed")
+            raise
+        finally:
+            self.wakeups.pop(prediction.id, None)
+            self.active.pop(prediction.id, None)
+
+    async def _track(self, prediction, record, wakeup, on_status):
+        interval = REPLICATE_POLL_MIN
+        last_status = None
+        while True:
+            if prediction.status != last_status:
+                last_status = prediction.status
+                record["status"] = last_status
+                if on_status:
+                    on_status(last_status)
+            if prediction.status in TERMINAL_STATUSES or record["finished_at"] is not None:
+                break
+            remaining = record["deadline_at"] - time.time()
+            if remaining <= 0:
+                await self._cancel_remote(prediction, record, "timed_out")
+                raise PredictionTimeout(f"Prediction {prediction.id} missed its deadline")
+            try:
+                # A webhook sets the event; otherwise poll with growing intervals
+                await asyncio.wait_for(wakeup.wait(), timeout=min(interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            interval = min(interval * 1.5, REPLICATE_POLL_MAX)
+            try:
+                await prediction.async_reload()
+            except Exception as e:
+                # A failed poll says nothing about the prediction; back off and poll again
+                print(f"⚠️ Could not poll prediction {prediction.id}: {e}")
+                continue
+            record["polls"] += 1
+
+        if record["finished_at"] is not None:
+            # Canceled through cancel(), which already counted it
+            raise PredictionError(f"Prediction {prediction.id} canceled")
+        record["finished_at"] = time.time()
+        PREDICTION_SECONDS.observe(record["finished_at"] - record["created_at"], status=prediction.status)
+        with self.lock:
+            self.counters[prediction.status] += 1
+        if prediction.status != "succeeded":
+            record["error"] = str(prediction.error or prediction.status)
+            raise PredictionError(f"Prediction {prediction.id} {prediction.status}: {record['error']}")
+        record["output"] = prediction.output
+        print(f"🎨 Prediction {prediction.id} completed in {record['finished_at'] - record['created_at']:.2f} seconds")
+        return prediction.output
+
+    async def _cancel_remote(self, prediction, record, reason):
+        record["status"] = reason
+        record["finished_at"] = time.time()
+        PREDICTION_SECONDS.observe(record["finished_at"] - record["created_at"], status=reason)
+        with self.lock:
+            self.counters[reason] += 1
+        try:
+            await prediction.async_cancel()
+            print(f"🛑 Prediction {prediction.id} canceled ({reason})")
+        except Exception as e:
+            print(f"⚠️ Could not cancel prediction {prediction.id}: {e}")
+
+    def wake(self, prediction_id):
+        """Called by the webhook endpoint: re-check a prediction right away"""
+        wakeup = self.wakeups.get(prediction_id)
+        if wakeup is None or self.loop is None:
+            return False
+        self.loop.call_soon_threadsafe(wakeup.set)
+        return True
+
+    def cancel(self, prediction_id, wait=True):
+        """
+        Cancel a prediction by id (tracked or not). A tracked one's tracker is
+        woken so its waiter fails right away instead of at the next poll.
+        wait=False schedules the cancel without waiting for Replicate.
+        """
+        async def _cancel():
+            record = self.get(prediction_id)
+            if record is not None and record["finished_at"] is not None:
+                return
+            prediction = self.active.get(prediction_id)
+            if prediction is not None:
+                await self._cancel_remote(prediction, record, "canceled")
+                wakeup = self.wakeups.get(prediction_id)
+                if wakeup is not None:
+                    wakeup.set()
+                return
+            import replicate
+
+            client = replicate.Client(api_token=os.getenv("REPLICATE_API_TOKEN"), base_url=REPLICATE_BASE_URL)
+            prediction = await client.predictions.async_get(prediction_id)
+            await prediction.async_cancel()
+            print(f"🛑 Prediction {prediction_id} canceled")
+
+        record = self.get(prediction_id)
+        if record is not None and record["finished_at"] is not None:
+            return record
+        future = asyncio.run_coroutine_threadsafe(_cancel(), self._ensure_loop())
+        if not wait:
+            return record or {"id": prediction_id, "status": "canceling"}
+        future.result(timeout=30)
+        if record is not None:
+            record["status"] = "canceled"
+        return record or {"id": prediction_id, "status": "canceled"}
+
+    def get(self, prediction_id):
+        with self.lock:
+            return self.records.get(prediction_id)
+
+    def list(self):
+        with self.lock:
+            return sorted(self.records.values(), key=lambda r: r["created_at"], reverse=True)
+
+    def _prune(self):
+        """Keep only the most recent PREDICTION_HISTORY records; caller holds self.lock"""
+        overflow = len(self.records) - PREDICTION_HISTORY
+        if overflow <= 0:
+            return
+        finished = sorted(
+            (r for r in self.records.values() if r["finished_at"] is not None),
+            key=lambda r: r["created_at"],
+        )
+        for record in finished[:overflow]:
+            del self.records[record["id"]]
+
+    def stats(self):
+        with self.lock:
+            in_flight = sum(1 for r in self.records.values() if r["finished_at"] is None)
+            return {"in_flight": in_flight, **self.counters}
+
+
+prediction_manager = PredictionManager()
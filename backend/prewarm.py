@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Build-time prewarm for the lazily imported dependencies.
+
+The server defers crewai, openai, wandb and weave until the background
+warm-up. Running this once in the image build (see Dockerfile), as the user
+the server runs as, byte-compiles the app modules and imports each heavy
+dependency once, so whatever they write on first import (bytecode, config
+and data files under $HOME) is already in the image when a container starts.
+
+    cd backend
+    python prewarm.py
+"""
+import compileall
+import importlib
+import os
+import sys
+import time
+
+HEAVY_MODULES = ("crewai", "crewai.tools", "openai", "wandb", "weave", "replicate", "wandb_llm", "main")
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    # Importing main must not try to reach W&B from the build
+    os.environ.setdefault("WANDB_MODE", "disabled")
+    failed = []
+    for name in HEAVY_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            failed.append(name)
+            print(f"⚠️ {name}: {e}")
+            continue
+        print(f"🔥 {name} imported in {time.perf_counter() - start:.2f}s")
+    compileall.compile_dir(here, quiet=1)
+    if failed:
+        print(f"⚠️ Not prewarmed: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
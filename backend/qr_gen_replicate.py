@@ -1,91 +1,196 @@
-from crewai.tools import tool
+import os
 import time
+from image_cache import image_cache, input_key
+from predictions import prediction_manager, REPLICATE_DEADLINE
+from resilience import Policy
+from qr_verify import verify_image, verification_enabled
+from tracing import traced
+from singleflight import SingleFlight
+
+# Deterministic mode pins the seed so identical requests can be served from the image cache
+QR_DETERMINISTIC = os.getenv("QR_DETERMINISTIC", "1") == "1"
+QR_SEED = int(os.getenv("QR_SEED", "1234"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "")
+# Concurrent requests for the same pinned-seed input share one GPU run
+prediction_flight = SingleFlight("predictions")
+# Best-of-N: outputs per generation; ones that fail local verification are re-issued
+# with a stronger ControlNet weight (higher = more scannable, less artistic)
+QR_VARIANTS = int(os.getenv("QR_VARIANTS", "1"))
+QR_VERIFY_RETRIES = int(os.getenv("QR_VERIFY_RETRIES", "2"))
+QR_CONDITIONING_SCALE = float(os.getenv("QR_CONDITIONING_SCALE", "1.2"))
+QR_CONDITIONING_STEP = float(os.getenv("QR_CONDITIONING_STEP", "0.25"))
+QR_CONDITIONING_MAX = float(os.getenv("QR_CONDITIONING_MAX", "2.0"))
+# Each prediction already has REPLICATE_DEADLINE; never hedged since duplicates cost GPU time
+REPLICATE_RETRIES = int(os.getenv("REPLICATE_RETRIES", "1"))
+replicate_policy = Policy(
+    "replicate", REPLICATE_DEADLINE * (REPLICATE_RETRIES + 1), retries=REPLICATE_RETRIES, hedge=False
+)
+# Extra seconds a caller waits past the policy deadline before giving up on its own
+REPLICATE_WAIT_GRACE = 5
+
+def build_prediction_input(prompt: str, qr_code_content: str, seed: int = None, num_outputs: int = 1, conditioning_scale: float = None) -> dict:
+    """Replicate input dict for the qr-code-hackathon deployment"""
+    if seed is None:
+        seed = QR_SEED if QR_DETERMINISTIC else -1
+    if conditioning_scale is None:
+        conditioning_scale = QR_CONDITIONING_SCALE
+    return {
+        "prompt": prompt,
+        "seed": seed,
+        "width": 768,
+        "border": 2,
+        "height": 768,
+        "num_outputs": num_outputs,
+        "guidance_scale": 7.5,
+        "negative_prompt": "Foreboding mystical, unblended, worst quality, normal quality, low quality, low res, blurry, ugly, disfigured, nsfw, people, animal, character, anime",
+        "qr_code_content": qr_code_content,
+        "qrcode_background": "white",
+        "num_inference_steps": 40,
+        "controlnet_conditioning_scale": conditioning_scale
+    }
+
+def cached_image_url(digest: str) -> str:
+    return f"{PUBLIC_BASE_URL}/images/{digest}"
 
 # 1. Create a regular function (no decorators)
 def generate_qr_art_func(prompt: str, qr_code_content: str = "behnamshahbazi.com/qrwe") -> str:
     """
     Generates a QR code art image using Replicate based on a text prompt.
-    Returns the Replicate image URL (frontend can render this directly).
-    Uses the deployment 'behnam354/qr-code-hackathon'.
+    Returns the /images/<digest> URL of the stored image (the Replicate URL if
+    the download fails); the frontend renders either directly.
+    Uses the deployment 'behnam354/qr-code-hackathon' (REPLICATE_DEPLOYMENT).
     """
-    import replicate
-    import requests
-    import os
+    return run_qr_prediction(prompt, qr_code_content=qr_code_content)
 
+def run_qr_prediction(prompt: str, qr_code_content: str = "behnamshahbazi.com/qrwe", on_status=None) -> str:
+    """
+    Same as generate_qr_art_func, but calls on_status(status) each time the
+    Replicate prediction changes state (starting, processing, succeeded, ...).
+    Kept separate so the CrewAI tool schema only exposes prompt and payload.
+    """
     try:
-        print(f"🎨 [TOOL] Generating QR art with prompt: {prompt}")
-        print(f"🎨 [TOOL] Starting Replicate API call...")
-        
-        replicate_api_token = os.getenv("REPLICATE_API_TOKEN")
-        if not replicate_api_token:
-            raise ValueError("REPLICATE_API_TOKEN not set in environment")
-        
-        print(f"🎨 [TOOL] API token found, initializing client...")
-        client = replicate.Client(api_token=replicate_api_token)
-        
-        print(f"🎨 [TOOL] Getting deployment...")
-        deployment = client.deployments.get("behnam354/qr-code-hackathon")
-        print(f"🎨 [TOOL] Deployment retrieved: {deployment}")
-        
-        print(f"🎨 [TOOL] Creating prediction...")
-        prediction = deployment.predictions.create(
-            input={
-                "prompt": prompt,
-                "seed": -1,
-                "width": 768,
-                "border": 2,
-                "height": 768,
-                "num_outputs": 1,
-                "guidance_scale": 7.5,
-                "negative_prompt": "Foreboding mystical, unblended, worst quality, normal quality, low quality, low res, blurry, ugly, disfigured, nsfw, people, animal, character, anime",
-                "qr_code_content": qr_code_content,
-                "qrcode_background": "white",
-                "num_inference_steps": 40,
-                "controlnet_conditioning_scale": 1.2
-            }
-        )
-        print(f"🎨 [TOOL] Prediction created: {prediction.id}")
-        
-        print(f"🎨 [TOOL] Waiting for prediction to complete...")
-        start_time = time.time()
-        try:
-            prediction.wait()  # 1 minute timeout
-        except Exception as wait_error:
-            print(f"❌ [TOOL] Prediction wait failed: {wait_error}")
-            raise
-        end_time = time.time()
-        print(f"🎨 [TOOL] Prediction completed in {end_time - start_time:.2f} seconds")
-        
-        output = prediction.output
-        print(f"🎨 [TOOL] Replicate output: {output}")
-        
-        if not output or not isinstance(output, list):
-            raise ValueError("No output from Replicate prediction")
-        
-        image_url = output[0]
-        print(f"🎨 [TOOL] Image URL: {image_url}")
-        
-        # Optionally download and save locally for logging
-        try:
-            print(f"🎨 [TOOL] Downloading image...")
-            image_data = requests.get(image_url, timeout=30).content
-            file_path = "qr_code_art.png"
-            with open(file_path, "wb") as f:
-                f.write(image_data)
-            print(f"🎨 [TOOL] Image saved to: {file_path}")
-        except Exception as e:
-            print(f"⚠️ [TOOL] Could not save image locally: {e}")
-        
-        return image_url
-        
+        return generate_qr_variants(prompt, qr_code_content, on_status=on_status)["qr_code_url"]
     except Exception as e:
         print(f"❌ [TOOL] Error in generate_qr_art_func: {e}")
         import traceback
         print(f"❌ [TOOL] Full traceback: {traceback.format_exc()}")
         return f"Error generating QR code art: {str(e)}"
 
-# 2. Decorate the function to register as a CrewAI tool
-generate_qr_art = tool("QRCodeArtGenerator")(generate_qr_art_func)
+@traced
+def predict_images(prediction_input: dict, on_status=None) -> list:
+    """
+    Run one prediction and store its outputs; returns [{"url", "digest"}].
+    "digest" is None for outputs that could not be downloaded.
+    """
+    print(f"🎨 [TOOL] Generating QR art with prompt: {prediction_input['prompt']}")
+    cache_key = image_cache_key(prediction_input)
+    images = cached_images(cache_key)
+    if images:
+        print(f"🎨 [TOOL] Image cache hit: {[image['digest'] for image in images]}")
+        if on_status:
+            on_status("cached")
+        return images
+    if cache_key:
+        return prediction_flight.do(cache_key, run_prediction, prediction_input, cache_key, on_status)
+    return run_prediction(prediction_input, cache_key, on_status)
+
+def run_prediction(prediction_input: dict, cache_key: str = None, on_status=None) -> list:
+    """Uncached part of predict_images: create the prediction and stream its outputs into the store"""
+    print("🎨 [TOOL] Starting Replicate prediction...")
+    start_time = time.time()
+    output = await_prediction(prediction_input, on_status)
+    end_time = time.time()
+    print(f"🎨 [TOOL] Prediction completed in {end_time - start_time:.2f} seconds")
+
+    print(f"🎨 [TOOL] Replicate output: {output}")
+    return store_outputs(output, cache_key)
+
+def image_cache_key(prediction_input: dict):
+    """Image store key for an input; a random seed (-1) never repeats, so only pinned seeds get one"""
+    return input_key(prediction_input) if prediction_input["seed"] != -1 else None
+
+def cached_images(cache_key):
+    """[{"url", "digest"}] already stored for cache_key, or None"""
+    digests = image_cache.lookup(cache_key) if cache_key else None
+    if not digests:
+        return None
+    return [{"url": cached_image_url(digest), "digest": digest} for digest in digests]
+
+def store_outputs(output, cache_key: str = None) -> list:
+    """Stream a prediction's output URLs into the image store; returns [{"url", "digest"}]"""
+    if not output or not isinstance(output, list):
+        raise ValueError("No output from Replicate prediction")
+
+    images = []
+    for image_url in output:
+        # Stream into the content-addressed store; Replicate URLs expire after an hour
+        try:
+            digest = image_cache.download(str(image_url))
+            print(f"🎨 [TOOL] Image stored as: {digest}")
+            images.append({"url": cached_image_url(digest), "digest": digest})
+        except Exception as e:
+            print(f"⚠️ [TOOL] Could not store image locally: {e}")
+            images.append({"url": str(image_url), "digest": None})
+    if cache_key and all(image["digest"] for image in images):
+        image_cache.remember(cache_key, [image["digest"] for image in images])
+    return images
+
+def await_prediction(prediction_input: dict, on_status=None):
+    """
+    Create one prediction and wait for its output. Tracking and retries under
+    replicate_policy run on the prediction manager's loop, so only the calling
+    thread waits; if it gives up, the prediction is canceled on Replicate.
+    """
+    pending = prediction_manager.submit(prediction_input, on_status=on_status, policy=replicate_policy)
+    return pending.result(timeout=replicate_policy.deadline + REPLICATE_WAIT_GRACE)
+
+UNVERIFIED = {"verified": False, "passed": None, "score": None}
+
+def verify_output(image: dict, qr_code_content: str) -> dict:
+    """verify_image report for a stored image; images that couldn't be stored are left unverified"""
+    if not image["digest"]:
+        return UNVERIFIED
+    return verify_image(image_cache.path_for(image["digest"]), qr_code_content)
+
+@traced
+def generate_qr_variants(prompt: str, qr_code_content: str, on_status=None, on_variant=None) -> dict:
+    """
+    Generate QR_VARIANTS images, verify each one scans locally and re-issue only
+    the failing ones with a higher controlnet_conditioning_scale, up to
+    QR_VERIFY_RETRIES times. Returns {"qr_code_url", "verification", "variants"}
+    for the best variant; on_variant(variant) is called as each one is scored.
+    """
+    verify = verification_enabled()
+    scale = QR_CONDITIONING_SCALE
+    num_outputs = QR_VARIANTS
+    variants = []
+    for attempt in range(QR_VERIFY_RETRIES + 1 if verify else 1):
+        prediction_input = build_prediction_input(
+            prompt, qr_code_content, num_outputs=num_outputs, conditioning_scale=scale
+        )
+        failing = 0
+        for image in predict_images(prediction_input, on_status=on_status):
+            report = verify_output(image, qr_code_content) if verify else UNVERIFIED
+            variant = {"url": image["url"], "attempt": attempt, "conditioning_scale": scale, **report}
+            variants.append(variant)
+            if on_variant:
+                on_variant(variant)
+            if report["passed"] is False:
+                failing += 1
+        if any(variant["passed"] is not False for variant in variants) or scale >= QR_CONDITIONING_MAX:
+            break
+        print(f"🔁 [TOOL] {failing} variant(s) failed to scan, retrying with conditioning scale {scale + QR_CONDITIONING_STEP:.2f}")
+        num_outputs = failing
+        scale = min(scale + QR_CONDITIONING_STEP, QR_CONDITIONING_MAX)
+
+    best = max(variants, key=lambda v: (v["passed"] is not False, v["score"] or 0))
+    return {"qr_code_url": best["url"], "verification": best, "variants": variants}
+
+# 2. Register the function as a CrewAI tool; built on demand because crewai is slow to import
+def qr_art_tool():
+    from crewai.tools import tool
+
+    return tool("QRCodeArtGenerator")(generate_qr_art_func)
 
 # 3. ✅ Test the undecorated function directly
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""
+Local, CPU-only scannability check for generated QR art.
+
+The image is decoded as-is and again after downscaling and blurring (roughly
+what a phone camera at a distance sees). The robustness score is the fraction
+of those views that decode to the expected payload. Decoding uses the first
+available of zxing-cpp, pyzbar or OpenCV; without any of them (or Pillow)
+verification is skipped and images are reported as unverified.
+"""
+import os
+from tracing import traced
+
+QR_VERIFY = os.getenv("QR_VERIFY", "1") == "1"
+QR_VERIFY_MIN_SCORE = float(os.getenv("QR_VERIFY_MIN_SCORE", "0.6"))
+
+_decoder = None
+_decoder_name = None
+
+
+def _load_decoder():
+    """Pick a decoder once; returns (name, decode(pil_image) -> list of strings)"""
+    global _decoder, _decoder_name
+    if _decoder_name is not None:
+        return _decoder_name, _decoder
+    _decoder_name = "none"
+    try:
+        import PIL.Image  # noqa: F401 - every decoder below is fed Pillow images
+    except ImportError:
+        print("⚠️ Pillow not installed - QR verification disabled")
+        return _decoder_name, _decoder
+    try:
+        import zxingcpp
+
+        _decoder_name = "zxing-cpp"
+        _decoder = lambda image: [r.text for r in zxingcpp.read_barcodes(image, formats=zxingcpp.BarcodeFormat.QRCode)]
+        return _decoder_name, _decoder
+    except ImportError:
+        pass
+    try:
+        from pyzbar import pyzbar
+
+        _decoder_name = "pyzbar"
+        _decoder = lambda image: [r.data.decode("utf-8", "replace") for r in pyzbar.decode(image)]
+        return _decoder_name, _decoder
+    except ImportError:
+        # pyzbar also raises ImportError when the zbar shared library is missing
+        pass
+    try:
+        import cv2
+        import numpy
+
+        detector = cv2.QRCodeDetector()
+
+        def decode_cv2(image):
+            text, _, _ = detector.detectAndDecode(numpy.array(image.convert("RGB")))
+            return [text] if text else []
+
+        _decoder_name = "opencv"
+        _decoder = decode_cv2
+        return _decoder_name, _decoder
+    except ImportError:
+        pass
+    print("⚠️ No QR decoder installed (zxing-cpp, pyzbar or opencv) - QR verification disabled")
+    return _decoder_name, _decoder
+
+
+def verification_enabled():
+    return QR_VERIFY and _load_decoder()[1] is not None
+
+
+def _views(image):
+    """The original image plus degraded copies a scan should survive"""
+    from PIL import ImageFilter
+
+    width, height = image.size
+    yield "original", image
+    yield "half", image.resize((max(1, width // 2), max(1, height // 2)))
+    yield "quarter", image.resize((max(1, width // 4), max(1, height // 4)))
+    yield "blur", image.filter(ImageFilter.GaussianBlur(radius=max(1, width // 384)))
+    yield "heavy_blur", image.filter(ImageFilter.GaussianBlur(radius=max(2, width // 192)))
+
+
+@traced
+def verify_image(path, expected):
+    """
+    Decode the image at path and score how reliably it yields `expected`.
+    Returns {"verified", "decoded", "matches", "score", "passed", "views"};
+    "verified" is False (and "passed" None) when no decoder is available.
+    """
+    name, decode = _load_decoder()
+    if decode is None or not QR_VERIFY:
+        return {"verified": False, "decoder": name, "decoded": None, "matches": None, "score": None, "passed": None, "views": {}}
+
+    from PIL import Image
+
+    expected = expected.strip()
+    views = {}
+    decoded = None
+    with Image.open(path) as image:
+        image = image.convert("L")
+        for view_name, view in _views(image):
+            try:
+                texts = decode(view)
+            except Exception as e:
+                print(f"⚠️ QR decode failed on {view_name} view: {e}")
+                texts = []
+            if view_name == "original" and texts:
+                decoded = texts[0]
+            views[view_name] = any(text.strip() == expected for text in texts)
+    score = sum(views.values()) / len(views)
+    matches = views["original"]
+    return {
+        "verified": True,
+        "decoder": name,
+        "decoded": decoded,
+        "matches": matches,
+        "score": round(score, 3),
+        "passed": matches and score >= QR_VERIFY_MIN_SCORE,
+        "views": views,
+    }
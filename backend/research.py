@@ -0,0 +1,148 @@
+"""
+Brand research helpers: Exa search and Browserbase scraping.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, urlunsplit
+from cache import TTLCache, normalize_text, CACHE_STALE_SECONDS
+from http_client import session, HTTP_CONNECT_TIMEOUT
+from resilience import Policy
+from tracing import traced
+from singleflight import SingleFlight
+
+# Base URLs can point at local stand-ins (see bench/fake_services.py)
+EXA_BASE_URL = os.getenv("EXA_BASE_URL", "https://api.exa.ai")
+BROWSERBASE_BASE_URL = os.getenv("BROWSERBASE_BASE_URL", "https://api.browserbase.com")
+EXA_NUM_RESULTS = int(os.getenv("EXA_NUM_RESULTS", "3"))
+EXA_TIMEOUT = float(os.getenv("EXA_TIMEOUT", "15"))
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "4"))
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "20"))
+SCRAPE_DEADLINE = float(os.getenv("SCRAPE_DEADLINE", "25"))
+SCRAPE_MAX_CHARS = int(os.getenv("SCRAPE_MAX_CHARS", "200000"))
+EXA_CACHE_TTL = int(os.getenv("EXA_CACHE_TTL", str(24 * 3600)))
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", str(3 * 24 * 3600)))
+# Total time per search / page including retries and hedges (see resilience.py)
+EXA_DEADLINE = float(os.getenv("EXA_DEADLINE", "20"))
+EXA_RETRIES = int(os.getenv("EXA_RETRIES", "2"))
+EXA_HEDGE = os.getenv("EXA_HEDGE", "1") == "1"
+BROWSERBASE_DEADLINE = float(os.getenv("BROWSERBASE_DEADLINE", "20"))
+BROWSERBASE_RETRIES = int(os.getenv("BROWSERBASE_RETRIES", "1"))
+BROWSERBASE_HEDGE = os.getenv("BROWSERBASE_HEDGE", "1") == "1"
+
+exa_cache = TTLCache("exa_search", EXA_CACHE_TTL, stale_seconds=CACHE_STALE_SECONDS)
+page_cache = TTLCache("scraped_pages", PAGE_CACHE_TTL, stale_seconds=CACHE_STALE_SECONDS)
+exa_policy = Policy("exa", EXA_DEADLINE, retries=EXA_RETRIES, hedge=EXA_HEDGE)
+browserbase_policy = Policy("browserbase", BROWSERBASE_DEADLINE, retries=BROWSERBASE_RETRIES, hedge=BROWSERBASE_HEDGE)
+# Concurrent runs for the same brand share one Exa query / one scrape per page
+exa_flight = SingleFlight("exa_search")
+page_flight = SingleFlight("scraped_pages")
+
+# Shared across requests so total scrape fan-out stays bounded on a small VM
+scrape_pool = ThreadPoolExecutor(max_workers=SCRAPE_MAX_WORKERS, thread_name_prefix="scrape")
+
+
+def normalize_url(url):
+    """Cache key for a URL: lowercase scheme and host, no fragment or trailing slash"""
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+
+@traced
+def search_with_exa(brand_name):
+    """Return up to EXA_NUM_RESULTS URLs about the brand's visual identity"""
+    cache_key = f"{normalize_text(brand_name)}|{EXA_NUM_RESULTS}"
+    cached = exa_cache.get(cache_key)
+    if cached is not None:
+        print({"exa_cache_hit": brand_name, "exa_results": cached})
+        return cached
+    return exa_flight.do(cache_key, fetch_exa_results, brand_name, cache_key)
+
+
+def fetch_exa_results(brand_name, cache_key):
+    print({"exa_query": brand_name})
+    return exa_policy.call(post_exa_search, brand_name, cache_key, stale=lambda: exa_cache.get_stale(cache_key))
+
+
+def post_exa_search(brand_name, cache_key):
+    resp = session.post(
+        f"{EXA_BASE_URL}/search",
+        headers={"Authorization": f"Bearer {os.getenv('EXA_API_KEY', 'your_exa_api_key')}"},
+        json={"query": f"{brand_name} visual identity", "numResults": EXA_NUM_RESULTS},
+        timeout=(HTTP_CONNECT_TIMEOUT, EXA_TIMEOUT),
+    )
+    resp.raise_for_status()
+    urls = [r["url"] for r in resp.json().get("results", [])]
+    print({"exa_results": urls})
+    if urls:
+        exa_cache.set(cache_key, urls)
+    return urls
+
+
+@traced
+def scrape_page(url):
+    """Fetch the text of a single page through Browserbase (cached per normalized URL)"""
+    cache_key = normalize_url(url)
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        print({"scrape_cache_hit": url})
+        return cached
+    return page_flight.do(cache_key, fetch_page, url, cache_key)
+
+
+def fetch_page(url, cache_key):
+    print({"scrape_url": url})
+    return browserbase_policy.call(post_scrape, url, cache_key, stale=lambda: page_cache.get_stale(cache_key))
+
+
+def post_scrape(url, cache_key):
+    resp = session.post(
+        f"{BROWSERBASE_BASE_URL}/scrape",
+        headers={"Authorization": f"Bearer {os.getenv('BROWSERBASE_API_KEY', 'your_browserbase_api_key')}"},
+        json={"url": url},
+        timeout=(HTTP_CONNECT_TIMEOUT, SCRAPE_TIMEOUT),
+    )
+    resp.raise_for_status()
+    text = resp.json().get("text", "")[:SCRAPE_MAX_CHARS]
+    if text:
+        page_cache.set(cache_key, text)
+    return text
+
+
+def scrape_with_browserbase(urls, on_page=None, deadline=SCRAPE_DEADLINE):
+    """
+    Scrape all urls concurrently and return [{"url", "text"}] in input order.
+
+    Pages that fail or are still running when the deadline passes are left out,
+    so one slow site can't hold up the rest. on_page(url, chars, elapsed_ms, error)
+    is called as each page finishes.
+    """
+    start_time = time.time()
+
+    def fetch(url):
+        page_start = time.time()
+        try:
+            text = scrape_page(url)
+        except Exception as e:
+            print(f"⚠️ Scrape failed for {url}: {e}")
+            if on_page:
+                on_page(url, 0, round((time.time() - page_start) * 1000), str(e))
+            raise
+        if on_page:
+            on_page(url, len(text), round((time.time() - page_start) * 1000), None)
+        return text
+
+    futures = {url: scrape_pool.submit(fetch, url) for url in urls}
+    done, not_done = wait(futures.values(), timeout=deadline)
+    for future in not_done:
+        future.cancel()
+
+    out = []
+    for url, future in futures.items():
+        if future in done and future.exception() is None:
+            out.append({"url": url, "text": future.result()})
+        elif future not in done:
+            print(f"⚠️ Scrape for {url} missed the {deadline}s deadline")
+    print({"scraped": [r["url"] for r in out], "elapsed_ms": round((time.time() - start_time) * 1000)})
+    return out
@@ -0,0 +1,371 @@
+"""
+Deadlines, retries, hedging and circuit breakers for outbound dependencies.
+
+Every dependency (Exa, Browserbase, W&B Inference, Replicate) calls through
+its own Policy:
+
+- the whole call, retries included, must finish within `deadline` seconds
+- attempts that fail with a connection error, a timeout, 429 or 5xx are
+  retried up to `retries` times after a full-jitter exponential backoff;
+  anything else (other 4xx, a rejected prediction, a config error) is raised
+  at once and doesn't count against the breaker
+- with `hedge`, an attempt still running after the HEDGE_PERCENTILE latency
+  of recent successful calls gets one duplicate, and the first result wins
+- after BREAKER_FAILURES failed calls in a row the breaker opens and calls
+  fail fast for BREAKER_COOLDOWN seconds, then one trial call is let through
+
+While a call fails or the breaker is open, the `stale` callback (usually a
+cache's get_stale) can supply an expired result instead of an error. Every
+policy registers itself in `policies` for /resilience/status.
+
+Attempts the caller stops waiting for (deadline passed, a hedge won) keep
+running on their pool thread, so each one gets a cancellation event:
+`cancelled()` tells the attempt to stop, and `check_cancelled()` raises
+AttemptCancelled. Check them before spending on a paid call or firing a
+callback. Coroutine
+functions go through `acall`, which awaits attempts on the caller's loop
+instead of holding a pool thread, and cancels them at the deadline.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+RESILIENCE_POOL_SIZE = int(os.getenv("RESILIENCE_POOL_SIZE", "32"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# Successful calls to observe before hedging kicks in, and how many are remembered
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+policies = {}
+# What Policy._allow returns for the single trial call of a half-open breaker
+PROBE = "probe"
+
+# Attempts run here so the caller can wait with a deadline and launch hedges
+attempt_pool = ThreadPoolExecutor(max_workers=RESILIENCE_POOL_SIZE, thread_name_prefix="attempt")
+# Cancellation events of the attempts the current code runs in, outermost first
+attempt_cancel_events = contextvars.ContextVar("attempt_cancel_events", default=())
+
+
+class CircuitOpenError(Exception):
+    """Raised when a dependency's breaker is open and no stale result is available"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call (including its retries) runs past the policy deadline"""
+
+
+class AttemptCancelled(Exception):
+    """Raised inside an attempt whose caller is no longer waiting for it"""
+
+
+def cancelled():
+    """True inside an attempt (or one it is nested in) whose result is no longer wanted"""
+    return any(event.is_set() for event in attempt_cancel_events.get())
+
+
+def check_cancelled():
+    if cancelled():
+        raise AttemptCancelled("attempt abandoned by its caller")
+
+
+@functools.lru_cache(maxsize=1)
+def transport_errors():
+    """Exception types for requests that got no answer: connection failures and timeouts"""
+    errors = [ConnectionError, TimeoutError, DeadlineExceeded]
+    try:
+        import requests
+
+        errors += [requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError]
+    except ImportError:
+        pass
+    try:
+        import httpx
+
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        import openai
+
+        # Includes APITimeoutError
+        errors.append(openai.APIConnectionError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_retryable(error):
+    """Connection errors, timeouts, 429 and 5xx are worth another try; nothing else is"""
+    if isinstance(error, transport_errors()):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def _run_attempt(fn, args, kwargs):
+    # An attempt that waited in the pool queue past its caller's patience never starts
+    check_cancelled()
+    return fn(*args, **kwargs)
+
+
+class Policy:
+    def __init__(self, name, deadline, retries=2, hedge=True, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+            "timeouts": 0, "short_circuits": 0, "stale_served": 0, "rejected": 0,
+        }
+        policies[name] = self
+
+    def call(self, fn, *args, stale=None, hedge=True, **kwargs):
+        """
+        Return fn(*args, **kwargs) under this policy. On failure, or while the
+        breaker is open, return stale() if it gives something other than None.
+        hedge=False skips hedging for calls whose attempts have visible side
+        effects while they run, such as streaming tokens to a client.
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+        allowed = self._allow()
+        if not allowed:
+            with self.lock:
+                self.counters["short_circuits"] += 1
+            return self._fallback(stale, CircuitOpenError(f"{self.name} circuit is open"))
+
+        try:
+            deadline = time.monotonic() + self.deadline
+            attempt = 0
+            while True:
+                try:
+                    result = self._attempt(fn, args, kwargs, deadline, hedge)
+                except AttemptCancelled:
+                    # Says nothing about the dependency; the finally releases a probe
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        # A bad request, rejected input or missing config: the dependency itself is fine
+                        self._record(success=True, outcome="rejected")
+                        raise
+                    attempt += 1
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        self._record(success=False)
+                        return self._fallback(stale, e)
+                    time.sleep(delay)
+                    # A call nested in an abandoned attempt has nobody left to retry for
+                    check_cancelled()
+                    continue
+                self._record(success=True)
+                return result
+        finally:
+            if allowed == PROBE:
+                self._end_probe()
+
+    async def acall(self, fn, *args, stale=None, **kwargs):
+        """
+        Async counterpart of call() for a coroutine function: each attempt is
+        awaited on the caller's loop and cancelled if it outlives the deadline.
+        There is no hedging.
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+        allowed = self._allow()
+        if not allowed:
+            with self.lock:
+                self.counters["short_circuits"] += 1
+            return self._fallback(stale, CircuitOpenError(f"{self.name} circuit is open"))
+
+        try:
+            deadline = time.monotonic() + self.deadline
+            attempt = 0
+            while True:
+                start = time.monotonic()
+                try:
+                    try:
+                        result = await asyncio.wait_for(fn(*args, **kwargs), max(0.0, deadline - start))
+                    except asyncio.TimeoutError:
+                        if time.monotonic() < deadline:
+                            # The attempt's own timeout, not the policy deadline
+                            raise
+                        with self.lock:
+                            self.counters["timeouts"] += 1
+                        raise DeadlineExceeded(f"{self.name} missed its {self.deadline}s deadline")
+                except Exception as e:
+                    if not is_retryable(e):
+                        self._record(success=True, outcome="rejected")
+                        raise
+                    attempt += 1
+                    delay = self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        self._record(success=False)
+                        return self._fallback(stale, e)
+                    await asyncio.sleep(delay)
+                    continue
+                with self.lock:
+                    self.latencies.append(time.monotonic() - start)
+                self._record(success=True)
+                return result
+        finally:
+            if allowed == PROBE:
+                self._end_probe()
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Jittered backoff before retry number `attempt`, or None once the call should fail"""
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if isinstance(error, DeadlineExceeded) or attempt > self.retries or time.monotonic() + delay >= deadline:
+            return None
+        print(f"🔁 {self.name} attempt {attempt} failed ({error}), retrying in {delay:.2f}s")
+        with self.lock:
+            self.counters["retries"] += 1
+        return delay
+
+    def _attempt(self, fn, args, kwargs, deadline, hedge):
+        """
+        One attempt, plus a hedged duplicate if it outlives the latency
+        percentile. Whatever ends the wait, every attempt still running is
+        told to stop through its cancellation event.
+        """
+        start = time.monotonic()
+        hedge_after = self.hedge_after() if hedge else None
+        cancel_events = {}
+        primary = self._submit(fn, args, kwargs, cancel_events)
+        pending = {primary}
+        hedged = False
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    with self.lock:
+                        self.counters["timeouts"] += 1
+                    raise DeadlineExceeded(f"{self.name} missed its {self.deadline}s deadline")
+                timeout = remaining
+                if hedge_after is not None and not hedged:
+                    timeout = min(remaining, max(0.0, start + hedge_after - now))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        with self.lock:
+                            self.latencies.append(time.monotonic() - start)
+                            if future is not primary:
+                                self.counters["hedge_wins"] += 1
+                        return future.result()
+                    error = error or future.exception()
+                if not done and hedge_after is not None and not hedged and time.monotonic() < deadline:
+                    hedged = True
+                    with self.lock:
+                        self.counters["hedges"] += 1
+                    pending.add(self._submit(fn, args, kwargs, cancel_events))
+            raise error
+        finally:
+            for event in cancel_events.values():
+                event.set()
+
+    @staticmethod
+    def _submit(fn, args, kwargs, cancel_events):
+        """Start an attempt on the pool with its own cancellation event (added to cancel_events)"""
+        # Each attempt gets a copy of the caller's context so Weave spans nest under the caller
+        context = contextvars.copy_context()
+        event = threading.Event()
+        context.run(attempt_cancel_events.set, attempt_cancel_events.get() + (event,))
+        future = attempt_pool.submit(context.run, _run_attempt, fn, args, kwargs)
+        cancel_events[future] = event
+        return future
+
+    def hedge_after(self):
+        """Seconds after which an attempt is hedged, or None (hedging off or too few samples)"""
+        with self.lock:
+            if not self.hedge or len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))]
+
+    def _allow(self):
+        """
+        Breaker check: closed lets everything through, half-open a single trial
+        call. Returns PROBE for that trial call, so it can be released if it
+        ends (cancelled, abandoned) without a result to record.
+        """
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return PROBE
+            return False
+
+    def _end_probe(self):
+        """Let another trial call through if this one ended without _record() settling the breaker"""
+        with self.lock:
+            if self.state == "half_open":
+                self.probing = False
+
+    def _record(self, success, outcome=None):
+        with self.lock:
+            self.counters[outcome or ("successes" if success else "failures")] += 1
+            if success:
+                if self.state != "closed":
+                    print(f"✅ {self.name} circuit closed")
+                self.state = "closed"
+                self.consecutive_failures = 0
+                self.probing = False
+                return
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"⚠️ {self.name} circuit opened after {self.consecutive_failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def _fallback(self, stale, error):
+        value = stale() if stale is not None else None
+        if value is None:
+            raise error
+        print(f"♻️ {self.name} unavailable ({error}), serving stale result")
+        with self.lock:
+            self.counters["stale_served"] += 1
+        return value
+
+    def stats(self):
+        hedge_after = self.hedge_after()
+        with self.lock:
+            ordered = sorted(self.latencies)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_for_s": round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+                if self.state == "open" else None,
+                "deadline_s": self.deadline,
+                "max_retries": self.retries,
+                "hedge_after_ms": round(hedge_after * 1000) if hedge_after is not None else None,
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000) if ordered else None,
+                **self.counters,
+            }
@@ -0,0 +1,104 @@
+"""
+Response shaping for crew results, and compression for large responses.
+
+A run_crew result carries the raw text of every scraped page, which nobody
+reads in the UI. Responses leave it out unless asked for: `fields` selects
+top-level keys or dotted paths into nested ones (`style.color_palette`), and
+`*` returns everything. The pages themselves are served a few at a time from
+GET /jobs/{job_id}/artifacts.
+
+COMPRESSION picks the encoding for responses over COMPRESSION_MIN_BYTES:
+"auto" uses brotli when brotli-asgi is installed (falling back to gzip for
+clients without br support) and gzip otherwise; "gzip" or "off" force it.
+Server-sent event streams and images are never compressed.
+"""
+import os
+
+COMPRESSION = os.getenv("COMPRESSION", "auto")
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1000"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+ARTIFACT_PAGE_SIZE = int(os.getenv("ARTIFACT_PAGE_SIZE", "1"))
+ARTIFACT_MAX_PAGE_SIZE = int(os.getenv("ARTIFACT_MAX_PAGE_SIZE", "10"))
+
+# Keys of a run_crew result, and those left out unless selected with `fields`
+RESULT_FIELDS = (
+    "urls", "scraped", "style", "summary", "concise_prompt", "qr_code_url", "qr_verification", "report", "generation_id",
+)
+OMITTED_BY_DEFAULT = ("scraped",)
+
+# Streaming and binary responses that compression middleware must pass through untouched
+UNCOMPRESSED_PATHS = (r"^/jobs/[^/]+/events$", r"^/run-crew/stream$", r"^/batch$", r"^/images/")
+
+
+def parse_fields(fields):
+    """Split a `fields` query value into paths, or None for the default; raises ValueError on unknown keys"""
+    if fields is None or not fields.strip():
+        return None
+    paths = [path.strip() for path in fields.split(",") if path.strip()]
+    if "*" in paths:
+        return ["*"]
+    unknown = sorted({path.split(".")[0] for path in paths} - set(RESULT_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (expected {', '.join(RESULT_FIELDS)} or *)")
+    return paths
+
+
+def shape_result(result, paths=None):
+    """Copy of result restricted to paths (from parse_fields); by default everything but raw page text"""
+    if not isinstance(result, dict):
+        return result
+    if paths is None:
+        return {key: value for key, value in result.items() if key not in OMITTED_BY_DEFAULT}
+    if paths == ["*"]:
+        return result
+    shaped = {}
+    for path in paths:
+        keys = path.split(".")
+        value = result
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = shaped
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return shaped
+
+
+def page_artifacts(result, offset, limit, max_chars=None):
+    """One page of a result's scraped pages, optionally truncated to max_chars each"""
+    pages = (result or {}).get("scraped") or []
+    items = [
+        {"url": page.get("url"), "chars": len(page.get("text") or ""), "text": (page.get("text") or "")[:max_chars]}
+        for page in pages[offset:offset + limit]
+    ]
+    next_offset = offset + limit if offset + limit < len(pages) else None
+    return {"total": len(pages), "offset": offset, "limit": limit, "next_offset": next_offset, "items": items}
+
+
+def add_compression(app):
+    """Compress large responses with brotli or gzip per COMPRESSION; returns the encoding in use"""
+    if COMPRESSION == "off":
+        return "off"
+    if COMPRESSION not in ("auto", "gzip"):
+        raise ValueError(f"Unknown COMPRESSION {COMPRESSION!r} (expected auto, gzip or off)")
+    if COMPRESSION == "auto":
+        try:
+            from brotli_asgi import BrotliMiddleware
+        except ImportError:
+            pass
+        else:
+            app.add_middleware(
+                BrotliMiddleware,
+                minimum_size=COMPRESSION_MIN_BYTES,
+                gzip_fallback=True,
+                excluded_handlers=list(UNCOMPRESSED_PATHS),
+            )
+            return "br"
+    from starlette.middleware.gzip import GZipMiddleware
+
+    # Starlette already skips text/event-stream and image responses
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_BYTES, compresslevel=COMPRESSION_LEVEL)
+    return "gzip"
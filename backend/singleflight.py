@@ -0,0 +1,53 @@
+"""
+Single-flight call deduplication.
+
+When several threads ask for the same key at once, the first one (the leader)
+runs the function and the rest wait for and share its result or exception.
+Nothing is remembered after the call finishes; that is what the caches are
+for. Every group registers itself in `groups` for /cache/stats.
+"""
+import os
+import threading
+from concurrent.futures import Future
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1") == "1"
+
+groups = {}
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {"leaders": 0, "followers": 0}
+        groups[name] = self
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), sharing one execution among concurrent callers with the same key"""
+        if not SINGLEFLIGHT:
+            return fn(*args, **kwargs)
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+                self.counters["leaders"] += 1
+            else:
+                self.counters["followers"] += 1
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+        call.set_result(result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.calls), **self.counters}
@@ -19,5 +19,11 @@ echo "Starting uvicorn server on port $PORT..."
 echo "Press Ctrl+C to stop the server"
 echo "----------------------------------------"
 
-# Start the server
-uvicorn main:app --reload --port $PORT --host 0.0.0.0 
\ No newline at end of file
+# Start the server (--reload only supports a single process)
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    echo "Starting $WORKERS workers (STATE_BACKEND=${STATE_BACKEND:-sqlite})"
+    uvicorn main:app --workers $WORKERS --port $PORT --host 0.0.0.0
+else
+    uvicorn main:app --reload --port $PORT --host 0.0.0.0
+fi 
\ No newline at end of file
@@ -0,0 +1,601 @@
+"""
+Pluggable store for crew job state.
+
+STATE_BACKEND selects where job records, their event logs and the queue of
+pending jobs live:
+
+- "memory": process-local dicts (single worker, the default)
+- "sqlite": a SQLite file shared by every worker on the machine
+- "redis":  any Redis-compatible server at REDIS_URL, shared across machines
+
+Every uvicorn worker runs its own job threads that claim queued jobs from the
+store, so any worker can accept a request, run a job or stream its events.
+A claimed job carries a lease that its worker renews while the job runs; jobs
+whose lease runs out (the worker process died) are requeued or failed by reap().
+Stage summaries change through start_stage()/finish_stage(), which read and
+write the record in one step, since a job's stages can overlap on several threads.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Several workers can't share process memory, so default to the on-disk store for them
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite" if WEB_CONCURRENCY > 1 else "memory")
+STATE_DIR = os.getenv("CACHE_DIR", ".cache")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(STATE_DIR, "state.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "agentqr:")
+
+# Columns of a job record; everything else (task, kwargs, stage, stages, result, error, attempts) is data
+JOB_COLUMNS = ("id", "status", "created_at", "started_at", "finished_at", "worker", "lease_until")
+JOB_SELECT = ", ".join(JOB_COLUMNS) + ", data"
+LOST_WORKER_ERROR = "The worker running this job stopped responding"
+
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """Shared client for REDIS_URL (redis-py is only needed when a Redis backend is selected)"""
+    global _redis
+    with _redis_lock:
+        if _redis is None:
+            import redis
+
+            _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        return _redis
+
+
+def stage_started(job, name, started_at):
+    """Fields that add a started stage to job; new dicts, so a stored record is never edited in place"""
+    stages = [dict(stage) for stage in job["stages"]]
+    stages.append({"name": name, "started_at": started_at, "elapsed_ms": None})
+    return {"stage": name, "stages": stages}
+
+
+def stage_finished(job, name, elapsed_ms):
+    """Fields that set the latest `name` stage's elapsed_ms, or None if it never started"""
+    stages = [dict(stage) for stage in job["stages"]]
+    for stage in reversed(stages):
+        if stage["name"] == name:
+            stage["elapsed_ms"] = elapsed_ms
+            return {"stages": stages}
+    return None
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.events = {}
+        self.queue = deque()
+
+    def create(self, job):
+        """
+        Queue job, unless a queued or running job has the same dedupe_key; returns
+        that job's id in that case (nothing is created), else None. The check and
+        the insert are one atomic step, also across workers for the shared stores.
+        """
+        with self.lock:
+            if job.get("dedupe_key"):
+                for other in self.jobs.values():
+                    if other.get("dedupe_key") == job["dedupe_key"] and other["status"] in ("queued", "running"):
+                        return other["id"]
+            self.jobs[job["id"]] = dict(job)
+            self.events[job["id"]] = []
+            self.queue.append(job["id"])
+        return None
+
+    def claim(self, worker, lease_seconds):
+        """Mark the oldest queued job as running by worker, leased for lease_seconds, and return it, or None"""
+        with self.lock:
+            while self.queue:
+                job = self.jobs.get(self.queue.popleft())
+                if job is not None and job["status"] == "queued":
+                    now = time.time()
+                    job.update(
+                        status="running", started_at=now, worker=worker, lease_until=now + lease_seconds,
+                        attempts=job.get("attempts", 0) + 1,
+                    )
+                    return dict(job)
+            return None
+
+    def renew(self, job_ids, worker, lease_seconds):
+        """Extend the leases of jobs still running on worker"""
+        with self.lock:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is not None and job["status"] == "running" and job["worker"] == worker:
+                    job["lease_until"] = time.time() + lease_seconds
+
+    def reap(self, max_attempts):
+        """Requeue (or fail, after max_attempts) running jobs whose lease expired; returns [(job_id, status)]"""
+        now = time.time()
+        reaped = []
+        with self.lock:
+            for job in self.jobs.values():
+                if job["status"] != "running" or (job.get("lease_until") or now) >= now:
+                    continue
+                if job.get("attempts", 1) < max_attempts:
+                    job.update(status="queued", started_at=None, worker=None, lease_until=None)
+                    self.queue.appendleft(job["id"])
+                else:
+                    job.update(status="failed", finished_at=now, lease_until=None, error=LOST_WORKER_ERROR)
+                reaped.append((job["id"], job["status"]))
+        return reaped
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def find_active(self, dedupe_key):
+        """Id of a queued or running job created with dedupe_key, or None"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.get("dedupe_key") == dedupe_key and job["status"] in ("queued", "running"):
+                    return job["id"]
+        return None
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def finish(self, job_id, worker, **fields):
+        """Like update, but only while worker still holds the job; returns whether it did"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "running" or job["worker"] != worker:
+                return False
+            job.update(fields, lease_until=None)
+            return True
+
+    def start_stage(self, job_id, name, started_at):
+        self._change(job_id, lambda job: stage_started(job, name, started_at))
+
+    def finish_stage(self, job_id, name, elapsed_ms):
+        self._change(job_id, lambda job: stage_finished(job, name, elapsed_ms))
+
+    def _change(self, job_id, change):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            fields = change(job) if job is not None else None
+            if fields:
+                job.update(fields)
+
+    def append_event(self, job_id, event):
+        with self.lock:
+            if job_id in self.events:
+                self.events[job_id].append(event)
+
+    def events_since(self, job_id, index):
+        with self.lock:
+            return list(self.events.get(job_id, [])[index:])
+
+    def counts(self):
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {"queued": statuses.count("queued"), "running": statuses.count("running")}
+
+    def prune(self, cutoff):
+        """Drop jobs that finished before cutoff"""
+        with self.lock:
+            expired = [
+                job_id for job_id, job in self.jobs.items()
+                if job["finished_at"] is not None and job["finished_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
+                self.events.pop(job_id, None)
+
+    def set_value(self, key, value, ttl_seconds):
+        """Small shared key/value entries; only meaningful for stores shared across machines"""
+
+    def get_value(self, key):
+        return None
+
+
+class SQLiteBackend:
+    shared = True
+
+    def __init__(self, path=STATE_DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        # timeout: wait for other workers' write transactions instead of failing
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL,"
+            " started_at REAL, finished_at REAL, worker TEXT, lease_until REAL, data TEXT NOT NULL)"
+        )
+        if "lease_until" not in {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}:
+            try:
+                self.db.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            except sqlite3.OperationalError:
+                # Another worker added it first
+                pass
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        # At most one queued or running job per dedupe key, enforced by SQLite across every worker
+        self.db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON jobs (json_extract(data, '$.dedupe_key'))"
+            " WHERE status IN ('queued', 'running')"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, event TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_job_events ON job_events (job_id, seq)")
+
+    @staticmethod
+    def _row_to_job(row):
+        job = json.loads(row[len(JOB_COLUMNS)])
+        job.update(zip(JOB_COLUMNS, row[:len(JOB_COLUMNS)]))
+        return job
+
+    def create(self, job):
+        data = {key: value for key, value in job.items() if key not in JOB_COLUMNS}
+        with self.lock:
+            inserted = self.db.execute(
+                f"INSERT INTO jobs ({JOB_SELECT}) VALUES ({', '.join('?' * (len(JOB_COLUMNS) + 1))})"
+                " ON CONFLICT DO NOTHING",
+                (*(job.get(column) for column in JOB_COLUMNS), json.dumps(data, default=str)),
+            ).rowcount
+        if inserted:
+            return None
+        # Lost to an identical active job; it can finish in between, so retry if it's already gone
+        return self.find_active(job["dedupe_key"]) or self.create(job)
+
+    def claim(self, worker, lease_seconds):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, worker = ?, lease_until = ?,"
+                " data = json_set(data, '$.attempts', COALESCE(json_extract(data, '$.attempts'), 0) + 1)"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1)"
+                f" AND status = 'queued' RETURNING {JOB_SELECT}",
+                (now, worker, now + lease_seconds),
+            ).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def renew(self, job_ids, worker, lease_seconds):
+        with self.lock:
+            self.db.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                [(time.time() + lease_seconds, job_id, worker) for job_id in job_ids],
+            )
+
+    def reap(self, max_attempts):
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.db.execute(
+                    "SELECT id, COALESCE(json_extract(data, '$.attempts'), 1) FROM jobs"
+                    " WHERE status = 'running' AND lease_until < ?",
+                    (now,),
+                ).fetchall()
+                reaped = []
+                for job_id, attempts in rows:
+                    if attempts < max_attempts:
+                        self.db.execute(
+                            "UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, lease_until = NULL"
+                            " WHERE id = ?",
+                            (job_id,),
+                        )
+                        reaped.append((job_id, "queued"))
+                    else:
+                        self.db.execute(
+                            "UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL,"
+                            " data = json_set(data, '$.error', ?) WHERE id = ?",
+                            (now, LOST_WORKER_ERROR, job_id),
+                        )
+                        reaped.append((job_id, "failed"))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return reaped
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT {JOB_SELECT} FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def find_active(self, dedupe_key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running')"
+                " AND json_extract(data, '$.dedupe_key') = ? ORDER BY created_at LIMIT 1",
+                (dedupe_key,),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def update(self, job_id, **fields):
+        self._update(job_id, None, fields)
+
+    def finish(self, job_id, worker, **fields):
+        return self._update(job_id, worker, {**fields, "lease_until": None})
+
+    def start_stage(self, job_id, name, started_at):
+        self._update(job_id, None, lambda job: stage_started(job, name, started_at))
+
+    def finish_stage(self, job_id, name, elapsed_ms):
+        self._update(job_id, None, lambda job: stage_finished(job, name, elapsed_ms))
+
+    def _update(self, job_id, worker, fields):
+        """
+        Apply fields in one transaction; with worker, only while that worker
+        still runs the job. fields may be a function of the job's data that
+        returns them (or None to leave the job alone).
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT data, status, worker FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None or (worker is not None and (row[1] != "running" or row[2] != worker)):
+                    self.db.execute("ROLLBACK")
+                    return False
+                if callable(fields):
+                    fields = fields(json.loads(row[0]))
+                    if not fields:
+                        self.db.execute("ROLLBACK")
+                        return False
+                columns = {key: value for key, value in fields.items() if key in JOB_COLUMNS}
+                data = {key: value for key, value in fields.items() if key not in JOB_COLUMNS}
+                if data:
+                    columns["data"] = json.dumps({**json.loads(row[0]), **data}, default=str)
+                if columns:
+                    assignments = ", ".join(f"{key} = ?" for key in columns)
+                    self.db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return True
+
+    def append_event(self, job_id, event):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO job_events (job_id, event) VALUES (?, ?)", (job_id, json.dumps(event, default=str))
+            )
+
+    def events_since(self, job_id, index):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT event FROM job_events WHERE job_id = ? ORDER BY seq LIMIT -1 OFFSET ?", (job_id, index)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def counts(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+            ).fetchall()
+        return {"queued": 0, "running": 0, **dict(rows)}
+
+    def prune(self, cutoff):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (cutoff,)
+            )
+            self.db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+
+    def set_value(self, key, value, ttl_seconds):
+        """Every worker on this machine already shares the disk, nothing to record"""
+
+    def get_value(self, key):
+        return None
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, ttl_seconds, prefix=REDIS_PREFIX, client=None):
+        self.ttl_seconds = ttl_seconds
+        self.redis = client or get_redis()
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def create(self, job):
+        import redis
+
+        # Written before the active key is taken, so whoever reads that key finds the record
+        self.redis.set(self._key("job", job["id"]), json.dumps(job, default=str))
+        if job.get("dedupe_key"):
+            active_key = self._key("active", job["dedupe_key"])
+            while not self.redis.set(active_key, job["id"], ex=self.ttl_seconds, nx=True):
+                active_id = self.find_active(job["dedupe_key"])
+                if active_id is not None:
+                    self.redis.delete(self._key("job", job["id"]))
+                    return active_id
+                # The key points at a finished job: clear it (unless someone else just did) and try again
+                with self.redis.pipeline() as pipe:
+                    try:
+                        pipe.watch(active_key)
+                        stale_id = pipe.get(active_key)
+                        pipe.multi()
+                        if stale_id is not None and self.find_active(job["dedupe_key"]) is None:
+                            pipe.delete(active_key)
+                        pipe.execute()
+                    except redis.WatchError:
+                        pass
+        self.redis.rpush(self._key("queue"), job["id"])
+        return None
+
+    def _transact(self, job_id, change, watch=()):
+        """
+        Read-modify-write a job under WATCH, retrying if another worker changes
+        it meanwhile. change(job, pipe) edits job in place and queues any extra
+        commands on pipe, or returns False to leave the job alone. Returns the
+        written job, or None.
+        """
+        import redis
+
+        key = self._key("job", job_id)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key, *watch)
+                    raw = pipe.get(key)
+                    if raw is None:
+                        return None
+                    job = json.loads(raw)
+                    was_finished = job["finished_at"] is not None
+                    pipe.multi()
+                    if change(job, pipe) is False:
+                        pipe.reset()
+                        return None
+                    pipe.set(key, json.dumps(job, default=str))
+                    if job["finished_at"] is not None and not was_finished:
+                        # Finished jobs are dropped by Redis itself after the TTL
+                        pipe.srem(self._key("running"), job_id)
+                        pipe.delete(self._key("lease", job_id))
+                        if job.get("dedupe_key"):
+                            pipe.delete(self._key("active", job["dedupe_key"]))
+                        pipe.expire(key, self.ttl_seconds)
+                        pipe.expire(self._key("events", job_id), self.ttl_seconds)
+                    pipe.execute()
+                    return job
+                except redis.WatchError:
+                    continue
+
+    def claim(self, worker, lease_seconds):
+        def start(job, pipe):
+            if job["status"] != "queued":
+                return False
+            job.update(status="running", started_at=time.time(), worker=worker, attempts=job.get("attempts", 0) + 1)
+            pipe.sadd(self._key("running"), job["id"])
+            # The lease is its own key so renewals never rewrite the job record
+            pipe.set(self._key("lease", job["id"]), worker, ex=max(1, round(lease_seconds)))
+
+        while True:
+            job_id = self.redis.lpop(self._key("queue"))
+            if job_id is None:
+                return None
+            job = self._transact(job_id, start)
+            if job is not None:
+                return job
+
+    def renew(self, job_ids, worker, lease_seconds):
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            # xx: a lease that already expired stays expired; the job may have been requeued
+            pipe.set(self._key("lease", job_id), worker, ex=max(1, round(lease_seconds)), xx=True)
+        pipe.execute()
+
+    def reap(self, max_attempts):
+        reaped = []
+        for job_id in self.redis.smembers(self._key("running")):
+            lease_key = self._key("lease", job_id)
+            if self.redis.exists(lease_key):
+                continue
+
+            def expire(job, pipe):
+                if job["status"] != "running":
+                    pipe.srem(self._key("running"), job["id"])
+                    return
+                if job.get("attempts", 1) < max_attempts:
+                    job.update(status="queued", started_at=None, worker=None)
+                    pipe.srem(self._key("running"), job["id"])
+                    pipe.lpush(self._key("queue"), job["id"])
+                else:
+                    job.update(status="failed", finished_at=time.time(), error=LOST_WORKER_ERROR)
+
+            job = self._transact(job_id, expire, watch=(lease_key,))
+            if job is None:
+                self.redis.srem(self._key("running"), job_id)
+            elif job["status"] in ("queued", "failed"):
+                reaped.append((job_id, job["status"]))
+        return reaped
+
+    def get(self, job_id):
+        raw = self.redis.get(self._key("job", job_id))
+        return json.loads(raw) if raw is not None else None
+
+    def find_active(self, dedupe_key):
+        job_id = self.redis.get(self._key("active", dedupe_key))
+        job = self.get(job_id) if job_id else None
+        return job_id if job is not None and job["status"] in ("queued", "running") else None
+
+    def update(self, job_id, **fields):
+        self._transact(job_id, lambda job, pipe: job.update(fields))
+
+    def finish(self, job_id, worker, **fields):
+        def apply(job, pipe):
+            if job["status"] != "running" or job["worker"] != worker:
+                return False
+            job.update(fields)
+
+        return self._transact(job_id, apply) is not None
+
+    def start_stage(self, job_id, name, started_at):
+        self._transact(job_id, lambda job, pipe: job.update(stage_started(job, name, started_at)))
+
+    def finish_stage(self, job_id, name, elapsed_ms):
+        def apply(job, pipe):
+            fields = stage_finished(job, name, elapsed_ms)
+            if fields is None:
+                return False
+            job.update(fields)
+
+        self._transact(job_id, apply)
+
+    def append_event(self, job_id, event):
+        self.redis.rpush(self._key("events", job_id), json.dumps(event, default=str))
+
+    def events_since(self, job_id, index):
+        return [json.loads(raw) for raw in self.redis.lrange(self._key("events", job_id), index, -1)]
+
+    def counts(self):
+        return {"queued": self.redis.llen(self._key("queue")), "running": self.redis.scard(self._key("running"))}
+
+    def prune(self, cutoff):
+        """Finished jobs already expire on their own"""
+
+    def set_value(self, key, value, ttl_seconds):
+        self.redis.set(self._key("kv", key), value, ex=ttl_seconds)
+
+    def get_value(self, key):
+        return self.redis.get(self._key("kv", key))
+
+
+def create_backend(name, ttl_seconds):
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        return RedisBackend(ttl_seconds)
+    if name != "memory":
+        raise ValueError(f"Unknown STATE_BACKEND {name!r} (expected memory, sqlite or redis)")
+    return MemoryBackend()
+
+
+@contextlib.contextmanager
+def process_lock(name):
+    """Exclusive lock across the worker processes on this machine (no-op where flock is unavailable)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(os.path.join(STATE_DIR, f"{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,106 @@
+"""
+Single-pass style analysis of scraped brand pages.
+
+Every descriptor keyword is folded into one trie-shaped regex together with
+the hex color pattern, so each page is scanned exactly once regardless of how
+many categories there are. Keywords match at the start of a word ("minimal"
+matches "minimalist"). Results are weighted frequencies rather than
+first-found lists, so a style mentioned throughout a site outranks one that
+appears once in a footer.
+"""
+import re
+from collections import Counter
+
+DESCRIPTOR_KEYWORDS = {
+    "minimalist":   ["minimal", "clean", "simple", "uncluttered"],
+    "modern":       ["modern", "contemporary", "sleek", "cutting-edge"],
+    "elegant":      ["elegant", "refined", "sophisticated", "polished"],
+    "bold":         ["bold", "strong", "impactful", "striking"],
+    "friendly":     ["friendly", "warm", "inviting", "approachable"],
+    "professional": ["professional", "business", "corporate", "formal"],
+    "innovative":   ["innovative", "creative", "forward-thinking", "fresh"],
+    "dynamic":      ["dynamic", "energetic", "vibrant", "lively"],
+    "premium":      ["premium", "luxury", "high-end", "exclusive"],
+    "playful":      ["playful", "fun", "casual", "relaxed"],
+    "geometric":    ["geometric", "angular", "sharp"],
+    "organic":      ["organic", "flowing", "curved"],
+    "dimensional":  ["gradient", "shadow", "depth"],
+}
+MAX_KEYWORDS = 6
+MAX_COLORS = 8
+
+KEYWORD_CATEGORY = {keyword: category for category, keywords in DESCRIPTOR_KEYWORDS.items() for keyword in keywords}
+
+
+def trie_pattern(words):
+    """Regex alternation factored by common prefixes, so the engine never backtracks across siblings"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        ends = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 and not ends else "(?:" + "|".join(branches) + ")"
+        return f"{body}?" if ends else body
+
+    return build(trie)
+
+
+# One pass finds both hex colors and word-initial keywords; run on lowercased text
+# (cheaper than IGNORECASE) with a lookbehind instead of \b, which re checks faster
+STYLE_PATTERN = re.compile(
+    r"(?<![\w#])(?:#([0-9a-f]{6}|[0-9a-f]{3})\b|(" + trie_pattern(KEYWORD_CATEGORY) + "))"
+)
+
+
+def normalize_color(hex_digits):
+    """'#abc' and '#aabbcc' count as the same color"""
+    if len(hex_digits) == 3:
+        hex_digits = "".join(c * 2 for c in hex_digits)
+    return f"#{hex_digits}"
+
+
+def analyze_text(text):
+    """Raw (category counts, color counts) for one text"""
+    categories = Counter()
+    colors = Counter()
+    for (color, keyword), count in Counter(STYLE_PATTERN.findall(text.lower())).items():
+        if keyword:
+            categories[KEYWORD_CATEGORY[keyword]] += count
+        else:
+            colors[normalize_color(color)] += count
+    return categories, colors
+
+
+def weighted(counts):
+    """Counts -> shares of the total, highest first"""
+    total = sum(counts.values())
+    return {key: round(count / total, 4) for key, count in counts.most_common()} if total else {}
+
+
+def analyze_pages(pages):
+    """
+    Style profile of scraped pages ([{"url", "text", "summary"?}]). Returns
+    style_keywords / color_palette (top categories and colors by weight) plus
+    the full style_scores / color_scores.
+    """
+    categories = Counter()
+    colors = Counter()
+    for page in pages:
+        page_categories, page_colors = analyze_text(page.get("text", "") + " " + page.get("summary", ""))
+        categories.update(page_categories)
+        colors.update(page_colors)
+    style_scores = weighted(categories)
+    color_scores = weighted(colors)
+    return {
+        "style_keywords": list(style_scores)[:MAX_KEYWORDS],
+        "color_palette": list(color_scores)[:MAX_COLORS],
+        "style_scores": style_scores,
+        "color_scores": color_scores,
+    }
@@ -0,0 +1,98 @@
+"""
+Bounded, batched trace ingestion.
+
+/trace only enqueues events; a background task flushes them to the sink in
+batches of TRACE_BATCH_SIZE or every TRACE_FLUSH_INTERVAL seconds, whichever
+comes first. When the queue is full new events are dropped and counted.
+"""
+import asyncio
+import os
+import time
+
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "2000"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "100"))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2.0"))
+
+
+class TraceQueue:
+    def __init__(self, sink, max_size=TRACE_QUEUE_SIZE, batch_size=TRACE_BATCH_SIZE, flush_interval=TRACE_FLUSH_INTERVAL):
+        self.sink = sink
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = None
+        self.task = None
+        self.counters = {"received": 0, "dropped": 0, "flushed": 0, "batches": 0, "flush_errors": 0}
+        self.last_flush_at = None
+        self.pending = []
+
+    def start(self):
+        """Create the queue and flusher task (must be called from the running loop)"""
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and flush anything still queued"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # Include the batch the flusher was still collecting when it was cancelled
+        batch, self.pending = self.pending, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+
+    def put_many(self, events):
+        """Enqueue without blocking; returns (accepted, dropped)"""
+        accepted = dropped = 0
+        for event in events:
+            self.counters["received"] += 1
+            try:
+                self.queue.put_nowait(event)
+                accepted += 1
+            except asyncio.QueueFull:
+                dropped += 1
+        self.counters["dropped"] += dropped
+        return accepted, dropped
+
+    async def _run(self):
+        while True:
+            self.pending.append(await self.queue.get())
+            deadline = time.monotonic() + self.flush_interval
+            while len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self.pending.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch, self.pending = self.pending, []
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        try:
+            # The sink (wandb.log) does network I/O, keep it off the event loop
+            await asyncio.to_thread(self.sink, batch)
+            self.counters["flushed"] += len(batch)
+            self.counters["batches"] += 1
+            self.last_flush_at = time.time()
+        except Exception as e:
+            self.counters["flush_errors"] += 1
+            print(f"⚠️ Failed to flush {len(batch)} trace events: {e}")
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "last_flush_at": self.last_flush_at,
+            **self.counters,
+        }
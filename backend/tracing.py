@@ -0,0 +1,31 @@
+"""
+Weave span helpers.
+
+`traced` turns a function into a weave.op on first call, so modules can mark
+their hot paths without importing weave at module load. Calls made before
+weave has been imported (it is loaded in the background at startup) run
+untraced rather than paying the import on the request path, and calls made
+before weave.init are simply not recorded.
+"""
+import functools
+import sys
+
+
+def traced(fn):
+    op = None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        nonlocal op
+        if op is None:
+            if "weave" not in sys.modules:
+                return fn(*args, **kwargs)
+            try:
+                import weave
+                op = weave.op()(fn)
+            except Exception as e:
+                print(f"⚠️ Weave tracing unavailable for {fn.__name__}: {e}")
+                op = fn
+        return op(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,221 @@
+"""
+CrewAI LLM adapter for W&B Inference (OpenAI-compatible completions).
+
+Lives apart from crew_runner because crewai and openai take seconds to import;
+crew_runner only imports this when the crew runtime is first built.
+
+Completions can be memoized (LLM_CACHE): "exact" keys on the formatted prompt
+as sent, "normalized" ignores case and whitespace differences in it. Both also
+key on model, max_tokens and temperature.
+
+call() streams when given on_token or first_line: tokens are passed on as they
+arrive, and first_line stops reading once the first line is complete.
+"""
+import hashlib
+import os
+import time
+from crewai import BaseLLM
+from openai import OpenAI
+from cache import TTLCache, normalize_text, CACHE_STALE_SECONDS
+from resilience import Policy, check_cancelled
+from metrics import LLM_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, timed
+from singleflight import SingleFlight
+from tracing import traced
+
+LLM_CACHE_MODES = ("off", "exact", "normalized")
+LLM_CACHE = os.getenv("LLM_CACHE", "off")
+if LLM_CACHE not in LLM_CACHE_MODES:
+    raise ValueError(f"Unknown LLM_CACHE {LLM_CACHE!r} (expected off, exact or normalized)")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_DISK_ITEMS = int(os.getenv("LLM_CACHE_DISK_ITEMS", "2000"))
+# Sampling defaults for calls that don't pass their own (CrewAI agents)
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+# Stream calls that ask for tokens or only the first line; "0" always makes blocking calls
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+# Per-attempt timeout; retries, hedging and the overall deadline come from the policy
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+INFERENCE_DEADLINE = float(os.getenv("INFERENCE_DEADLINE", "60"))
+INFERENCE_RETRIES = int(os.getenv("INFERENCE_RETRIES", "2"))
+INFERENCE_HEDGE = os.getenv("INFERENCE_HEDGE", "1") == "1"
+
+# Identical concurrent completions (same model, prompt and sampling parameters) share one call
+llm_flight = SingleFlight("llm_completions")
+completion_cache = TTLCache(
+    "llm_completions", LLM_CACHE_TTL, disk_items=LLM_CACHE_DISK_ITEMS, stale_seconds=CACHE_STALE_SECONDS
+)
+inference_policy = Policy("inference", INFERENCE_DEADLINE, retries=INFERENCE_RETRIES, hedge=INFERENCE_HEDGE)
+
+
+def completion_key(model, formatted_prompt, max_tokens, temperature, first_line=False, mode=LLM_CACHE):
+    """Cache / single-flight key for one completion request"""
+    prompt = normalize_text(formatted_prompt) if mode == "normalized" else formatted_prompt
+    scope = "|first_line" if first_line else ""
+    return hashlib.sha256(f"{model}|{max_tokens}|{temperature}{scope}|{prompt}".encode("utf-8")).hexdigest()
+
+
+class WandbOpenAILLM(BaseLLM):
+    def __init__(self, model, api_key, base_url, project):
+        # One OpenAI client (and connection pool) shared by every request
+        self.client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            project=project,
+            timeout=INFERENCE_TIMEOUT,
+            # inference_policy retries instead
+            max_retries=0,
+        )
+        self.model = model
+
+    def call(self, prompt: str, temperature: float = None, max_tokens: int = None, on_token=None, first_line: bool = False, **kwargs) -> str:
+        """
+        Complete prompt (a string or chat messages). on_token(delta, offset) is
+        called as text streams in; offset is where delta starts in the
+        completion, and goes back to 0 if a failed attempt is retried.
+        """
+        try:
+            if isinstance(prompt, list):
+                prompt_str = ""
+                for msg in prompt:
+                    role = msg.get("role", "user").capitalize()
+                    content = msg.get("content", "")
+                    prompt_str += f"{role}: {content}\n"
+            else:
+                prompt_str = prompt
+
+            formatted_prompt = f"### Instruction:\n{prompt_str.strip()}\n\n### Response:\n"
+
+            temperature = LLM_TEMPERATURE if temperature is None else temperature
+            max_tokens = LLM_MAX_TOKENS if max_tokens is None else max_tokens
+            if LLM_STREAM and (on_token is not None or first_line):
+                return self.complete_streaming(formatted_prompt, max_tokens, temperature, on_token=on_token, first_line=first_line)["text"]
+            return self.complete(formatted_prompt, max_tokens=max_tokens, temperature=temperature)["text"]
+        except Exception as e:
+            print("❌ [ERROR] Wandb LLM call failed:", e)
+            raise
+
+    @traced
+    def complete(self, formatted_prompt: str, max_tokens: int, temperature: float) -> dict:
+        """
+        One completion call; returns the text plus token usage for the trace and
+        /metrics, and "cache" ("hit", "miss" or "off") so hits show up in Weave.
+        """
+        key = completion_key(self.model, formatted_prompt, max_tokens, temperature)
+        caching = LLM_CACHE != "off"
+        if caching:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                # Nothing was sent, so a hit costs no tokens
+                return {**cached, "usage": {}, "cache": "hit"}
+        result = llm_flight.do(key, self._complete, formatted_prompt, max_tokens, temperature, key if caching else None)
+        return {**result, "cache": "miss" if caching else "off"}
+
+    @traced
+    def complete_streaming(self, formatted_prompt: str, max_tokens: int, temperature: float, on_token=None, first_line: bool = False) -> dict:
+        """
+        Streamed completion call; same result as complete(). Not shared with
+        concurrent identical calls (each caller wants its own tokens) or hedged.
+        """
+        key = completion_key(self.model, formatted_prompt, max_tokens, temperature, first_line=first_line)
+        caching = LLM_CACHE != "off"
+        if caching:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                if on_token:
+                    on_token(cached["text"], 0)
+                return {**cached, "usage": {}, "cache": "hit"}
+        result = inference_policy.call(
+            self._stream_request, formatted_prompt, max_tokens, temperature, on_token, first_line,
+            key if caching else None, stale=self._stale(key if caching else None), hedge=False,
+        )
+        return {**result, "cache": "miss" if caching else "off"}
+
+    def _complete(self, formatted_prompt, max_tokens, temperature, cache_key=None):
+        """Run the request under inference_policy, falling back to an expired cached completion"""
+        return inference_policy.call(
+            self._request, formatted_prompt, max_tokens, temperature, cache_key, stale=self._stale(cache_key)
+        )
+
+    @staticmethod
+    def _stale(cache_key):
+        """Policy fallback serving an expired cached completion, or None without a cache key"""
+        if cache_key is None:
+            return None
+
+        def stale():
+            cached = completion_cache.get_stale(cache_key)
+            return {**cached, "usage": {}, "stale": True} if cached is not None else None
+
+        return stale
+
+    def _request(self, formatted_prompt, max_tokens, temperature, cache_key):
+        """The inference request itself; stores the completion under cache_key when given"""
+        with timed(LLM_SECONDS, model=self.model):
+            response = self.client.completions.create(
+                model=self.model,
+                prompt=formatted_prompt,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        usage = {}
+        if response.usage is not None:
+            usage = {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+            }
+            LLM_TOKENS.inc(usage["prompt_tokens"], model=self.model, kind="prompt")
+            LLM_TOKENS.inc(usage["completion_tokens"], model=self.model, kind="completion")
+        result = {"text": response.choices[0].text.strip(), "usage": usage}
+        if cache_key is not None and result["text"]:
+            completion_cache.set(cache_key, result)
+        return result
+
+    def _stream_request(self, formatted_prompt, max_tokens, temperature, on_token, first_line, cache_key):
+        """The streamed inference request; with first_line, closes the stream after the first complete line"""
+        start = time.monotonic()
+        text = ""
+        chunks = 0
+        usage = {}
+        with timed(LLM_SECONDS, model=self.model):
+            stream = self.client.completions.create(
+                model=self.model,
+                prompt=formatted_prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                for chunk in stream:
+                    # The caller gave up on this attempt: stop paying for tokens nobody will see
+                    check_cancelled()
+                    if chunk.usage is not None:
+                        usage = {
+                            "prompt_tokens": chunk.usage.prompt_tokens,
+                            "completion_tokens": chunk.usage.completion_tokens,
+                        }
+                    delta = chunk.choices[0].text if chunk.choices else ""
+                    if not delta:
+                        continue
+                    if chunks == 0:
+                        LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - start, model=self.model)
+                    chunks += 1
+                    if on_token:
+                        on_token(delta, len(text))
+                    text += delta
+                    if first_line and "\n" in text.lstrip():
+                        # Everything after the first line is thrown away; stop generating it
+                        break
+            finally:
+                stream.close()
+        if not usage:
+            # Closed before the usage chunk: each streamed chunk carries one token
+            usage = {"completion_tokens": chunks}
+        for kind in ("prompt", "completion"):
+            if f"{kind}_tokens" in usage:
+                LLM_TOKENS.inc(usage[f"{kind}_tokens"], model=self.model, kind=kind)
+        text = text.strip()
+        result = {"text": text.split("\n")[0] if first_line else text, "usage": usage}
+        if cache_key is not None and result["text"]:
+            completion_cache.set(cache_key, result)
+        return result
@@ -1,6 +1,12 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Palette, QrCode, Bot, Zap, Search, Image, Download, Trophy, Cloud, Globe, Cpu, Database, Monitor, Rocket, Play, Code, Eye, CheckCircle } from 'lucide-react';
 
+// Trace events are batched client-side: flushed every TRACE_FLUSH_MS or at TRACE_BATCH_SIZE events
+const TRACE_FLUSH_MS = 2000;
+const TRACE_BATCH_SIZE = 25;
+// Only the parts of a crew result the UI shows; raw research is at /jobs/{id}/artifacts
+const RESULT_FIELDS = 'summary,concise_prompt,qr_code_url,report';
+
 const ArtisticQRGenerator = () => {
   const [qrData, setQrData] = useState('behnamshahbazi.com/qrwe');
   const [artStyle, setArtStyle] = useState('nature');
@@ -15,6 +21,9 @@ const ArtisticQRGenerator = () => {
   const [crewResult, setCrewResult] = useState(null);
   const [error, setError] = useState(null);
   const canvasRef = useRef(null);
+  const traceBuffer = useRef([]);
+  const traceTimer = useRef(null);
+  const streamedText = useRef({});
 
   // Environment detection for backend URL
   const getBackendUrl = () => {
@@ -28,6 +37,9 @@ const ArtisticQRGenerator = () => {
 
   const backendUrl = getBackendUrl();
 
+  // Cached images are served by the backend under a relative /images/... path
+  const resolveImageUrl = (url) => (url && url.startsWith('/') ? `${backendUrl}${url}` : url);
+
   // Real agent configurations
   const agentConfig = {
     styleResearcher: {
@@ -56,28 +68,50 @@ const ArtisticQRGenerator = () => {
     }
   };
 
-  const addLog = (agent, message, type = 'info') => {
+  const addLog = (agent, message, type = 'info', duration = null) => {
     const timestamp = new Date().toLocaleTimeString();
     const logEvent = { agent, message, type, timestamp };
     setAgentLogs(prev => [...prev, logEvent]);
     
-    // Add to Weave trace
+    // Add to Weave trace (duration is only known for real backend stages)
     setWeaveTrace(prev => [...prev, {
       span_id: `span_${Date.now()}`,
       agent,
       operation: message,
       timestamp,
-      duration: Math.random() * 2000 + 500
+      duration
     }]);
 
-    // Send log event to backend for Weave logging
+    // Queue the event for the backend; it is sent in batches rather than one request per line
+    traceBuffer.current.push(logEvent);
+    if (traceBuffer.current.length >= TRACE_BATCH_SIZE) {
+      flushTraces();
+    } else if (!traceTimer.current) {
+      traceTimer.current = setTimeout(flushTraces, TRACE_FLUSH_MS);
+    }
+  };
+
+  // Send buffered log events to the backend for Weave logging as one array
+  const flushTraces = () => {
+    clearTimeout(traceTimer.current);
+    traceTimer.current = null;
+    const events = traceBuffer.current;
+    if (events.length === 0) return;
+    traceBuffer.current = [];
     fetch(`${backendUrl}/trace`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(logEvent),
+      body: JSON.stringify(events),
+      keepalive: true,
     }).catch(() => {/* ignore errors for now */});
   };
 
+  // Flush whatever is left when the page is closed
+  useEffect(() => {
+    window.addEventListener('pagehide', flushTraces);
+    return () => window.removeEventListener('pagehide', flushTraces);
+  }, []);
+
   const addProtocolMessage = (from, to, message) => {
     setProtocolMessages(prev => [...prev, {
       id: Date.now(),
@@ -299,6 +333,7 @@ const ArtisticQRGenerator = () => {
       addLog('System', `Error: ${error.message}`, 'error');
     } finally {
       setIsGenerating(false);
+      flushTraces();
     }
   };
 
@@ -313,49 +348,132 @@ const ArtisticQRGenerator = () => {
     }
   };
 
+  // Human-readable names for the backend pipeline stages streamed over SSE
+  const stageLabels = {
+    init: 'Weave Init',
+    crew_kickoff: 'Crew AI',
+    exa_search: 'Exa Search',
+    scrape: 'BrowserBase',
+    scrape_url: 'BrowserBase',
+    extract_style: 'Style Extractor',
+    summarize_brand: 'Brand Analyst',
+    make_qr_prompt: 'Prompt Engineer',
+    generate_qr_art: 'Replicate',
+    replicate_prediction: 'Replicate',
+    qr_verify: 'QR Verifier',
+    write_report: 'Report Writer'
+  };
+
+  const handleStageEvent = (event) => {
+    const agent = stageLabels[event.stage] || event.stage;
+    if (event.stage === 'scrape_url' && event.status === 'failed') {
+      addLog(agent, `Could not scrape ${event.url}: ${event.error}`, 'error', event.elapsed_ms);
+    } else if (event.stage === 'scrape_url') {
+      addLog(agent, `Scraped ${event.url} (${event.chars} chars)`, 'automation', event.elapsed_ms);
+    } else if (event.stage === 'replicate_prediction') {
+      addLog(agent, `Prediction ${event.status}`, 'ai');
+    } else if (event.stage === 'qr_verify') {
+      const score = event.score === null ? 'not checked' : `robustness ${Math.round(event.score * 100)}%`;
+      addLog(agent, `Variant ${event.status} (${score}, conditioning ${event.conditioning_scale})`, event.status === 'failed' ? 'error' : 'validation');
+    } else if (event.status === 'started') {
+      addLog(agent, `Started ${event.stage}`, 'agent');
+    } else if (event.status === 'failed') {
+      addLog(agent, `Failed ${event.stage}: ${event.error}`, 'error', event.elapsed_ms);
+    } else {
+      addLog(agent, `Completed ${event.stage}`, 'success', event.elapsed_ms);
+      // Show partial results as soon as they are available
+      const data = event.data || {};
+      if (data.summary) {
+        setCrewResult(data.summary);
+      }
+      if (data.concise_prompt) {
+        addLog(agent, `Prompt: ${data.concise_prompt}`, 'ai');
+        setGeneratedQR(prev => ({ ...(prev || {}), prompt: data.concise_prompt }));
+      }
+      if (data.qr_code_url) {
+        setGeneratedQR(prev => ({ ...(prev || {}), image: resolveImageUrl(data.qr_code_url) }));
+      }
+    }
+  };
+
+  // Streamed summary/report text; offset lets a retried LLM call start over
+  const handleTokenEvent = (event) => {
+    const text = (streamedText.current[event.stage] || '').slice(0, event.offset) + event.text;
+    streamedText.current[event.stage] = text;
+    setCrewResult(text);
+  };
+
+  const showCrewResult = (result) => {
+    let resultText = '';
+    if (result && typeof result === 'object') {
+      if (typeof result.report === 'string') {
+        resultText = result.report;
+      } else if (result.raw) {
+        resultText = result.raw;
+      } else if (result.tasks_output) {
+        resultText = JSON.stringify(result.tasks_output, null, 2);
+      } else {
+        resultText = JSON.stringify(result, null, 2);
+      }
+    } else if (typeof result === 'string') {
+      resultText = result;
+    } else {
+      resultText = 'No result data available';
+    }
+    setCrewResult(resultText);
+    if (result && typeof result === 'object') {
+      const qrImageUrl = result.qr_code_url || result.image_url;
+      const qrPrompt = result.concise_prompt || result.prompt;
+      if (qrImageUrl) {
+        setGeneratedQR({ image: resolveImageUrl(qrImageUrl), prompt: qrPrompt });
+      }
+    }
+  };
+
   const runCrewWorkflow = async () => {
     setIsGenerating(true);
     setError(null);
+    setGeneratedQR(null);
+    setCrewResult(null);
+    streamedText.current = {};
     try {
       addLog('Crew AI', `Running Crew workflow for topic: ${crewTopic}`, 'system');
-      const res = await fetch(`${backendUrl}/run-crew`, {
+      const res = await fetch(`${backendUrl}/jobs`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ topic: crewTopic }),
+        body: JSON.stringify({ topic: crewTopic, qr_data: qrData }),
       });
-      const data = await res.json();
-      console.log('Backend response:', data); // <-- Add this line for debugging
-      let resultText = '';
-      if (data.result && typeof data.result === 'object') {
-        if (data.result.raw) {
-          resultText = data.result.raw;
-        } else if (data.result.tasks_output) {
-          resultText = JSON.stringify(data.result.tasks_output, null, 2);
-        } else {
-          resultText = JSON.stringify(data.result, null, 2);
-        }
-      } else if (typeof data.result === 'string') {
-        resultText = data.result;
-      } else {
-        resultText = 'No result data available';
-      }
-      setCrewResult(resultText);
-      // Fix: Look for qr_code_url/image_url and prompt inside data.result if not found at top level
-      let qrImageUrl = data.qr_code_url || data.image_url;
-      let qrPrompt = data.qr_prompt || data.prompt;
-      if ((!qrImageUrl || !qrPrompt) && data.result && typeof data.result === 'object') {
-        qrImageUrl = qrImageUrl || data.result.qr_code_url || data.result.image_url;
-        qrPrompt = qrPrompt || data.result.concise_prompt || data.result.prompt;
+      if (!res.ok) {
+        throw new Error(`Backend returned ${res.status}`);
       }
-      if (qrImageUrl) {
-        setGeneratedQR({ image: qrImageUrl, prompt: qrPrompt });
+      const { job_id: jobId } = await res.json();
+
+      // Stream real pipeline stages from the backend
+      const done = await new Promise((resolve, reject) => {
+        const source = new EventSource(`${backendUrl}/jobs/${jobId}/events?fields=${RESULT_FIELDS}`);
+        source.addEventListener('stage', (e) => handleStageEvent(JSON.parse(e.data)));
+        source.addEventListener('token', (e) => handleTokenEvent(JSON.parse(e.data)));
+        source.addEventListener('done', (e) => {
+          source.close();
+          resolve(JSON.parse(e.data));
+        });
+        source.onerror = () => {
+          source.close();
+          reject(new Error('Lost connection to backend event stream'));
+        };
+      });
+      if (done.status !== 'completed') {
+        throw new Error(done.error || 'Crew workflow failed');
       }
+      console.log('Backend response:', done);
+      showCrewResult(done.result);
       addLog('Crew AI', 'Crew workflow completed successfully', 'success');
     } catch (e) {
       setError('Failed to run Crew workflow. Please try again.');
       addLog('Crew AI', 'Failed to run Crew workflow', 'error');
     } finally {
       setIsGenerating(false);
+      flushTraces();
     }
   };
 
@@ -598,7 +716,9 @@ const ArtisticQRGenerator = () => {
                 <div key={index} className="p-2 bg-gray-700 rounded">
                   <div className="font-mono text-orange-400">{trace.span_id}</div>
                   <div className="text-gray-300">{trace.agent}: {trace.operation}</div>
-                  <div className="text-gray-500">{trace.duration.toFixed(0)}ms</div>
+                  {trace.duration != null && (
+                    <div className="text-gray-500">{trace.duration.toFixed(0)}ms</div>
+                  )}
                 </div>
               ))}
             </div>